@@ -0,0 +1,58 @@
+#! /usr/bin/env python3
+"""
+Times the printer's default colour stage over typical plugin output: the
+old regex passes, the old passes followed by util.text.minify, and
+util.text.colourise with and without its cache.
+
+Run from the repository root: python3 -m benchmarks.bench_colour
+"""
+
+import re
+import time
+
+from util.text import colourise, minify, namedtable
+
+ROUNDS = 200
+
+# Lines shaped like those the plugins print.
+SAMPLES = [
+    "\x0312Google\x03⎟ Karkat - An IRC bot \x0312⎟\x03 https://github.com/svkampen/Karkat",
+    "\x0306Last.FM\x03⎟ user is now playing \x0302Artist\x03 · Song Title \x0306⎟\x03 \x0304♥\x03 15 plays",
+    "\x0306│\x03 Weather for Sydney \x0306│\x03 \x0223°C\x02 \x0315Partly cloudy\x03",
+    "\x02Definition:\x02 \x1fword\x1f (noun) a single distinct meaningful element",
+    "\x0f\x0305,01 ERROR \x0f Something \x02went\x02 wrong\x0f\x0f",
+    "plain text reply with no formatting at all, which is the common case",
+] + namedtable(["\x0312item%d\x03" % i for i in range(40)], size=80)
+
+
+def old_defaultcolor(line, color="14"):
+    """ The regex passes ColourPrinter used before colourise. """
+    line = re.sub(r"\x03([^\d])",
+                  lambda x: (("\x03%s" % (color)) + (x.group(1) or "")),
+                  line)
+    line = line.replace("\x0f", "\x0f\x03%s" % (color))
+    line = line.replace("\x0f\x03%s\x0f\x03%s" % (color, color), "\x0f")
+    return "\x03%s%s" % (color, line)
+
+
+def bench(name, funct):
+    start = time.time()
+    for _ in range(ROUNDS):
+        for line in SAMPLES:
+            funct(line)
+    elapsed = time.time() - start
+    size = sum(len(funct(i).encode("utf-8")) for i in SAMPLES)
+    print("%-20s %8.2fµs/line  %5d bytes" % (
+        name, elapsed / (ROUNDS * len(SAMPLES)) * 1e6, size
+    ))
+
+
+def main():
+    bench("old", old_defaultcolor)
+    bench("old + minify", lambda line: minify(old_defaultcolor(line)))
+    bench("colourise", lambda line: colourise.__wrapped__(line, 14))
+    bench("colourise (cached)", lambda line: colourise(line, 14))
+
+
+if __name__ == "__main__":
+    main()
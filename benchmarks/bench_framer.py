@@ -0,0 +1,97 @@
+#! /usr/bin/env python3
+"""
+Replays a 50k line burst against util.text.Buffer and util.text.LineFramer.
+
+Run from the repository root: python3 -m benchmarks.bench_framer
+"""
+
+import time
+
+from util.text import Buffer, LineFramer
+
+LINES = 50000
+
+
+class BurstSocket(object):
+    """ A socket whose receive queue holds an entire burst. """
+    def __init__(self, data):
+        self.data = memoryview(data)
+
+    def recv(self, size):
+        chunk, self.data = self.data[:size], self.data[size:]
+        return bytes(chunk)
+
+    def recv_into(self, buffer):
+        size = min(len(buffer), len(self.data))
+        buffer[:size] = self.data[:size]
+        self.data = self.data[size:]
+        return size
+
+
+def burst(lines=LINES):
+    """ A NAMES/WHO-style burst, as it would arrive after a netjoin. """
+    return "".join(
+        ":irc.example.net 352 Karkat #channel ~user%d host-%d.example.com "
+        "irc.example.net nick%d H@ :0 Real Name\r\n" % (i, i, i)
+        for i in range(lines)
+    ).encode("utf-8")
+
+
+def buffer_recv(data):
+    """ The old receive path: recv(1024) into Buffer. """
+    sock, buff, count = BurstSocket(data), Buffer(), 0
+    while buff.append(sock.recv(1024)):
+        for _ in buff:
+            count += 1
+    return count
+
+
+def buffer_append(data):
+    """ Buffer holding an entire pending burst. """
+    buff, count = Buffer(), 0
+    buff.append(data)
+    for _ in buff:
+        count += 1
+    return count
+
+
+def framer_recv(data):
+    """ The new receive path: recv_into the framer's buffer. """
+    sock, buff, count = BurstSocket(data), LineFramer(), 0
+    while buff.recv_into(sock):
+        for _ in buff:
+            count += 1
+    return count
+
+
+def framer_append(data):
+    """ LineFramer holding an entire pending burst. """
+    buff, count = LineFramer(), 0
+    buff.append(data)
+    for _ in buff:
+        count += 1
+    return count
+
+
+def measure(funct, data, repeat=3):
+    """ Return the best time out of several runs. """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        assert funct(data) == LINES
+        taken = time.perf_counter() - start
+        best = taken if best is None else min(best, taken)
+    return best
+
+
+def main():
+    data = burst()
+    print("%d lines, %d bytes" % (LINES, len(data)))
+    for funct in (buffer_recv, framer_recv, buffer_append, framer_append):
+        taken = measure(funct, data)
+        print("%-14s %8.3fs %10.0f lines/s" % (
+            funct.__name__, taken, LINES / taken
+        ))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#! /usr/bin/env python3
+"""
+Times PRIVMSG dispatch as the number of loaded commands grows, waking every
+command for every message against routing through bot.router.
+
+Run from the repository root: python3 -m benchmarks.bench_router
+"""
+
+import time
+
+from bot.events import command
+from bot.router import CommandRouter
+from bot.threads import EventHandler
+from util.irc import Event
+
+MESSAGES = 2000
+PLUGIN_COUNTS = (10, 50, 200, 1000)
+
+
+class BenchServer(object):
+    """ Just enough of a bot for command wrappers to reject a message. """
+    def is_admin(self, hostmask):
+        return False
+
+    def rank_to_int(self, rank):
+        return 0
+
+    def numeric_rank(self, channel, nick):
+        return 0
+
+
+def handlers(count):
+    """ `count` commands, and a handler that sees everything. """
+    result = [EventHandler("privmsg", lambda server, line: None)]
+    for i in range(count):
+        funct = command("cmd%d alias%d" % (i, i))(lambda server, msg: None)
+        result.append(EventHandler("privmsg", funct))
+    return result
+
+
+def lines():
+    """ Mostly chatter, with the odd command for nothing loaded. """
+    for i in range(MESSAGES):
+        if i % 10:
+            text = "just talking about things %d" % i
+        else:
+            text = "!missing%d some arguments" % i
+        yield ":nick!user@host PRIVMSG #channel :%s" % text
+
+
+def scan(server, callbacks, events):
+    for event in events:
+        for handler in callbacks:
+            handler(server, event)
+
+
+def routed(server, callbacks, events):
+    router = CommandRouter(callbacks)
+    for event in events:
+        for handler in router.route(event):
+            handler(server, event)
+
+
+def main():
+    server = BenchServer()
+    for count in PLUGIN_COUNTS:
+        callbacks = handlers(count)
+        for name, dispatch in [("scan", scan), ("routed", routed)]:
+            events = [Event(i) for i in lines()]
+            start = time.time()
+            dispatch(server, callbacks, events)
+            elapsed = time.time() - start
+            print("%4d commands  %-6s %8.2fµs/message" % (
+                count, name, elapsed / MESSAGES * 1e6
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#! /usr/bin/env python3
+"""
+Times work queues under contention: several producers putting jobs while
+several consumers drain them, one job at a time or in batches. Reports the
+throughput, and the worst time a producer spent in put(), which is what the
+dispatch thread feels.
+
+queue.Queue is the baseline. The old Work, which held its own lock while
+waiting in queue.Queue.get(), cannot be measured: the first put() behind
+an idle consumer deadlocks.
+
+Run from the repository root: python3 -m benchmarks.bench_work
+"""
+
+import queue
+import threading
+import time
+
+from bot.workers.work import Work
+
+JOBS = 200000
+BATCH = 32
+SHAPES = ((1, 1), (1, 4), (4, 4))
+
+
+def drain_one(work, done):
+    count = 0
+    while True:
+        if work.get() is Work.TERM:
+            break
+        count += 1
+    done.append(count)
+
+
+def drain_batch(work, done):
+    count = 0
+    while True:
+        batch = work.get_batch(BATCH)
+        if batch[-1] is Work.TERM:
+            count += len(batch) - 1
+            break
+        count += len(batch)
+    done.append(count)
+
+
+def produce(work, jobs, worst):
+    slowest = 0
+    for i in range(jobs):
+        start = time.perf_counter()
+        work.put(i)
+        slowest = max(slowest, time.perf_counter() - start)
+    worst.append(slowest)
+
+
+def run(make, drain, producers, consumers):
+    work = make()
+    done, worst = [], []
+    threads = [threading.Thread(target=drain, args=(work, done))
+               for _ in range(consumers)]
+    for thread in threads:
+        thread.start()
+    start = time.perf_counter()
+    putters = [threading.Thread(target=produce,
+                                args=(work, JOBS // producers, worst))
+               for _ in range(producers)]
+    for thread in putters:
+        thread.start()
+    for thread in putters:
+        thread.join()
+    for _ in range(consumers):
+        work.put(Work.TERM)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    assert sum(done) == JOBS // producers * producers
+    return elapsed, max(worst)
+
+
+def main():
+    variants = [("queue.Queue", queue.Queue, drain_one),
+                ("Work.get", Work, drain_one),
+                ("Work.get_batch", Work, drain_batch)]
+    for producers, consumers in SHAPES:
+        for name, make, drain in variants:
+            elapsed, worst = run(make, drain, producers, consumers)
+            print("%d producers %d consumers  %-15s %8.0f jobs/s  "
+                  "worst put %7.1fµs" % (producers, consumers, name,
+                                         JOBS / elapsed, worst * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#! /usr/bin/env python3
+"""
+Counts the socket writes the printer makes to send 1000 queued lines, one
+write per line against coalesced writes.
+
+Run from the repository root: python3 -m benchmarks.bench_writes
+"""
+
+import socket
+import threading
+import time
+
+from bot.threads import Connection
+from bot.workers.ircsenders import IRCSender
+
+LINES = 1000
+
+
+class CountingSocket(object):
+    """ Counts the writes made to a socket. """
+    def __init__(self, sock):
+        self.sock = sock
+        self.writes = 0
+
+    def send(self, data):
+        self.writes += 1
+        return self.sock.send(data)
+
+    def sendall(self, data):
+        self.writes += 1
+        return self.sock.sendall(data)
+
+
+class BenchConnection(object):
+    """ Just enough of a Connection to drive a printer. """
+    config = {"Flood Rate": 0}
+    server = ("irc.example.net", 6667)
+    encoding = "utf-8"
+    sendline = Connection.sendline
+    sendlines = Connection.sendlines
+
+    def __init__(self, sock):
+        self.sock = CountingSocket(sock)
+
+
+def drain(sock, size, done):
+    """ Read until `size` bytes have arrived. """
+    while size > 0:
+        size -= len(sock.recv(65536))
+    done.set()
+
+
+def run(batch_size):
+    ours, theirs = socket.socketpair()
+    connection = BenchConnection(ours)
+    printer = IRCSender(connection)
+    printer.verbosity = printer.QUIET
+    printer.BATCH_SIZE = batch_size
+
+    lines = ["PRIVMSG #channel%d :line %d of the burst" % (i % 10, i)
+             for i in range(LINES)]
+    for line in lines:
+        printer.raw_message(line)
+
+    done = threading.Event()
+    size = sum(len(i) + 2 for i in lines)
+    threading.Thread(target=drain, args=(theirs, size, done), daemon=True).start()
+
+    start = time.time()
+    printer.start()
+    done.wait()
+    elapsed = time.time() - start
+    printer.terminate()
+    printer.join()
+    ours.close()
+    theirs.close()
+    return connection.sock.writes, elapsed
+
+
+def main():
+    for name, batch_size in [("line by line", 1),
+                             ("coalesced", IRCSender.BATCH_SIZE)]:
+        writes, elapsed = run(batch_size)
+        print("%-13s %5d writes per %d lines  %.4fs" % (name, writes, LINES, elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+An asyncio core for Karkat.
+
+Runs any number of IRC connections and their output queues on a single event
+loop, instead of a thread per socket. Lines are still dispatched through each
+bot's ExecutorMap, so inline callbacks run on the loop and everything else
+runs on the usual executors; plugins do not need to change.
+"""
+
+import asyncio
+import collections
+import socket
+import ssl
+import time
+
+from .threads import Bot, StatefulBot, EventHandler
+from .workers.executors import ExecutorMap, InlineExecutor
+from .workers.flood import OutputScheduler, INTERACTIVE
+from .workers.work import Work
+
+
+class LoopWork(object):
+    """
+    A work queue which may be fed from any thread, but is drained by a
+    coroutine on the event loop, at the rate its OutputScheduler allows.
+    """
+
+    TERM = Work.TERM
+
+    def __init__(self, loop, scheduler=None):
+        self.loop = loop
+        self.scheduler = scheduler if scheduler is not None else OutputScheduler()
+        self.last = None
+        self._waiter = None
+        self._terminated = False
+
+    def empty(self):
+        """ Returns true if probably empty. """
+        return not len(self.scheduler)
+
+    def flush(self):
+        """ Removes and returns all queued items. Call from the loop. """
+        return self.scheduler.flush()
+
+    def ready(self, limit=None):
+        """ Remove and return the jobs which may be sent right away. """
+        return self.scheduler.ready(time.time(), limit)
+
+    def put(self, job, lane=INTERACTIVE, target=None):
+        """ Queue a job and wake the consumer. Threadsafe. """
+        self.loop.call_soon_threadsafe(
+            self._put, job, lane, target, time.time()
+        )
+
+    def _put(self, job, lane, target, now):
+        self.scheduler.push(job, lane, target, now)
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def terminate(self):
+        """ Stops the consumer, discarding anything still queued. """
+        self.loop.call_soon_threadsafe(self._terminate)
+
+    def _terminate(self):
+        self._terminated = True
+        self._wake()
+
+    async def get(self):
+        """ Wait for and return the next job that may be sent. """
+        while not self._terminated:
+            now = time.time()
+            job = self.scheduler.pop(now)
+            if job is not None:
+                self.last = job
+                return job
+            self._waiter = self.loop.create_future()
+            delay = self.scheduler.delay(now)
+            if delay is None:
+                await self._waiter
+            else:
+                timer = self.loop.call_later(delay, self._wake)
+                await self._waiter
+                timer.cancel()
+        return self.TERM
+
+    def __len__(self):
+        return len(self.scheduler)
+
+
+class AsyncConnection(object):
+    """
+    Mixin which runs a Connection as tasks on an event loop.
+
+    The Thread-like interface is kept: connect() blocks until registered,
+    start() schedules the connection and join() runs the loop until it
+    closes.
+    """
+
+    READ_SIZE = 4096
+
+    def __init__(self, conf, loop=None, **kwargs):
+        super().__init__(conf, **kwargs)
+        self.loop = loop or asyncio.get_event_loop()
+        self.reader, self.writer = None, None
+        self.tasks = []
+        self.printer.work = LoopWork(self.loop, self.printer.work.scheduler)
+
+    def in_loop(self):
+        """ True unless the loop is running in another thread. """
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return not self.loop.is_running()
+
+    def connect(self):
+        if self.in_loop():
+            self.loop.run_until_complete(self.open())
+        else:
+            # Reconnecting an output from a helper thread.
+            asyncio.run_coroutine_threadsafe(self.open(), self.loop).result()
+
+    async def open(self):
+        """ Connect and register with the server. """
+        self.timings = collections.OrderedDict()
+        self.started = time.time()
+        self.sock = socket.socket()
+        self.sock.setblocking(False)
+        print("Connecting...")
+        await self.loop.sock_connect(self.sock, self.server)
+        self.mark("tcp")
+        if self.ssl:
+            # Match the threaded connection, which does not verify the server.
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            if self.certfile is not None:
+                context.load_cert_chain(self.certfile)
+            self.reader, self.writer = await asyncio.open_connection(
+                sock=self.sock, ssl=context, server_hostname=self.server[0]
+            )
+            self.mark("tls")
+        else:
+            self.reader, self.writer = await asyncio.open_connection(
+                sock=self.sock
+            )
+        nicks = self.register_user()
+        print("Connected. Trying %s" % self.nick)
+        while not self.connected:
+            data = await self.reader.read(self.READ_SIZE)
+            if not data:
+                raise ConnectionError("Server closed the connection during "
+                                      "registration.")
+            self.buff.append(data)
+            for line in self.buff:
+                if self.handshake(line, nicks):
+                    break
+        self.mark("registration")
+        self.tasks.append(self.loop.create_task(self.drain()))
+        print("Connected in %s." % self.report_timings())
+
+    def can_hand_off(self):
+        """ The streams belong to the loop, so hot restarts reconnect. """
+        return False
+
+    def sendlines(self, lines):
+        data = "".join("%s\r\n" % i for i in lines).encode(self.encoding)
+        self.loop.call_soon_threadsafe(self.writer.write, data)
+
+    def start(self):
+        """ Schedule the connection's read loop. """
+        if self.in_loop():
+            self.tasks.append(self.loop.create_task(self.serve()))
+        else:
+            self.loop.call_soon_threadsafe(self.start)
+
+    async def serve(self):
+        """ Read and dispatch lines until disconnected. """
+        try:
+            while self.pending:
+                self.dispatch(self.pending.popleft())
+            while self.connected:
+                for line in self.buff:
+                    self.dispatch(line)
+                data = await self.reader.read(self.READ_SIZE)
+                if not data:
+                    break
+                self.buff.append(data)
+        finally:
+            self.writer.close()
+            print("Connection closed.")
+            self.cleanup()
+
+            self.connected = False
+
+    async def drain(self):
+        """ Send queued output until the printer is terminated. """
+        printer = self.printer
+        while True:
+            job = await printer.work.get()
+            if job is LoopWork.TERM:
+                return
+            if printer.flush:
+                printer.work.flush()
+                printer.flush = False
+                continue
+            printer.process(job)
+
+    def stop_printer(self):
+        self.printer.terminate()
+
+    def quit(self, reason=None):
+        super().quit(reason)
+        if not self.loop.is_running() and self.tasks:
+            # Give the server a chance to acknowledge the QUIT.
+            self.loop.run_until_complete(asyncio.wait(self.tasks, timeout=5))
+
+    def join(self, timeout=None):
+        """ Run the event loop until this connection and its outputs close. """
+        tasks = [i for bot in self.printer.bots for i in bot.tasks]
+        self.loop.run_until_complete(asyncio.wait(tasks, timeout=timeout))
+
+
+class AsyncBot(AsyncConnection, StatefulBot):
+    """ A StatefulBot whose connections all run on one event loop. """
+
+    def start(self):
+        self.start_executors()
+        super().start()
+
+
+class AsyncOutput(AsyncConnection, Bot):
+    """
+    An output-only connection on the event loop.
+
+    Output connections only answer PINGs, so every callback runs inline and
+    no executor threads are created.
+    """
+
+    def __init__(self, conf, **kwargs):
+        super().__init__(conf, **kwargs)
+        inline = InlineExecutor()
+        self.executor = ExecutorMap({
+            EventHandler.BACKGROUND: inline,
+            EventHandler.GENERAL: inline,
+            EventHandler.THREADSAFE: inline,
+            EventHandler.CPU: inline,
+            EventHandler.INLINE: inline,
+        }, key=lambda x: x.cbtype)
@@ -0,0 +1,162 @@
+"""
+A circuit breaker for slow handlers.
+
+Each executor has a time budget per call. A handler which overruns its
+budget STRIKES times in a row is demoted to the background executor, where
+it can only hold up other demoted handlers, and the admins are told. If it
+keeps overrunning the background budget too, it is disabled for COOLDOWN
+seconds. A demoted handler which then runs within its original budget
+RECOVER times in a row is promoted back. A demoted general handler stays in
+its mutex set's mailbox, which drains in the background while its calls are
+next, so it still never runs beside the rest of its plugin.
+
+Calls are counted as overrunning as soon as they pass their deadline, not
+only once they return, so a handler stuck on a network call with no timeout
+is moved out of the way while it is still stuck.
+
+Config:
+    Budgets: seconds per call, by executor, e.g. {inline: 0.1, general: 10}
+    Admin Channel: where to send notices (default: print them)
+"""
+
+import sys
+import threading
+import time
+
+from util.text import ircstrip
+
+# Seconds a call may take in each executor. None means no limit.
+BUDGETS = {"inline": 0.25, "general": 10, "threadsafe": 10,
+           "background": 60, "cpu": None}
+
+
+class HandlerState(object):
+    """ How a handler has been doing. """
+
+    __slots__ = ("strikes", "fast", "demoted", "disabled")
+
+    def __init__(self):
+        self.strikes = 0      # Overruns in a row
+        self.fast = 0         # Runs within the original budget in a row
+        self.demoted = False
+        self.disabled = 0     # Disabled until this time
+
+
+class Breaker(object):
+    """ Decides where each handler runs, from how its calls have gone. """
+
+    STRIKES = 3
+    RECOVER = 5
+    COOLDOWN = 300
+    # Seconds between scans of the calls under way.
+    CHECK_EVERY = 1
+
+    def __init__(self, bot, budgets=None, background=None):
+        self.bot = bot
+        self.budgets = dict(BUDGETS, **(budgets or {}))
+        self.background = background
+        self.states = {}
+        self.overdue = set()  # Calls under way already counted as overruns
+        self.lock = threading.Lock()
+        self.checked = 0
+
+    def exempt(self, handler):
+        """ The bot's own handlers keep its state, so they are never moved. """
+        return (getattr(handler.funct, "__self__", None) is self.bot
+                or self.budgets.get(handler.executor) is None)
+
+    def route(self, handler):
+        """
+        The cbtype a handler should run as, or None if it is disabled.
+        """
+        now = time.time()
+        if now - self.checked > self.CHECK_EVERY:
+            self.checked = now
+            self.check(now)
+        state = self.states.get(handler.name)
+        if state is None:
+            return handler.cbtype
+        if state.disabled:
+            if state.disabled > now:
+                return None
+            with self.lock:
+                state.disabled, state.strikes = 0, 0
+            self.notice("%s is enabled again, in the background." % handler.name)
+        return self.background if state.demoted else handler.cbtype
+
+    def check(self, now):
+        """ Count calls which are running past their deadline. """
+        for timed in self.bot.metrics.under_way():
+            if id(timed) not in self.overdue and not self.exempt(timed.handler):
+                if now - timed.start > self.budget(timed):
+                    self.overdue.add(id(timed))
+                    self.overran(timed.handler, late=True)
+
+    def budget(self, timed):
+        return self.budgets[timed.executor]
+
+    def observe(self, timed, elapsed, failed):
+        """ Account for a finished call. """
+        if self.exempt(timed.handler):
+            return
+        if id(timed) in self.overdue:
+            # Already counted while it was running.
+            self.overdue.discard(id(timed))
+            return
+        original = self.budgets[timed.handler.executor]
+        if elapsed > self.budget(timed):
+            self.overran(timed.handler)
+        elif timed.handler.name in self.states:
+            self.recovered(timed.handler, elapsed <= original)
+
+    def overran(self, handler, late=False):
+        with self.lock:
+            state = self.states.setdefault(handler.name, HandlerState())
+            state.fast = 0
+            state.strikes += 1
+            if state.strikes < self.STRIKES:
+                return
+            state.strikes = 0
+            if not state.demoted:
+                state.demoted = True
+                action = "moved to the background"
+            else:
+                state.disabled = time.time() + self.COOLDOWN
+                action = "disabled for %d seconds" % self.COOLDOWN
+        self.notice("%s ran over its %s budget %d times in a row%s; %s." % (
+            handler.name, handler.executor, self.STRIKES,
+            " (still running)" if late else "", action
+        ))
+
+    def recovered(self, handler, fast):
+        with self.lock:
+            state = self.states[handler.name]
+            state.strikes = 0
+            if not state.demoted:
+                del self.states[handler.name]
+                return
+            state.fast = state.fast + 1 if fast else 0
+            if state.fast < self.RECOVER:
+                return
+            del self.states[handler.name]
+        self.notice("%s is fast again, and runs %s once more." % (
+            handler.name, handler.executor
+        ))
+
+    def tripped(self):
+        """ The handlers which have been demoted or disabled, and how. """
+        now = time.time()
+        with self.lock:
+            return sorted(
+                (name, "disabled for %ds" % (state.disabled - now)
+                 if state.disabled > now else "background")
+                for name, state in self.states.items() if state.demoted
+            )
+
+    def notice(self, text):
+        channel = self.bot.config.get("Admin Channel")
+        text = "\x0304Breaker│\x03 " + text
+        if channel is None:
+            print(ircstrip(text), file=sys.stderr)
+        else:
+            self.bot.printer.message(text, channel, "NOTICE")
@@ -0,0 +1,178 @@
+"""
+IRCv3 capability negotiation.
+
+The bot asks for the capabilities it knows how to use while registering,
+authenticates with SASL if it is configured to, and keeps track of
+capabilities the server adds or removes later on (cap-notify).
+
+Config:
+    SASL:
+        Mechanism: PLAIN or EXTERNAL (default PLAIN)
+        Username: account name (default Username)
+        Password: account password
+    SSL Cert: client certificate for EXTERNAL
+    Capabilities: any extra capabilities to request
+"""
+
+import base64
+import sys
+
+# The capabilities Karkat knows how to use.
+SUPPORTED = ("sasl", "multi-prefix", "server-time", "message-tags", "batch",
+             "cap-notify")
+
+# AUTHENTICATE payloads are sent in chunks of this many bytes.
+SASL_CHUNK = 400
+
+SASL_SUCCESS = {"903"}
+SASL_FAILURE = {"902", "904", "905", "906", "907", "908"}
+
+
+class Capabilities(object):
+    """
+    Negotiates capabilities for a connection. `"server-time" in bot.caps`
+    tells whether the server agreed to a capability.
+    """
+
+    def __init__(self, bot, wanted=SUPPORTED, sasl=None):
+        self.bot = bot
+        self.wanted = set(wanted)
+        self.sasl = sasl
+        if sasl is None:
+            self.wanted.discard("sasl")
+        self.reset()
+
+    def reset(self):
+        """ Forget everything negotiated on a previous connection. """
+        self.available = {}
+        self.enabled = set()
+        self.pending = set()
+        self.negotiating = False
+        self.authenticating = False
+        self.account = None
+
+    def start(self):
+        """ Begin negotiation. Registration waits until we send CAP END. """
+        self.reset()
+        self.negotiating = True
+        self.bot.sendline("CAP LS 302")
+
+    def end(self):
+        """ Finish negotiation once nothing is left outstanding. """
+        if self.negotiating and not self.pending and not self.authenticating:
+            self.negotiating = False
+            self.bot.sendline("CAP END")
+
+    def request(self, caps):
+        """ Ask for the capabilities we want out of those offered. """
+        wanted = sorted(i for i in caps
+                        if i in self.wanted and i not in self.enabled | self.pending)
+        if wanted:
+            self.pending.update(wanted)
+            self.bot.sendline("CAP REQ :%s" % " ".join(wanted))
+
+    def handle(self, event):
+        """
+        Process a line from the server. Returns True if the line belonged to
+        capability negotiation or authentication.
+        """
+        if event.command == "CAP" and len(event.params) > 2:
+            handler = getattr(self, "on_" + event.params[1].lower(), None)
+            if handler is not None:
+                handler(event.params[2:])
+            return True
+        elif event.command == "AUTHENTICATE":
+            self.authenticate(event.trailing)
+            return True
+        elif event.command in SASL_SUCCESS | SASL_FAILURE:
+            self.authenticated(event)
+            return True
+        elif event.command == "900":
+            self.account = event.params[2] if len(event.params) > 2 else None
+            return True
+        elif event.command == "421" and len(event.params) > 1 and event.params[1] == "CAP":
+            # The server predates capabilities, and registers us anyway.
+            self.negotiating = False
+            return True
+        return False
+
+    @staticmethod
+    def parse(caps):
+        """ Split a capability list into a {name: value} mapping. """
+        parsed = {}
+        for cap in caps.split():
+            name, _, value = cap.partition("=")
+            parsed[name] = value or None
+        return parsed
+
+    def on_ls(self, params):
+        self.available.update(self.parse(params[-1]))
+        if params[0] == "*":
+            # More to come.
+            return
+        self.request(self.available)
+        self.end()
+
+    def on_ack(self, params):
+        for cap in params[-1].split():
+            if cap.startswith("-"):
+                self.enabled.discard(cap[1:])
+                self.pending.discard(cap[1:])
+                continue
+            self.enabled.add(cap)
+            self.pending.discard(cap)
+            if cap == "sasl" and self.negotiating:
+                self.authenticating = True
+                self.bot.sendline("AUTHENTICATE %s" % self.mechanism)
+        self.end()
+
+    def on_nak(self, params):
+        for cap in params[-1].split():
+            self.pending.discard(cap)
+        self.end()
+
+    def on_new(self, params):
+        caps = self.parse(params[-1])
+        self.available.update(caps)
+        self.request(caps)
+
+    def on_del(self, params):
+        for cap in params[-1].split():
+            self.available.pop(cap, None)
+            self.enabled.discard(cap)
+
+    def on_list(self, params):
+        self.enabled = set(self.parse(params[-1]))
+
+    @property
+    def mechanism(self):
+        return self.sasl.get("Mechanism", "PLAIN").upper()
+
+    def authenticate(self, challenge):
+        """ Answer the server's SASL challenge. """
+        if not self.authenticating or challenge != "+":
+            return
+        if self.mechanism == "EXTERNAL":
+            self.bot.sendline("AUTHENTICATE +")
+            return
+        account = self.sasl.get("Username", self.bot.username)
+        payload = "%s\0%s\0%s" % (account, account, self.sasl["Password"])
+        payload = base64.b64encode(payload.encode("utf-8")).decode("ascii")
+        chunks = [payload[i:i+SASL_CHUNK] for i in range(0, len(payload), SASL_CHUNK)]
+        if not chunks or len(chunks[-1]) == SASL_CHUNK:
+            chunks.append("+")
+        for chunk in chunks:
+            self.bot.sendline("AUTHENTICATE %s" % chunk)
+
+    def authenticated(self, event):
+        """ Handle the outcome of SASL authentication. """
+        if event.command in SASL_FAILURE:
+            print("SASL authentication failed: %s" % event.trailing, file=sys.stderr)
+        self.authenticating = False
+        self.end()
+
+    def __contains__(self, cap):
+        return cap in self.enabled
+
+    def __iter__(self):
+        return iter(sorted(self.enabled))
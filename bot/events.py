@@ -7,7 +7,7 @@ import inspect
 import sys
 import traceback
 
-from util.irc import Command, Message
+from util.irc import Command, Message, Event
 
 
 # Constants
@@ -39,10 +39,33 @@ class Callback(object):
         funct.isBackground = True
         return funct
 
+    @staticmethod
+    def event(funct):
+        """ Pass the callback a parsed Event instead of the raw line. """
+        funct.takesEvent = True
+        return funct
+
+    @staticmethod
+    def takesEvent(funct):
+        return hasattr(funct, "takesEvent") and funct.takesEvent
+
     @staticmethod
     def isBackground(funct):
         return hasattr(funct, "isBackground") and funct.isBackground
 
+    @staticmethod
+    def cpu(funct):
+        """
+        Run the callback in a worker process. See bot.workers.processes for
+        what such callbacks may do.
+        """
+        funct.isCPU = True
+        return funct
+
+    @staticmethod
+    def isCPU(funct):
+        return hasattr(funct, "isCPU") and funct.isCPU
+
     ERROR = Exception
 
     class InvalidUsage(BaseException):
@@ -73,7 +96,6 @@ class Callback(object):
                 annotations = getattr(val, "__annotations__")
                 if "return" in annotations:
                     __mutex__.add(val)
-                    val.__mutex__ = val
                     if type(annotations["return"]) == str:
                         hooks.setdefault(annotations["return"], []).append(val)
                     else:
@@ -82,6 +104,10 @@ class Callback(object):
             except AttributeError:
                 pass
 
+        # Hooks are bound methods, which cannot carry a mutex set of their
+        # own, so EventHandler looks it up on the instance.
+        self.__mutex__ = __mutex__
+
         if not hasattr(self, "__callbacks__"):
             self.__callbacks__ = {}
 
@@ -152,7 +178,7 @@ def command(name=None,
         def _(*argv):
             try:
                 bot = argv[-2]
-                msg = Command(argv[-1])
+                msg = Event.of(argv[-1]).as_command()
                 user = msg.address
             except IndexError:
                 return
@@ -225,11 +251,13 @@ def command(name=None,
                     except Callback.InvalidUsage:
                         pass
         _.__annotations__["return"] = "privmsg"
+        _.takesEvent = True
         _.private = private
         _.public = public
         _.triggers = triggers
         _.funct = funct
         _.admin_only = admin
+        _.rank = rank
         return _
     return decorator
 
@@ -238,7 +266,7 @@ def msghandler(funct):
     def _(*argv):
         try:
             bot = argv[-2]
-            msg = Message(argv[-1])
+            msg = Event.of(argv[-1]).message()
         except IndexError:
             return
         else:
@@ -258,5 +286,6 @@ def msghandler(funct):
                     with output as out:
                         out += rval
     _.__annotations__["return"] = "privmsg"
+    _.takesEvent = True
     _.funct = funct
     return _
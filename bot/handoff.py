@@ -0,0 +1,52 @@
+"""
+Hot restarts: hand the server connections over to a new image of the bot.
+
+Before exec'ing, the bot writes each connection's state, and the bytes it
+has read but not dispatched, to a snapshot file, and lets the sockets survive
+the exec. The new process picks the sockets up by file descriptor and carries
+on without registering again or re-syncing its channels. Output still queued
+is sent by the new process.
+
+Cold starts reuse part of this: a StatefulBot saves its channels' ban,
+exception and invite lists when it disconnects, and does not ask for them
+again if it rejoins soon after.
+"""
+
+import json
+import os
+import tempfile
+
+OPTION = "--resume"
+
+
+def save(servers):
+    """
+    Snapshot handed off servers, keyed by name. Returns the snapshot's path.
+    """
+    snapshot = {}
+    for server in servers:
+        state = server.snapshot()
+        os.set_inheritable(state["fd"], True)
+        snapshot[server.name] = state
+    fd, path = tempfile.mkstemp(prefix="karkat-", suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump(snapshot, f)
+    return path
+
+
+def load(path):
+    """ Read and remove a snapshot written by save. """
+    with open(path) as f:
+        snapshot = json.load(f)
+    os.remove(path)
+    return snapshot
+
+
+def argv(args, path):
+    """ The command line for the new image, resuming from a snapshot. """
+    args = list(args)
+    while OPTION in args:
+        index = args.index(OPTION)
+        del args[index:index + 2]
+    args = [i for i in args if not i.startswith(OPTION + "=")]
+    return args + [OPTION, path]
@@ -0,0 +1,214 @@
+"""
+Who is in which channel, indexed both ways.
+
+Users are interned records keyed by their casemapped nick and shared by
+every channel they are in. A channel maps member keys to the membership,
+which holds the member's prefix modes, and each user keeps the keys of
+their channels, so quits and nick changes only touch those channels.
+"""
+
+import string
+import sys
+
+UPPER, LOWER = string.ascii_uppercase, string.ascii_lowercase
+
+# str.translate tables for the casemappings servers advertise.
+CASEMAPPINGS = {
+    "ascii": str.maketrans(UPPER, LOWER),
+    "rfc1459": str.maketrans(UPPER + "[]\\^", LOWER + "{}|~"),
+    "strict-rfc1459": str.maketrans(UPPER + "[]\\", LOWER + "{}|"),
+}
+
+
+class User(object):
+    """ A user we share a channel with. """
+
+    __slots__ = ("nick", "key", "ident", "host", "account", "channels")
+
+    def __init__(self, nick, key):
+        self.nick = nick
+        self.key = key
+        self.ident = self.host = self.account = None
+        self.channels = set()
+
+    def __repr__(self):
+        return "User(%r)" % self.nick
+
+
+class Membership(object):
+    """ A user's place in a channel, and their prefix modes there. """
+
+    __slots__ = ("user", "modes")
+
+    def __init__(self, user, modes=None):
+        self.user = user
+        self.modes = modes if modes is not None else []
+
+
+class Channel(object):
+    """
+    The members of a channel. Iterating gives their nicks and membership
+    tests are casemapped, so a Channel can be used as a set of nicks.
+    """
+
+    __slots__ = ("name", "key", "members", "store")
+
+    def __init__(self, store, name, key):
+        self.store = store
+        self.name = name
+        self.key = key
+        self.members = {}
+
+    def add(self, nick):
+        self.store.join(self.key, nick)
+
+    def remove(self, nick):
+        if not self.store.part(self.key, nick):
+            raise KeyError(nick)
+
+    def discard(self, nick):
+        self.store.part(self.key, nick)
+
+    def get(self, nick):
+        """ The membership of a nick, or None. """
+        return self.members.get(self.store.lower(nick))
+
+    def __contains__(self, nick):
+        return self.store.lower(nick) in self.members
+
+    def __iter__(self):
+        return iter([i.user.nick for i in self.members.values()])
+
+    def __len__(self):
+        return len(self.members)
+
+    def __repr__(self):
+        return "Channel(%r, %r)" % (self.name, sorted(self))
+
+
+class Members(object):
+    """
+    The membership store. `channels` maps channel keys to Channels and may
+    be handed out as is; change it through these methods.
+
+    Note: This object is not thread safe. Like the rest of StatefulBot's
+    state, it is only changed from inline callbacks.
+    """
+
+    def __init__(self, casemapping="ascii"):
+        self.users = {}
+        self.channels = {}
+        self.table = CASEMAPPINGS["ascii"]
+        self.casemapping = None
+        self.set_casemapping(casemapping)
+
+    def lower(self, name):
+        return name.translate(self.table)
+
+    def set_casemapping(self, casemapping):
+        """ Switch casemapping, rekeying anything already stored. """
+        casemapping = casemapping if casemapping in CASEMAPPINGS else "ascii"
+        if casemapping == self.casemapping:
+            return
+        self.casemapping = casemapping
+        self.table = CASEMAPPINGS[casemapping]
+        users, channels = list(self.users.values()), list(self.channels.values())
+        self.users.clear()
+        self.channels.clear()
+        for user in users:
+            user.key = sys.intern(self.lower(user.nick))
+            user.channels = set()
+            self.users[user.key] = user
+        for channel in channels:
+            channel.key = sys.intern(self.lower(channel.name))
+            channel.members = {m.user.key: m for m in channel.members.values()}
+            self.channels[channel.key] = channel
+            for member in channel.members.values():
+                member.user.channels.add(channel.key)
+
+    def user(self, nick):
+        """ The record for a nick, or None. """
+        return self.users.get(self.lower(nick))
+
+    def add_channel(self, name):
+        """ Start tracking a channel we have joined, emptying it. """
+        self.remove_channel(name)
+        key = sys.intern(self.lower(name))
+        channel = self.channels[key] = Channel(self, name, key)
+        return channel
+
+    def remove_channel(self, name):
+        """ Stop tracking a channel, forgetting users only seen there. """
+        channel = self.channels.pop(self.lower(name), None)
+        if channel is None:
+            return
+        for member in channel.members.values():
+            member.user.channels.discard(channel.key)
+            self.collect(member.user)
+
+    def channel(self, name):
+        """ The Channel for a name, tracking it if need be. """
+        key = self.lower(name)
+        if key not in self.channels:
+            return self.add_channel(name)
+        return self.channels[key]
+
+    def join(self, channel, nick, modes=None):
+        """ Record a nick in a channel. Returns the membership. """
+        channel = self.channel(channel)
+        key = self.lower(nick)
+        user = self.users.get(key)
+        if user is None:
+            key = sys.intern(key)
+            user = self.users[key] = User(nick, key)
+        member = channel.members.get(key)
+        if member is None:
+            member = channel.members[key] = Membership(user)
+            user.channels.add(channel.key)
+        if modes is not None:
+            member.modes = modes
+        return member
+
+    def part(self, channel, nick):
+        """ Remove a nick from a channel. Returns False if it was not there. """
+        channel = self.channels.get(self.lower(channel))
+        key = self.lower(nick)
+        if channel is None or key not in channel.members:
+            return False
+        user = channel.members.pop(key).user
+        user.channels.discard(channel.key)
+        self.collect(user)
+        return True
+
+    def quit(self, nick):
+        """ Remove a nick from every channel. Returns the channels it left. """
+        user = self.users.pop(self.lower(nick), None)
+        if user is None:
+            return []
+        channels = [self.channels[i] for i in user.channels]
+        for channel in channels:
+            del channel.members[user.key]
+        user.channels.clear()
+        return channels
+
+    def rename(self, nick, newnick):
+        """ Follow a nick change. """
+        user = self.users.pop(self.lower(nick), None)
+        if user is None:
+            return
+        key = sys.intern(self.lower(newnick))
+        for channel in user.channels:
+            members = self.channels[channel].members
+            members[key] = members.pop(user.key)
+        user.nick, user.key = newnick, key
+        self.users[key] = user
+
+    def membership(self, channel, nick):
+        """ A nick's membership of a channel, or None. """
+        channel = self.channels.get(self.lower(channel))
+        return channel.members.get(self.lower(nick)) if channel is not None else None
+
+    def collect(self, user):
+        """ Forget a user once we share no channels with them. """
+        if not user.channels and self.users.get(user.key) is user:
+            del self.users[user.key]
@@ -0,0 +1,233 @@
+"""
+Per-handler execution metrics.
+
+Every callback the bot dispatches is wrapped in a Timed call, which records
+how long it waited in its executor's queue, how long it ran and whether it
+raised. Figures are kept per handler and per executor, and can be rendered
+in the Prometheus text format.
+"""
+
+import bisect
+import threading
+import time
+
+# Upper bounds of the execution time histogram buckets, in seconds.
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+# Where a Timed call is: made, waiting in a queue, started, or dropped.
+NEW, QUEUED, STARTED, CANCELLED = range(4)
+
+
+class HandlerStats(object):
+    """ The figures for one handler in one executor. """
+
+    __slots__ = ("calls", "errors", "wait", "time", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.wait = 0.0  # Total seconds spent queued
+        self.time = 0.0  # Total seconds spent running
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, wait, elapsed, failed):
+        self.calls += 1
+        self.errors += failed
+        self.wait += wait
+        self.time += elapsed
+        self.buckets[bisect.bisect_left(BUCKETS, elapsed)] += 1
+
+    def copy(self):
+        stats = HandlerStats()
+        stats.calls, stats.errors = self.calls, self.errors
+        stats.wait, stats.time = self.wait, self.time
+        stats.buckets = list(self.buckets)
+        return stats
+
+
+class Timed(object):
+    """
+    A call to a handler, queued at a known time, which records its metrics
+    when run. Looks enough like the handler for executors to treat it as one.
+    The cbtype, and so the executor, may differ from the handler's own.
+    """
+
+    __slots__ = ("handler", "metrics", "executor", "queued", "start", "name",
+                 "cbtype", "funct", "takes_event", "__mutex__", "state")
+
+    def __init__(self, handler, metrics, executor, cbtype=None):
+        self.handler = handler
+        self.metrics = metrics
+        self.executor = executor
+        self.queued = time.time()
+        self.start = None
+        self.name = handler.name
+        self.cbtype = handler.cbtype if cbtype is None else cbtype
+        self.funct = handler.funct
+        self.takes_event = handler.takes_event
+        self.__mutex__ = handler.__mutex__
+        self.state = NEW
+
+    def __call__(self, *args, **kwargs):
+        self.start = time.time()
+        self.metrics.dequeued(self)
+        self.metrics.running[id(self)] = self
+        failed = True
+        try:
+            result = self.handler(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            del self.metrics.running[id(self)]
+            self.record(self.start, time.time() - self.start, failed)
+
+    def record(self, start, elapsed, failed):
+        """ Record a call. Executors which run the handler elsewhere call this. """
+        if self.start is None:
+            self.start = start
+            self.metrics.dequeued(self)
+        self.metrics.record(self.name, self.executor, start - self.queued,
+                            elapsed, failed)
+        for observer in self.metrics.observers:
+            observer(self, elapsed, failed)
+
+    def cancel(self):
+        """ Note that a queued call will never run. """
+        self.metrics.cancelled(self)
+
+
+class Metrics(object):
+    """
+    Collects HandlerStats, keyed by (handler name, executor). Observers are
+    called with each Timed call, its run time and whether it raised.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.since = time.time()
+        # Calls under way, by id.
+        self.running = {}
+        self.observers = []
+        # Calls queued but not started: in all, and by handler name.
+        self.depth = 0
+        self.waiting = {}
+        # Smoothed queue wait of calls as they start.
+        self.wait = 0.0
+        # Calls never made, by (handler name, reason).
+        self.dropped = {}
+
+    def timed(self, handler, executor, cbtype=None):
+        """
+        Wrap a handler call to be recorded under an executor's name. Call
+        enqueued once it has been handed to the executor.
+        """
+        return Timed(handler, self, executor, cbtype)
+
+    def enqueued(self, timed):
+        """
+        Count a call as waiting. One which has already started, as inline
+        calls have, is not counted.
+        """
+        with self.lock:
+            if timed.state != NEW:
+                return
+            timed.state = QUEUED
+            self.depth += 1
+            self.waiting[timed.name] = self.waiting.get(timed.name, 0) + 1
+
+    def unqueue(self, timed, state):
+        """ Stop counting a call as waiting. Requires the lock. """
+        if timed.state == QUEUED:
+            self.depth -= 1
+            if self.waiting[timed.name] == 1:
+                del self.waiting[timed.name]
+            else:
+                self.waiting[timed.name] -= 1
+        timed.state = state
+
+    def dequeued(self, timed):
+        """ Note that a call has started. """
+        with self.lock:
+            self.unqueue(timed, STARTED)
+            self.wait = 0.9 * self.wait + 0.1 * (timed.start - timed.queued)
+
+    def cancelled(self, timed):
+        """ Note that a call will never start. """
+        with self.lock:
+            if timed.state != STARTED:
+                self.unqueue(timed, CANCELLED)
+
+    def drop(self, name, reason):
+        """ Count a call which was not made. """
+        with self.lock:
+            self.dropped[name, reason] = self.dropped.get((name, reason), 0) + 1
+
+    def under_way(self):
+        """ The calls running right now. """
+        return list(self.running.values())
+
+    def record(self, name, executor, wait, elapsed, failed=False):
+        with self.lock:
+            stats = self.stats.get((name, executor))
+            if stats is None:
+                stats = self.stats[name, executor] = HandlerStats()
+            stats.add(wait, elapsed, failed)
+
+    def snapshot(self):
+        """ A consistent copy of the figures. """
+        with self.lock:
+            return {key: stats.copy() for key, stats in self.stats.items()}
+
+    def top(self, count=5):
+        """ The handlers which have spent the longest running. """
+        stats = sorted(self.snapshot().items(), key=lambda i: i[1].time, reverse=True)
+        return stats[:count]
+
+    def exposition(self, **labels):
+        """ The figures in the Prometheus text format. """
+        families = [
+            ("karkat_handler_calls_total", "counter", "Handler calls."),
+            ("karkat_handler_errors_total", "counter", "Handler calls which raised."),
+            ("karkat_handler_queue_wait_seconds", "summary",
+             "Time handler calls spent queued."),
+            ("karkat_handler_duration_seconds", "histogram",
+             "Time handler calls spent running."),
+        ]
+        stats = sorted(self.snapshot().items())
+        with self.lock:
+            dropped = sorted(self.dropped.items())
+        lines = []
+        for family, kind, description in families:
+            lines.append("# HELP %s %s" % (family, description))
+            lines.append("# TYPE %s %s" % (family, kind))
+            for (name, executor), figures in stats:
+                label = format_labels(dict(labels, handler=name, executor=executor))
+                if kind == "counter":
+                    value = figures.calls if "calls" in family else figures.errors
+                    lines.append("%s{%s} %d" % (family, label, value))
+                elif kind == "summary":
+                    lines.append("%s_sum{%s} %r" % (family, label, figures.wait))
+                    lines.append("%s_count{%s} %d" % (family, label, figures.calls))
+                else:
+                    total = 0
+                    for bound, count in zip(BUCKETS + ("+Inf",), figures.buckets):
+                        total += count
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (family, label, bound, total))
+                    lines.append("%s_sum{%s} %r" % (family, label, figures.time))
+                    lines.append("%s_count{%s} %d" % (family, label, figures.calls))
+        family = "karkat_handler_dropped_total"
+        lines.append("# HELP %s Handler calls shed or coalesced under load." % family)
+        lines.append("# TYPE %s counter" % family)
+        for (name, reason), count in dropped:
+            label = format_labels(dict(labels, handler=name, reason=reason))
+            lines.append("%s{%s} %d" % (family, label, count))
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    """ Render a label set, escaped as the text format requires. """
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return ",".join('%s="%s"' % (key, escape(value))
+                    for key, value in sorted(labels.items()))
@@ -0,0 +1,68 @@
+"""
+Overload protection at dispatch.
+
+Handlers fall into three priority classes: protocol and state handlers, which
+run inline and are never held back; commands, which someone is waiting on;
+and passive handlers, such as ALL listeners and msghandlers, which watch the
+channel. When the executors fall behind, passive work gives way first:
+
+- Past COALESCE queued calls, or a smoothed queue wait of COALESCE_WAIT
+  seconds, a passive handler which already has a call queued gets no more.
+- Past SHED queued calls, or SHED_WAIT seconds of queue wait, passive calls
+  are dropped.
+- Past LIMIT queued calls, commands are dropped too, so the queues stay
+  bounded.
+
+Dropped calls are counted in the bot's metrics, by handler and reason. A
+callback can choose its class by setting a priority attribute.
+
+Config:
+    Overload: any of {coalesce: 100, shed: 500, limit: 2000,
+                      coalesce wait: 1, shed wait: 5}
+"""
+
+PROTOCOL, COMMAND, PASSIVE = 0, 1, 2
+
+
+class Overload(object):
+    """ Decides whether a call should be queued, from the queues' state. """
+
+    COALESCE = 100
+    SHED = 500
+    LIMIT = 2000
+    COALESCE_WAIT = 1
+    SHED_WAIT = 5
+
+    def __init__(self, metrics, config=None):
+        self.metrics = metrics
+        config = config or {}
+        self.coalesce = config.get("coalesce", self.COALESCE)
+        self.shed = config.get("shed", self.SHED)
+        self.limit = config.get("limit", self.LIMIT)
+        self.coalesce_wait = config.get("coalesce wait", self.COALESCE_WAIT)
+        self.shed_wait = config.get("shed wait", self.SHED_WAIT)
+
+    def reason(self, handler):
+        """ Why a call to a handler should not be queued, or None. """
+        if handler.priority == PROTOCOL:
+            return None
+        depth = self.metrics.depth
+        if depth >= self.limit:
+            return "full"
+        if handler.priority != PASSIVE or not depth:
+            return None
+        wait = self.metrics.wait
+        if depth >= self.shed or wait >= self.shed_wait:
+            return "shed"
+        if ((depth >= self.coalesce or wait >= self.coalesce_wait)
+                and handler.name in self.metrics.waiting):
+            return "coalesced"
+        return None
+
+    def admit(self, handler):
+        """ True if a call should be queued. Refusals are counted. """
+        reason = self.reason(handler)
+        if reason is None:
+            return True
+        self.metrics.drop(handler.name, reason)
+        return False
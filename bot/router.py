@@ -0,0 +1,113 @@
+"""
+Decides which callbacks see each incoming line.
+
+Command decorators record the prefixes and triggers a handler answers to.
+Rather than waking every command for every message, the router looks the
+first word of a message up in a table keyed by (prefix, trigger). Handlers
+without that metadata, such as msghandlers, still see every message.
+
+DispatchTables snapshots a bot's callbacks into immutable tables, one per
+event type and one per blacklisted channel, so dispatching a line is a
+lookup. The bot swaps in a new snapshot whenever its callbacks or its
+blacklist change.
+"""
+
+import operator
+
+
+class CommandRouter(object):
+    """
+    An index of PRIVMSG handlers. Admin and rank checks are left to the
+    command wrappers; the router only skips commands that cannot match.
+    """
+
+    def __init__(self, handlers=()):
+        self.commands = {}
+        self.passive = []
+        for position, handler in enumerate(handlers):
+            self.add(position, handler)
+
+    @staticmethod
+    def keys(funct):
+        """ The (prefix, trigger) pairs a command answers to, or None. """
+        triggers = getattr(funct, "triggers", None)
+        if triggers is None or getattr(funct, "key", str.lower) is not str.lower:
+            return None
+        # Commands compare the first character of a message to their
+        # prefixes, so multi-character prefix strings are sets of prefixes.
+        prefixes = set(getattr(funct, "private", "") + getattr(funct, "public", ""))
+        if not prefixes:
+            return None
+        return {(prefix, trigger) for prefix in prefixes for trigger in triggers}
+
+    def add(self, position, handler):
+        """ Index a handler, remembering where it was registered. """
+        keys = self.keys(handler.funct)
+        if keys is None:
+            self.passive.append((position, handler))
+            return
+        for key in keys:
+            self.commands.setdefault(key, []).append((position, handler))
+
+    def route(self, event):
+        """ The handlers which should see a PRIVMSG, in registration order. """
+        try:
+            word = event.params[1].split(" ", 1)[0]
+        except IndexError:
+            word = ""
+        matched = self.commands.get((word[:1], word[1:].lower())) if word else None
+        if not matched:
+            return [handler for _, handler in self.passive]
+        handlers = sorted(self.passive + matched, key=operator.itemgetter(0))
+        return [handler for _, handler in handlers]
+
+
+
+class DispatchTables(object):
+    """
+    Immutable lookup tables built from a callback mapping. A blacklist maps
+    lowercased channels, or None for the default, to module name prefixes
+    whose handlers should not see PRIVMSGs there.
+    """
+
+    # Triggers which are not IRC commands.
+    SPECIAL = ("ALL", "DIE")
+
+    def __init__(self, callbacks, blacklist=None):
+        everything = tuple(callbacks.get("ALL", ()))
+        self.types = {trigger: everything + tuple(handlers)
+                      for trigger, handlers in callbacks.items()
+                      if trigger not in self.SPECIAL}
+        self.everything = everything
+        privmsg = tuple(callbacks.get("privmsg", ()))
+        blacklist = blacklist or {}
+        self.channels = {}
+        for channel, modules in blacklist.items():
+            if channel is not None:
+                channel = channel.lower()
+            self.channels[channel] = self.compile(everything, privmsg, modules)
+        if None not in self.channels:
+            self.channels[None] = self.compile(everything, privmsg, ())
+
+    @staticmethod
+    def compile(everything, privmsg, modules):
+        """ The handlers allowed in a channel, and a router for its commands. """
+        modules = tuple(modules)
+
+        def allowed(handler):
+            return not (modules and handler.module is not None
+                        and handler.module.__name__.startswith(modules))
+
+        return (tuple(i for i in everything if allowed(i)),
+                CommandRouter([i for i in privmsg if allowed(i)]))
+
+    def lookup(self, event):
+        """ The handlers which should see an event, in order. """
+        if event.command != "PRIVMSG":
+            return self.types.get(event.type, self.everything)
+        target = event.target
+        table = self.channels.get(target.lower() if target else None)
+        if table is None:
+            table = self.channels[None]
+        everything, router = table
+        return everything + tuple(router.route(event))
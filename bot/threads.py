@@ -7,26 +7,41 @@ import re
 import collections
 import socket
 import inspect
-import fnmatch
 import ssl
 import codecs
+import time
+import base64
+import datetime
+import json
 
 from pathlib import Path
 
 import yaml
 
 import util
-from util.irc import Address, Callback, MAX_MESSAGE_SIZE
-from util.text import TimerBuffer, Buffer
+from util.irc import Address, Callback, Event, HostmaskMatcher, MAX_MESSAGE_SIZE
+from util.text import TimerBuffer, LineFramer
 
 from .workers.executors import (
     AsyncExecutor,
-    FlexicutorPool,
-    Flexicutor,
+    AsyncExecutorPool,
     ExecutorMap,
     InlineExecutor,
+    MutexScheduler,
 )
+from .workers.processes import ProcessExecutor
 from .workers.ircsenders import MultiPrinter
+from .workers.flood import BULK
+from .caps import Capabilities, SUPPORTED
+from .router import DispatchTables
+from .members import Members, Channel
+from .metrics import Metrics
+from .breaker import Breaker
+from .overload import Overload, PROTOCOL, COMMAND, PASSIVE
+from .throttle import InputLimiter
+
+# Sent to wake the reader when a connection is handed off.
+HANDOFF_PING = "PING :handoff"
 
 
 class Connection(threading.Thread, object):
@@ -39,7 +54,11 @@ class Connection(threading.Thread, object):
         self.realname = config["Real Name"]
         self.mode = config.get("Mode", 0)
         self.ssl = config.get("SSL", False)
+        self.certfile = config.get("SSL Cert", None)
         self.password = config.get("Password", None)
+        self.caps = Capabilities(self,
+                                 SUPPORTED + tuple(config.get("Capabilities", ())),
+                                 config.get("SASL", None))
 
         self.nick = None
         self.nicks = config["Nick"]
@@ -50,6 +69,14 @@ class Connection(threading.Thread, object):
 
         self.connected = False
         self.restart = False
+        # Set when the connection is being handed to a new process.
+        self.handoff = False
+        # Output still queued when the connection was handed off.
+        self.unsent = []
+        # Lines received during registration, awaiting dispatch.
+        self.pending = collections.deque()
+        self.started = None
+        self.timings = collections.OrderedDict()
 
         self.encoding = "utf-8"
 
@@ -58,54 +85,155 @@ class Connection(threading.Thread, object):
         if debug is not None:
             self.buff = TimerBuffer(debug, encoding=self.encoding)
         else:
-            self.buff = Buffer(encoding=self.encoding)
+            self.buff = LineFramer(encoding=self.encoding)
 
     def connect(self):
+        self.timings = collections.OrderedDict()
+        self.started = time.time()
         self.sock = socket.socket()
-        if self.ssl:
-            self.sock = ssl.wrap_socket(self.sock)
         print("Connecting...")
         self.sock.connect(self.server)
-        # Try our first nickname.
-        nicks = collections.deque(self.nicks)
-        self.nick = nicks.popleft()
-        self.sendline("USER %s %s * :%s\r\n" % (self.username,
-                                                self.mode,
-                                                self.realname))
-        if self.password is not None:
-            self.sendline("PASS %s" % (self.password))
+        self.mark("tcp")
+        if self.ssl:
+            self.sock = ssl.wrap_socket(self.sock, certfile=self.certfile)
+            self.mark("tls")
+        nicks = self.register_user()
         print("Connected. Trying %s" % self.nick)
-        self.sendline("NICK %s" % self.nick)
         # Find a working nickname
-        while self.buff.append(self.sock.recv(1)):
+        while not self.connected:
+            if not self.buff.recv_into(self.sock):
+                raise ConnectionError("Server closed the connection during "
+                                      "registration.")
             for line in self.buff:
-                words = line.split()
-                if line.startswith("PING") or words[1] == "001":
-                    # We're done here.
-                    self.sendline("PONG %s" % line.split()[-1])
+                if self.handshake(line, nicks):
+                    # We're done here. Unread lines stay in the buffer for run.
                     break
-                errdict = {"433": "Invalid nickname, retrying.",
-                           "436": "Nickname in use, retrying."}
-                if words[1] == "432":
-                    raise ValueError(
-                        "Arguments sent to server are invalid; "
-                        "are you sure the configuration file is correct?"
-                    )
-                elif words[1] in errdict:
-                    print(errdict[words[1]], file=sys.stderr)
-                    self.nick = nicks.popleft()
-                    self.sendline("NICK %s" % self.nick)
-            else:
-                # If we haven't broken out of the loop, our nickname is
-                # not valid.
-                continue
-            break
+        self.mark("registration")
+        self.printer.start()
+        print("Connected in %s." % self.report_timings())
+
+    def resume(self, state):
+        """
+        Take over a connection handed off by a previous process, instead of
+        connecting and registering.
+        """
+        self.timings = collections.OrderedDict()
+        self.started = time.time()
+        self.sock = socket.socket(fileno=state["fd"])
+        self.sock.set_inheritable(False)
+        self.restore(state)
         self.connected = True
+        self.mark("resume")
         self.printer.start()
-        print("Connected.")
+        print("Resumed in %s." % self.report_timings())
+
+    def can_hand_off(self):
+        """ Whether the socket can outlive this process. TLS state cannot. """
+        return self.connected and not self.ssl
+
+    def hand_off(self):
+        """
+        Stop reading without closing the socket, so that a new process can
+        take the connection over. A PING wakes the reader if it is waiting.
+        """
+        self.handoff = True
+        self.printer.raw_message(HANDOFF_PING)
+
+    def snapshot(self):
+        """ The state a new process needs to resume the connection. """
+        unread = "".join("%s\r\n" % i for i in self.pending).encode(self.encoding)
+        unread += bytes(self.buff.view[self.buff.start:self.buff.end])
+        return {
+            "fd": self.sock.fileno(),
+            "unread": base64.b64encode(unread).decode("ascii"),
+            "encoding": self.encoding,
+            "nick": self.nick,
+            "username": self.username,
+            "caps": sorted(self.caps.enabled),
+            "available": self.caps.available,
+            "account": self.caps.account,
+            "unsent": self.unsent,
+        }
+
+    def restore(self, state):
+        """ Restore the state recorded by snapshot. """
+        self.set_encoding(state["encoding"])
+        self.buff.append(base64.b64decode(state["unread"]))
+        self.nick = state["nick"]
+        self.username = state["username"]
+        self.caps.reset()
+        self.caps.enabled = set(state["caps"])
+        self.caps.available = dict(state["available"])
+        self.caps.account = state["account"]
+        # The old process's queued output goes out once the printer starts.
+        for line in state.get("unsent", ()):
+            self.printer.raw_message(line)
+
+    def register_user(self):
+        """
+        Send the registration commands. Returns the queue of nicknames left
+        to try if our first choice is rejected.
+        """
+        nicks = collections.deque(self.nicks)
+        self.nick = nicks.popleft()
+        self.caps.start()
+        if self.password is not None:
+            self.sendline("PASS %s" % (self.password))
+        self.sendline("USER %s %s * :%s" % (self.username,
+                                            self.mode,
+                                            self.realname))
+        self.sendline("NICK %s" % self.nick)
+        return nicks
+
+    def handshake(self, line, nicks):
+        """
+        Process a line of the server preamble, retrying nicknames as needed.
+        Returns True once we are registered.
+        """
+        event = Event(line)
+        if self.caps.handle(event):
+            return False
+        words = event.raw.split()
+        if event.command == "PING":
+            self.sendline("PONG %s" % words[-1])
+        elif len(words) > 1 and words[1] == "001":
+            # Leave the welcome for the dispatch loop, so 001 hooks fire.
+            self.pending.append(line)
+        elif len(words) > 1 and words[1] == "432":
+            raise ValueError(
+                "Arguments sent to server are invalid; "
+                "are you sure the configuration file is correct?"
+            )
+        else:
+            errdict = {"433": "Invalid nickname, retrying.",
+                       "436": "Nickname in use, retrying."}
+            if len(words) > 1 and words[1] in errdict:
+                print(errdict[words[1]], file=sys.stderr)
+                self.nick = nicks.popleft()
+                self.sendline("NICK %s" % self.nick)
+            return False
+        self.connected = True
+        return True
+
+    def mark(self, stage):
+        """ Record the time taken to reach a stage of the connection. """
+        self.timings[stage] = time.time() - self.started
+
+    def report_timings(self):
+        """ Format the connection timings for display. """
+        last, stages = 0, []
+        for stage, elapsed in self.timings.items():
+            stages.append("%s %.3fs" % (stage, elapsed - last))
+            last = elapsed
+        return "%.3fs (%s)" % (last, ", ".join(stages))
 
     def sendline(self, line):
-        self.sock.send(("%s\r\n" % line).encode(self.encoding))
+        self.sendlines([line])
+
+    def sendlines(self, lines):
+        """ Send several lines with a single write. """
+        data = "".join("%s\r\n" % i for i in lines).encode(self.encoding)
+        self.sock.sendall(data)
 
     def dispatch(self, line):
         """
@@ -114,12 +242,29 @@ class Connection(threading.Thread, object):
         """
         return
 
-    def cleanup(self):
+    def quit(self, reason=None):
+        """ Disconnect from the server. """
+        self.connected = False
+        if reason is None:
+            self.sendline("QUIT")
+        else:
+            self.sendline("QUIT :%s" % reason)
+
+    def keep_unsent(self):
+        """ Take the queued output, for the next process to send. """
+        self.unsent = [i for i in self.printer.work.flush() if i != HANDOFF_PING]
+
+    def stop_printer(self):
         # TODO: decouple printer and connection.
+        if self.handoff:
+            self.keep_unsent()
         self.printer.terminate()
         print("Terminating threads...")
 
         self.printer.join()
+
+    def cleanup(self):
+        self.stop_printer()
         if "-d" in sys.argv and self.buff.log:
             print(
                 "%d high latency events recorded, max=%r, avg=%r" % (
@@ -131,13 +276,24 @@ class Connection(threading.Thread, object):
 
     def run(self):
         try:
-            while self.connected and self.buff.append(self.sock.recv(1024)):
+            while self.pending and not self.handoff:
+                self.dispatch(self.pending.popleft())
+            while self.connected and not self.handoff:
                 for line in self.buff:
                     self.dispatch(line)
+                    if self.handoff:
+                        # Leave the rest of the buffer to the next process.
+                        break
+                else:
+                    if not self.buff.recv_into(self.sock):
+                        break
 
         finally:
-            self.sock.close()
-            print("Connection closed.")
+            if self.handoff:
+                print("Connection handed off.")
+            else:
+                self.sock.close()
+                print("Connection closed.")
             self.cleanup()
 
             self.connected = False
@@ -166,6 +322,14 @@ class EventHandler(object):
     INLINE = 1
     THREADSAFE = 2
     BACKGROUND = 4
+    CPU = 8
+    # Executor names, for metrics.
+    EXECUTORS = {GENERAL: "general", INLINE: "inline", THREADSAFE: "threadsafe",
+                 BACKGROUND: "background", CPU: "cpu"}
+
+    @property
+    def executor(self):
+        return self.EXECUTORS[self.cbtype]
 
     @property
     def isInline(self):
@@ -179,6 +343,10 @@ class EventHandler(object):
     def isBackground(self):
         return self.cbtype == self.BACKGROUND
 
+    @property
+    def isCPU(self):
+        return self.cbtype == self.CPU
+
     @property
     def isGeneral(self):
         return self.cbtype == self.GENERAL
@@ -192,6 +360,8 @@ class EventHandler(object):
         if self.module:
             self.name = self.module.__name__ + "." + self.name
         self.funct = function
+        # Most callbacks take the raw line; some take the parsed Event.
+        self.takes_event = Callback.takesEvent(function)
         if Callback.isInline(function):
             self.cbtype = self.INLINE
             self.__mutex__ = {function}
@@ -201,30 +371,86 @@ class EventHandler(object):
         elif Callback.isBackground(function):
             self.cbtype = self.BACKGROUND
             self.__mutex__ = {function}
+        elif Callback.isCPU(function):
+            self.cbtype = self.CPU
+            self.__mutex__ = set()
         else:
             self.cbtype = self.GENERAL
+            # Hooks of a Callback instance share its state, and its mutex.
+            owner = getattr(function, "__self__", None)
             if hasattr(function, '__mutex__'):
                 self.__mutex__ = function.__mutex__
+            elif function in getattr(owner, "__mutex__", ()):
+                self.__mutex__ = owner.__mutex__
             else:
                 self.__mutex__ = {function}
+        if hasattr(function, "priority"):
+            self.priority = function.priority
+        elif self.cbtype == self.INLINE:
+            # Inline handlers are never queued, so never held back.
+            self.priority = PROTOCOL
+        elif hasattr(function, "triggers"):
+            self.priority = COMMAND
+        else:
+            self.priority = PASSIVE
 
     def __call__(self, *args):
+        if args:
+            line = args[-1]
+            if self.takes_event:
+                if isinstance(line, str):
+                    args = args[:-1] + (Event(line),)
+            elif isinstance(line, Event):
+                args = args[:-1] + (line.raw,)
         return self.funct(*args)
 
 
 class Bot(Connection):
 
+    # Lines of netsplit and netjoin batches held at once. Past this, they
+    # are dispatched as they arrive.
+    HELD_SIZE = 4096
+
     def __init__(self, conf, **kwargs):
         super().__init__(conf, **kwargs)
+        # General callbacks run as per mutex set actors on the same pool
+        # as threadsafe ones.
+        pool = AsyncExecutorPool(max_size=8)
+        background = AsyncExecutor()
+        self.processes = ProcessExecutor()
+        # Demoted general callbacks drain their mailboxes in the background.
+        self.scheduler = MutexScheduler(pool, background)
         self.executor = ExecutorMap({
-            EventHandler.BACKGROUND: AsyncExecutor(),
-            EventHandler.GENERAL: Flexicutor(),
-            EventHandler.THREADSAFE: FlexicutorPool(),
+            EventHandler.BACKGROUND: background,
+            EventHandler.GENERAL: self.scheduler,
+            EventHandler.THREADSAFE: pool,
+            EventHandler.CPU: self.processes,
             EventHandler.INLINE: InlineExecutor(),
         }, key=lambda x: x.cbtype)
+        self.metrics = Metrics()
+        self.breaker = Breaker(self, self.config.get("Budgets"), EventHandler.BACKGROUND)
+        self.metrics.observers.append(self.breaker.observe)
+        self.overload = Overload(self.metrics, self.config.get("Overload"))
         self.config_dir = Path(self.get_config_dir())
         self.callbacks = {"ALL": [], "DIE": []}
+        # Held while callbacks change; dispatch only reads self.tables.
+        self.callback_lock = threading.RLock()
+        self.tables = None
+        self.rebuild()
+        # Open IRCv3 batches: reference -> (type, parent reference).
+        self.batches = {}
+        # Lines of open netsplit and netjoin batches, by reference.
+        self.held = {}
         self.register("ping", self.pong)
+        self.register("join", self.first_join)
+        self.register("cap", self.cap_changed)
+        self.register("batch", self.batch)
+
+    def register_user(self):
+        # Batches do not outlive the connection which opened them.
+        self.batches = {}
+        self.held = {}
+        return super().register_user()
 
     def get_config_dir(self, *subdirs):
         # TODO: Deprecate
@@ -236,7 +462,77 @@ class Bot(Connection):
 
     @Callback.inline
     def pong(self, server, line):
-        self.sendline("PONG " + line.split(" ", 1)[1])
+        # Sent through the printer's protocol lane, ahead of queued output.
+        self.printer.raw_message("PONG " + line.split(" ", 1)[1])
+
+    @Callback.inline
+    def first_join(self, server, line):
+        """ Reports how long it took to join our first channel. """
+        if "join" not in self.timings and Address(line.split()[0]).nick == self.nick:
+            self.mark("join")
+            print("Joined first channel %.3fs after connecting." % self.timings["join"])
+
+    @Callback.inline
+    @Callback.event
+    def cap_changed(self, server, event):
+        """ Follow capabilities the server adds or removes after registration. """
+        self.caps.handle(event)
+
+    @Callback.inline
+    @Callback.event
+    def batch(self, server, event):
+        """ Keep track of open batches. """
+        reference = event.params[0]
+        if reference.startswith("+"):
+            self.batches[reference[1:]] = (event.params[1], event.batch)
+        else:
+            self.batches.pop(reference[1:], None)
+
+    def hold(self, event):
+        """
+        Hold back the lines of netsplit and netjoin batches, and hand them
+        to the line closing the batch. Returns True if the event was held.
+        """
+        if event.command == "BATCH" and event.params:
+            reference = event.params[0]
+            if reference.startswith("+"):
+                if event.params[1:2] and event.params[1] in COLLECTED_BATCHES:
+                    self.held[reference[1:]] = []
+            else:
+                event.events = self.held.pop(reference[1:], None)
+            return False
+        held = self.held.get(event.batch)
+        if held is None or sum(map(len, self.held.values())) >= self.HELD_SIZE:
+            return False
+        held.append(event)
+        return True
+
+    def batch_types(self, event):
+        """ The types of the batches an event belongs to, innermost first. """
+        types = []
+        reference = event.batch
+        while reference in self.batches and len(types) <= len(self.batches):
+            kind, reference = self.batches[reference]
+            types.append(kind)
+        return types
+
+    def snapshot(self):
+        state = super().snapshot()
+        state["batches"] = self.batches
+        state["held"] = {ref: [[i.tags, i.raw] for i in events]
+                         for ref, events in self.held.items()}
+        return state
+
+    def restore(self, state):
+        super().restore(state)
+        self.batches = {ref: tuple(batch) for ref, batch in state["batches"].items()}
+        self.held = {}
+        for ref, lines in state.get("held", {}).items():
+            self.held[ref] = []
+            for tags, raw in lines:
+                event = Event(raw)
+                event.tags = tags
+                self.held[ref].append(event)
 
     def cleanup(self):
         super().cleanup()
@@ -248,18 +544,40 @@ class Bot(Connection):
         self.executor.join()
         print("Threads terminated.")
 
-    def run(self):
+    def start_executors(self):
         self.executor.start()
+        # Plugins are loaded by now, so workers can set their modules up
+        # as they start.
+        modules = {i.funct.__module__ for handlers in self.callbacks.values()
+                   for i in handlers if i.isCPU}
+        if modules:
+            self.processes.warm(modules)
+
+    def run(self):
+        self.start_executors()
         super().run()
 
+    def compile(self):
+        """ Build dispatch tables from the current callbacks. """
+        return DispatchTables(self.callbacks)
+
+    def rebuild(self):
+        """ Swap in dispatch tables for the current callbacks. """
+        with self.callback_lock:
+            self.tables = self.compile()
+
     def register_all(self, callbacks):
-        for trigger in callbacks:
-            for f in callbacks[trigger]:
-                self.register(trigger, f)
+        with self.callback_lock:
+            for trigger in callbacks:
+                for f in callbacks[trigger]:
+                    self.callbacks.setdefault(trigger, []).append(EventHandler(trigger, f))
+            self.rebuild()
 
     def register(self, trigger, funct):
         callback = EventHandler(trigger, funct)
-        self.callbacks.setdefault(trigger, []).append(callback)
+        with self.callback_lock:
+            self.callbacks.setdefault(trigger, []).append(callback)
+            self.rebuild()
 
     def unregister_funct(self, callback, trigger=None):
         removed = []
@@ -268,10 +586,12 @@ class Bot(Connection):
         else:
             triggers = self.callbacks.keys()
 
-        for i in triggers:
-            while callback in self.callbacks[i]:
-                self.callbacks[i].remove(callback)
-                removed.append(i)
+        with self.callback_lock:
+            for i in triggers:
+                while callback in self.callbacks[i]:
+                    self.callbacks[i].remove(callback)
+                    removed.append(i)
+            self.rebuild()
 
         return removed
 
@@ -282,27 +602,48 @@ class Bot(Connection):
         else:
             triggers = self.callbacks.keys()
 
-        for i in triggers:
-            remove = [i for i in self.callbacks[i] if i.name == funct]
-            for f in remove:
-                self.callbacks[i].remove(f)
-                removed.append(i)
+        with self.callback_lock:
+            for i in triggers:
+                remove = [i for i in self.callbacks[i] if i.name == funct]
+                for f in remove:
+                    self.callbacks[i].remove(f)
+                    removed.append(i)
+            self.rebuild()
         return removed
 
     def execute(self, handler, line):
-        """ Executes a callback. """
-        self.executor.call(handler, self, line)
+        """
+        Executes a callback, recording its metrics. Handlers the breaker
+        has demoted run in the background, and disabled ones do not run.
+        Under load, passive handlers are shed before anything else.
+        """
+        cbtype = self.breaker.route(handler)
+        if cbtype is None or not self.overload.admit(handler):
+            return
+        timed = self.metrics.timed(handler, EventHandler.EXECUTORS[cbtype], cbtype)
+        if cbtype != handler.cbtype and handler.cbtype == EventHandler.GENERAL:
+            # Keep its place in its mutex set, so it still excludes the
+            # rest of its plugin.
+            self.scheduler.call_slow(timed, self, line)
+        else:
+            self.executor.call(timed, self, line)
+        # Only count calls the executor took.
+        self.metrics.enqueued(timed)
 
     def dispatch(self, line):
         """
         Self-balancing threaded dispatch
         """
-        line = line.rstrip()
-        words = line.split()
-        msgType = words[words[0] not in ["PING", "ERROR"]].lower()
+        event = Event(line.rstrip())
+        if self.hold(event):
+            return
 
-        for funct in self.callbacks["ALL"] + self.callbacks.get(msgType.lower(), []):
-            self.execute(funct, line)
+        for funct in self.select(event):
+            self.execute(funct, event)
+
+    def select(self, event):
+        """ The callbacks which should see an event. """
+        return self.tables.lookup(event)
 
     def loadplugin(self, mod):
         """ The following can optionally be defined to hook into karkat:
@@ -329,17 +670,132 @@ class Bot(Connection):
             print("        Registered destructor: %s" % mod.__destroy__.__name__)
 
 class SelectiveBot(Bot):
+    """
+    A bot with per-channel module blacklists and ignore lists. Blacklisted
+    modules are left out of the dispatch tables, so change the blacklist
+    through these methods rather than by hand.
+
+    Messages from ignored users only reach callbacks registered for ALL,
+    such as the logger. Admins cannot be ignored.
+
+    Commands are rate limited per user and per channel before they are
+    queued; see bot.throttle. Admins are not limited.
+
+    Config:
+        Ignore: a list of masks to ignore everywhere, or a mapping of
+                channels to lists of masks.
+        Input Limits: per command class rate limits, see bot.throttle.
+    """
+
+    # Commands from ignored users which are dropped.
+    IGNORED_COMMANDS = {"PRIVMSG", "NOTICE"}
+
     def __init__(self, conf, **kwargs):
-        super().__init__(conf, **kwargs)
+        # Dispatch tables are first built by Bot.__init__.
         self.blacklist = {None: []}
+        self.ignores = {}
+        super().__init__(conf, **kwargs)
+        # Bare hosts in the admin list match anyone from that host.
+        self.admin_masks = HostmaskMatcher(
+            [i if "!" in i else ("*!" + i if "@" in i else "*!*@" + i)
+             for i in self.admins],
+            self.lower
+        )
+        ignores = self.config.get("Ignore", [])
+        if isinstance(ignores, dict):
+            for channel, masks in ignores.items():
+                for mask in masks:
+                    self.ignore(mask, channel)
+        else:
+            for mask in ignores:
+                self.ignore(mask)
+        self.limiter = InputLimiter(self.config.get("Input Limits"), self.lower)
+
+    @staticmethod
+    def lower(name):
+        return name.lower()
+
+    def is_admin(self, address):
+        return self.admin_masks.match(address)
+
+    def ignore(self, mask, channel=None):
+        """ Ignore a mask in a channel, or everywhere. """
+        key = self.lower(channel) if channel is not None else None
+        matcher = self.ignores.get(key)
+        if matcher is None:
+            matcher = self.ignores[key] = HostmaskMatcher((), self.lower)
+        matcher.add(mask)
+
+    def unignore(self, mask, channel=None):
+        """ Stop ignoring a mask. Returns False if it was not ignored. """
+        key = self.lower(channel) if channel is not None else None
+        matcher = self.ignores.get(key)
+        if matcher is None or mask not in matcher.masks:
+            return False
+        matcher.remove(mask)
+        return True
+
+    def is_ignored(self, hostmask, channel=None):
+        for key in (None, self.lower(channel) if channel is not None else None):
+            matcher = self.ignores.get(key)
+            if matcher is not None and matcher.match(hostmask):
+                return not self.is_admin(hostmask)
+        return False
 
     def execute(self, handler, line):
-        """ Executes a callback. """
-        # TODO: replace queues with something more generic.
-        # Check if PRIVMSG:
-        data = line.split()
-        if data[1] != "PRIVMSG" or not any(handler.module.__name__.startswith(i) for i in self.blacklist.get(data[2].lower(), self.blacklist[None])):
-            super().execute(handler, line)
+        """ Drops commands from users who are sending them too fast. """
+        if (handler.priority == COMMAND and line.address is not None
+                and not self.is_admin(line.prefix)):
+            allowed, notify = self.limiter.check(handler, line, time.time())
+            if notify:
+                self.printer.message("\x0304Throttle│\x03 You're sending commands "
+                                     "too quickly. Slow down.", line.nick, "NOTICE")
+            if not allowed:
+                self.metrics.drop(handler.name, "throttled")
+                return
+        super().execute(handler, line)
+
+    def select(self, event):
+        if (self.ignores and event.command in self.IGNORED_COMMANDS
+                and event.address is not None
+                and self.is_ignored(event.prefix, event.target)):
+            return self.tables.everything
+        return super().select(event)
+
+    def recompile_masks(self):
+        """ Recompile hostmask matchers after the casemapping changes. """
+        self.admin_masks.invalidate()
+        for matcher in self.ignores.values():
+            matcher.invalidate()
+
+    def compile(self):
+        return DispatchTables(self.callbacks, self.blacklist)
+
+    def disable(self, channel, module):
+        """ Blacklist a module in a channel. Returns False if it already was. """
+        with self.callback_lock:
+            blacklisted = self.blacklist.setdefault(channel, list(self.blacklist[None]))
+            if module in blacklisted:
+                return False
+            blacklisted.append(module)
+            self.rebuild()
+        return True
+
+    def enable(self, channel, module):
+        """ Lift a module's blacklisting. Returns False if it was not blacklisted. """
+        with self.callback_lock:
+            blacklisted = self.blacklist.setdefault(channel, list(self.blacklist[None]))
+            if module not in blacklisted:
+                return False
+            blacklisted.remove(module)
+            self.rebuild()
+        return True
+
+    def update_blacklist(self, blacklist):
+        """ Merge a saved blacklist into this one. """
+        with self.callback_lock:
+            self.blacklist.update(blacklist)
+            self.rebuild()
 
 
 class IAL(object):
@@ -352,6 +808,12 @@ class IAL(object):
                 return i
 
 
+# Batch types which replay old messages.
+HISTORY_BATCHES = {"chathistory", "znc.in/playback"}
+# Batch types which arrive as one event, on the line closing the batch.
+COLLECTED_BATCHES = {"netsplit", "netjoin"}
+
+
 class StatefulBot(SelectiveBot):
     """ Beware of thread safety when manipulating server state. If a callback
     interacts with this class, it must either be inlined, or be
@@ -364,63 +826,158 @@ class StatefulBot(SelectiveBot):
     #       See xchat docs for interface ideas.
     # TODO: Fix nickname case rules and do sanity checking
 
+    # Fields asked of WHOX: token, channel, user, host, nick, flags, account.
+    WHOX_FIELDS = "%tcuhnfa"
+    WHOX_TOKEN = "152"
+    # Channels synced at once. The rest wait their turn.
+    SYNC_LIMIT = 2
+    # Nicks remembered as lost to netsplits.
+    SPLITS_SIZE = 4096
+    # Seconds for which list modes saved on disconnect are trusted on a
+    # cold start, instead of being asked for again. Set with "List Cache".
+    LIST_CACHE_TTL = 3600
+    LIST_CACHE = "lists.json"
+
     def __init__(self, conf, **kwargs):
+        # Casemapping is needed as soon as SelectiveBot reads its ignores.
+        self.members = Members()
         super().__init__(conf, **kwargs)
         self.features = []
-        self.channels = {}
+        # Channel keys to Channels, which work like sets of nicks.
+        self.channels = self.members.channels
         self.server_settings = {}
         self.away = None
         self.valid_modes = ([], [])
-        self.user_modes = {}
         self.channel_modes = {}
+        # Matchers for list modes, by (channel key, mode). Built on demand.
+        self.list_masks = {}
         self.listbuffer = {}
         self.topic = {}
         self.hostmask = None
+        # Nick keys lost to netsplits, and when they split by server-time.
+        self.splits = collections.OrderedDict()
+        # Channel sync: what each channel still waits on, channels waiting
+        # to start, and an Event per channel which is set once synced.
+        self.syncing = {}
+        self.sync_queue = collections.deque()
+        self.synced = {}
+        # List modes saved by the last process, by channel key.
+        self.cached_lists = self.load_lists()
         # TODO: parse these.
         self.rawmap = {346: "I", 348: "e", 367: "b", 386: "q", 388: "a"}
-        self.register_all({
+        state = {
             "quit": [self.user_quit],
             "part": [self.user_left],
             "join": [self.user_join],
             "nick": [self.user_nickchange],
             "kick": [self.user_kicked],
+            "batch": [self.netsplit],
             "mode": [self.channel_mode],
             "topic": [self.topic_changed],
             "002": [self.on_connect],
             "332": [self.channel_topic],
             "352": [self.joined_channel],
+            "354": [self.joined_channel_whox],
+            "315": [self.who_end],
+            "482": [self.sync_refused],
             "005": [self.onServerSettings],
             "306": [self.went_away],
             "305": [self.came_back],
             "301": [self.user_awaymsg],
             "324": [self.joined_channel_modes],
-        })
+        }
         for i in self.rawmap:
-            self.register(str(i), self.list_builder)
-            self.register(str(i+1), self.list_end)
+            state[str(i)] = [self.list_builder]
+            state[str(i+1)] = [self.list_end]
+        self.state_handlers = {f for handlers in state.values() for f in handlers}
+        self.register_all(state)
+
+    def execute(self, handler, line):
+        # Replayed history describes the past, not the channels as they are.
+        if handler.funct in self.state_handlers and self.replayed(Event.of(line)):
+            return
+        super().execute(handler, line)
+
+    def replayed(self, event):
+        """ True if an event is part of a history playback batch. """
+        return (event.batch is not None
+                and any(i in HISTORY_BATCHES for i in self.batch_types(event)))
+
+    def snapshot(self):
+        """
+        Adds what is known of the channels, so a resumed bot does not have
+        to sync them again. Channels still syncing are synced from scratch.
+        """
+        state = super().snapshot()
+        state.update({
+            "server_settings": self.server_settings,
+            "features": self.features,
+            "valid_modes": self.valid_modes,
+            "hostmask": self.hostmask,
+            "away": self.away,
+            "topic": self.topic,
+            "channel_modes": self.channel_modes,
+            "channels": [
+                {"name": channel.name,
+                 "members": [[i.user.nick, i.user.ident, i.user.host,
+                              i.user.account, i.modes]
+                             for i in channel.members.values()]}
+                for channel in self.channels.values()
+            ],
+            "unsynced": [channel.name for channel in self.channels.values()
+                         if not self.is_synced(channel.name)],
+        })
+        return state
+
+    def restore(self, state):
+        super().restore(state)
+        self.server_settings = state["server_settings"]
+        self.features = state["features"]
+        self.valid_modes = state["valid_modes"]
+        self.hostmask = state["hostmask"]
+        self.away = state["away"]
+        self.topic = state["topic"]
+        self.channel_modes = state["channel_modes"]
+        self.members.set_casemapping(self.server_settings.get("CASEMAPPING", "ascii"))
+        for channel in state["channels"]:
+            self.members.add_channel(channel["name"])
+            for nick, ident, host, account, modes in channel["members"]:
+                user = self.members.join(channel["name"], nick, modes).user
+                user.ident, user.host, user.account = ident, host, account
+        self.recompile_masks()
+        for channel in self.channels.values():
+            if channel.name in state["unsynced"]:
+                self.sync(channel.name)
+            else:
+                self.synced.setdefault(channel.key, threading.Event()).set()
+
+    def cleanup(self):
+        if not self.handoff:
+            # A hot restart carries the lists over in its snapshot instead.
+            try:
+                self.save_lists()
+            except OSError:
+                print("Could not save channel lists.", file=sys.stderr)
+        super().cleanup()
 
     def nickcmp(self, nick1, nick2):
         """ Implements RFC-compliant nickcmp """
         return util.cmp(self.nickkey(nick1), self.nickkey(nick2))
 
     def nickkey(self, nick):
-        """ Maps a nick to it's rfc-compliant lowercase form. """
-        if self.server_settings.get("CASEMAPPING", "ascii") == "rfc1459":
-            return util.rfc_nickkey(nick)
-        else:
-            return nick.lower()
+        """ Maps a nick to its lowercase form under the server's casemapping. """
+        return nick.translate(self.members.table)
 
     lower = nickkey  # for convenience
 
     def isIn(self, nick, ls):
+        if isinstance(ls, Channel):
+            return nick in ls
         return self.lower(nick) in [self.lower(i) for i in ls]
 
     def eq(self, nick1, nick2):
         return self.nickcmp(nick1, nick2) == 0
 
-    def is_admin(self, address):
-        return any(fnmatch.fnmatch(address, i) for i in self.admins) or any(address.endswith("@" + i) for i in self.admins)
-
     def can_send(self, message, target, method):
         msg = ":%s!%s@%s %s\r\n" % (self.nick, self.username, self.hostmask, self.printer.pack(message, target, method))
         return len(msg.encode(self.encoding)) <= MAX_MESSAGE_SIZE
@@ -432,8 +989,31 @@ class StatefulBot(SelectiveBot):
 
         if action == "+":
             settings.append(arg)
-        else:
+        elif arg in settings:
             settings.remove(arg)
+        self.list_masks.pop((self.lower(channel), mode), None)
+
+    def mask_list(self, channel, mode):
+        """ A matcher for one of a channel's list modes, such as its bans. """
+        key = (self.lower(channel), mode)
+        matcher = self.list_masks.get(key)
+        if matcher is None:
+            matcher = HostmaskMatcher(self.get_list(channel, mode), self.lower)
+            self.list_masks[key] = matcher
+        return matcher
+
+    def is_banned(self, channel, hostmask):
+        """ True if a hostmask matches a ban and no ban exception. """
+        return (self.mask_list(channel, "b").match(hostmask)
+                and not self.mask_list(channel, "e").match(hostmask))
+
+    def is_invited(self, channel, hostmask):
+        """ True if a hostmask is on a channel's invite exception list. """
+        return self.mask_list(channel, "I").match(hostmask)
+
+    def recompile_masks(self):
+        super().recompile_masks()
+        self.list_masks.clear()
 
     def parse_B_mode(self, channel, action, mode, args):
         settings = self.channel_modes.setdefault(self.lower(channel), {})
@@ -462,13 +1042,14 @@ class StatefulBot(SelectiveBot):
             del settings[mode]
 
     def parse_user_mode(self, channel, action, mode, args):
-        settings = self.user_modes.setdefault(self.lower(channel), {})
-        user = args.pop(0)
-        settings = settings.setdefault(self.lower(user), [])
+        member = self.members.membership(channel, args.pop(0))
+        if member is None:
+            return
         if action == "+":
-            settings.append(mode)
-        else:
-            settings.remove(mode)
+            if mode not in member.modes:
+                member.modes.append(mode)
+        elif mode in member.modes:
+            member.modes.remove(mode)
 
     def set_modes(self, channel, modes, args):
         """
@@ -502,7 +1083,8 @@ class StatefulBot(SelectiveBot):
                     self.parse_D_mode(channel, action, i, args)
 
     def get_user_modes(self, channel, username):
-        return self.user_modes.get(self.lower(channel), {}).get(self.lower(username), [])
+        member = self.members.membership(channel, username)
+        return member.modes if member is not None else []
 
     def rank_to_int(self, rank):
         if rank in self.valid_modes[0]:
@@ -553,6 +1135,8 @@ class StatefulBot(SelectiveBot):
         words = line.split(" ")
         self.channel_modes.setdefault(self.lower(words[3]), {}).update({self.rawmap[int(words[1])-1]: self.listbuffer.get((int(words[1])-1, self.lower(words[3])), [])})
         self.listbuffer[int(words[1])-1, self.lower(words[3])] = []
+        self.list_masks.pop((self.lower(words[3]), self.rawmap[int(words[1])-1]), None)
+        self.sync_done(words[3], self.rawmap[int(words[1])-1])
 
     @Callback.inline
     def channel_mode(self, server, line):
@@ -566,6 +1150,123 @@ class StatefulBot(SelectiveBot):
         words = line.split(" ")
         channel, modes, args = words[3], words[4], words[5:]
         self.set_modes(channel, modes, args)
+        self.sync_done(channel, "modes")
+
+    # Channel sync
+
+    def sync(self, channel):
+        """
+        Fetch a channel's users and modes. Queries go out in the printer's
+        bulk lane, and only SYNC_LIMIT channels are synced at a time, so
+        joining many channels does not flood the server or delay replies.
+        """
+        key = self.lower(channel)
+        self.synced.setdefault(key, threading.Event()).clear()
+        if key in self.syncing or channel in self.sync_queue:
+            return
+        if len(self.syncing) < self.SYNC_LIMIT:
+            self.start_sync(channel)
+        else:
+            self.sync_queue.append(channel)
+
+    def start_sync(self, channel):
+        """ Send the queries for a channel, skipping lists saved recently. """
+        key = self.lower(channel)
+        lists = [i for i in self.server_settings.get("CHANMODES", "").split(",")[0]
+                 if i in self.rawmap.values()]
+        cached = self.cached_lists.pop(key, {})
+        for mode in [i for i in lists if i in cached]:
+            self.channel_modes.setdefault(key, {})[mode] = cached[mode]
+            self.list_masks.pop((key, mode), None)
+            lists.remove(mode)
+        self.syncing[key] = ["who", "modes"] + lists
+        if "WHOX" in self.server_settings:
+            who = "WHO %s %s,%s" % (channel, self.WHOX_FIELDS, self.WHOX_TOKEN)
+        else:
+            who = "WHO %s" % channel
+        queries = [who, "MODE %s" % channel]
+        queries.extend("MODE %s %s" % (channel, i) for i in lists)
+        for query in queries:
+            self.printer.raw_message(query, BULK)
+
+    def sync_done(self, channel, part):
+        """ Note a reply to a sync query, finishing the sync if it was the last. """
+        key = self.lower(channel)
+        pending = self.syncing.get(key)
+        if pending is None or part not in pending:
+            return
+        pending.remove(part)
+        if not pending:
+            del self.syncing[key]
+            self.synced.setdefault(key, threading.Event()).set()
+            self.next_sync()
+
+    def next_sync(self):
+        while self.sync_queue and len(self.syncing) < self.SYNC_LIMIT:
+            channel = self.sync_queue.popleft()
+            if self.lower(channel) in self.channels:
+                self.start_sync(channel)
+
+    def forget_sync(self, channel):
+        """ Stop syncing a channel we have left. """
+        key = self.lower(channel)
+        self.syncing.pop(key, None)
+        self.synced.pop(key, None)
+        self.next_sync()
+
+    def save_lists(self):
+        """
+        Save the list modes of synced channels, so the next cold start can
+        skip asking for them.
+        """
+        lists = {}
+        for key, channel in self.channels.items():
+            if self.is_synced(channel.name):
+                modes = self.get_channel_modes(key)
+                lists[key] = {i: modes[i] for i in self.rawmap.values() if i in modes}
+        with open(str(self.config_dir / self.LIST_CACHE), "w") as f:
+            json.dump({"time": time.time(), "lists": lists}, f)
+
+    def load_lists(self):
+        """ The list modes saved by save_lists, if they are fresh enough. """
+        try:
+            with open(str(self.config_dir / self.LIST_CACHE)) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        ttl = self.config.get("List Cache", self.LIST_CACHE_TTL)
+        if time.time() - saved.get("time", 0) > ttl:
+            return {}
+        return saved.get("lists", {})
+
+    def is_synced(self, channel):
+        event = self.synced.get(self.lower(channel))
+        return event is not None and event.is_set()
+
+    def wait_synced(self, channel, timeout=None):
+        """
+        Block until a channel's users and modes are known. Returns False on
+        timeout. Inline callbacks must not wait, as they hold up the replies.
+        """
+        return self.synced.setdefault(self.lower(channel), threading.Event()).wait(timeout)
+
+    @Callback.inline
+    def who_end(self, server, line):
+        """ Handles 315s (end of WHO) """
+        self.sync_done(line.split(" ")[3], "who")
+
+    @Callback.inline
+    def sync_refused(self, server, line):
+        """
+        Handles 482s: some lists are only visible to channel operators.
+        Replies arrive in the order the queries were sent, so a 482 only
+        answers a list query once everything sent before it is answered.
+        Any other 482, such as for a plugin's KICK, is not ours.
+        """
+        channel = line.split(" ")[3]
+        pending = self.syncing.get(self.lower(channel))
+        if pending and len(pending[0]) == 1:
+            self.sync_done(channel, pending[0])
 
 
     @Callback.inline
@@ -604,6 +1305,10 @@ class StatefulBot(SelectiveBot):
                 #        raise Warning("Server sent invalid charset %r, using %s." % (value, self.encoding))
                 self.server_settings[key] = value
 
+        casemapping = self.members.casemapping
+        self.members.set_casemapping(self.server_settings.get("CASEMAPPING", "ascii"))
+        if self.members.casemapping != casemapping:
+            self.recompile_masks()
         if "PREFIX" in self.server_settings:
             self.valid_modes = [list(i) for i in re.match(r"\((.+)\)(.+)", self.server_settings["PREFIX"]).groups()]
 
@@ -615,33 +1320,51 @@ class StatefulBot(SelectiveBot):
         nick = Address(words[0]).nick
         channel = self.lower(words[2])
         if self.eq(nick, self.nick):
-            del self.channels[channel]
+            self.members.remove_channel(channel)
+            self.forget_sync(channel)
         else:
-            self.channels[channel].remove(nick)
+            self.members.part(channel, nick)
 
     @Callback.inline
     def user_quit(self, server, line):
         """ Handles QUITs"""
         words = line.split()
-        nick = Address(words[0]).nick
-        for i in self.channels:
-            if self.isIn(nick, self.channels[i]):
-                self.channels[i].remove(nick) # Note: May error. This might indicate a logic error or a bastard server.
+        self.members.quit(Address(words[0]).nick)
+
+    @Callback.inline
+    @Callback.event
+    def netsplit(self, server, event):
+        """ Applies a netsplit or netjoin batch as one membership update. """
+        if not event.events:
+            return
+        for i in event.events:
+            if i.command == "QUIT" and i.nick is not None:
+                self.members.quit(i.nick)
+                self.splits[self.lower(i.nick)] = i.time or datetime.datetime.utcnow()
+                if len(self.splits) > self.SPLITS_SIZE:
+                    self.splits.popitem(last=False)
+            elif i.command == "JOIN" and i.address is not None and i.params:
+                self.splits.pop(self.lower(i.nick), None)
+                user = self.members.join(i.params[0], i.nick).user
+                user.ident, user.host = i.address.ident, i.address.mask
+
+    def split_time(self, nick):
+        """ When a nick was lost to a netsplit, or None. """
+        return self.splits.get(self.lower(nick))
 
     @Callback.inline
     def user_join(self, server, line):
         """ Handles JOINs """
         words = line.split()
-        nick = Address(words[0]).nick
-        channel = self.lower(words[2][1:])
-        if self.eq(nick, self.nick):
-            self.channels[channel] = set()
-            self.sendline("WHO %s" % words[2]) # TODO: replace with connection object shit.
-            self.sendline("MODE %s" % words[2])
-            for i in self.server_settings["CHANMODES"].split(",")[0]: # Lists
-                self.sendline("MODE %s %s" % (words[2][1:], i))
+        address = Address(words[0])
+        channel = words[2].lstrip(":")
+        if self.eq(address.nick, self.nick):
+            self.members.add_channel(channel)
+            self.sync(channel)
         else:
-            self.channels[channel].add(nick)
+            self.splits.pop(self.lower(address.nick), None)
+            user = self.members.join(channel, address.nick).user
+            user.ident, user.host = address.ident, address.mask
 
     @Callback.inline
     def joined_channel(self, server, line):
@@ -649,19 +1372,33 @@ class StatefulBot(SelectiveBot):
         words = line.split()
         if self.eq(words[7], self.nick):
             self.username, self.hostmask = words[4], words[5]
-        self.channels.setdefault(self.lower(words[3]), set()).add(words[7])
-        self.user_modes.setdefault(self.lower(words[3]), {}).update({self.lower(words[7]): [self.valid_modes[0][self.valid_modes[1].index(i)] for i in words[8] if i in self.valid_modes[1]]})
+        user = self.members.join(words[3], words[7], self.prefix_modes(words[8])).user
+        user.ident, user.host = words[4], words[5]
+
+    @Callback.inline
+    def joined_channel_whox(self, server, line):
+        """ Handles 354s (WHOX replies to our sync queries) """
+        words = line.split()
+        if len(words) < 10 or words[3] != self.WHOX_TOKEN:
+            return
+        channel, user, host, nick, flags, account = words[4:10]
+        if self.eq(nick, self.nick):
+            self.username, self.hostmask = user, host
+        record = self.members.join(channel, nick, self.prefix_modes(flags)).user
+        record.ident, record.host = user, host
+        record.account = None if account == "0" else account
+
+    def prefix_modes(self, flags):
+        """ The prefix modes a set of WHO flags such as H@+ stands for. """
+        return [self.valid_modes[0][self.valid_modes[1].index(i)] for i in flags if i in self.valid_modes[1]]
 
     @Callback.inline
     def user_nickchange(self, server, line):
         """ Handles NICKs """
         words = line.split()
         nick = Address(words[0]).nick
-        newnick = words[2][1:]
-        for i in self.channels:
-            if nick in self.channels[i]:
-                self.channels[i].remove(nick)
-                self.channels[i].add(newnick)
+        newnick = words[2].lstrip(":")
+        self.members.rename(nick, newnick)
         if self.eq(nick, self.nick):
             self.nick = newnick
 
@@ -671,7 +1408,11 @@ class StatefulBot(SelectiveBot):
         words = line.split()
         nick = words[3]
         channel = self.lower(words[2])
-        self.channels[channel].remove(nick)
+        if self.eq(nick, self.nick):
+            self.members.remove_channel(channel)
+            self.forget_sync(channel)
+        else:
+            self.members.part(channel, nick)
 
     @Callback.inline
     def on_connect(self, server, line):
@@ -0,0 +1,154 @@
+"""
+Per-user input rate limiting.
+
+Each command belongs to a class, such as "network" for commands which call
+out to web services or "command" for everything else. Every class gives
+each hostmask a token bucket, and each channel another, and a command is
+only queued if both buckets hold a token. Messages that trigger several
+handlers only cost one token.
+
+A user who runs out is sent a single notice; the rest of their commands
+are dropped silently until their bucket refills. Admins are not limited.
+
+A command picks its class with a rate_class attribute, or by being listed
+in a class's commands, or by living in one of a class's modules.
+
+Config:
+    Input Limits: a mapping of class names to any of
+                  {rate: 0.5, burst: 5, channel rate: 2, channel burst: 10,
+                   commands: [...], modules: [...]}
+                  A rate of 0 lifts that limit.
+"""
+
+from .router import CommandRouter
+from .workers.flood import TokenBucket
+
+DEFAULT = "command"
+
+CLASSES = {
+    DEFAULT: {"rate": 0.5, "burst": 5, "channel rate": 2, "channel burst": 10},
+    "network": {"rate": 0.2, "burst": 3, "channel rate": 0.5, "channel burst": 5,
+                "modules": ["plugins.web"]},
+}
+
+
+class RateClass(object):
+    """ The limits for one class of commands. """
+
+    def __init__(self, name, config):
+        self.name = name
+        self.rate = config.get("rate", 0)
+        self.burst = config.get("burst", 1)
+        self.channel_rate = config.get("channel rate", 0)
+        self.channel_burst = config.get("channel burst", 1)
+        self.commands = {i.lower() for i in config.get("commands", ())}
+        self.modules = tuple(config.get("modules", ()))
+
+
+class InputLimiter(object):
+    """
+    Token buckets for each (class, hostmask) and (class, channel) pair.
+
+    Note: This object is not thread safe. It is only used from dispatch.
+    """
+
+    # Buckets are swept for ones which have refilled past this many.
+    PRUNE_AT = 1000
+
+    def __init__(self, config=None, lower=str.lower):
+        self.lower = lower
+        config = config if config is not None else {}
+        self.classes = {}
+        for name in set(CLASSES) | set(config):
+            settings = dict(CLASSES.get(name, CLASSES[DEFAULT]))
+            settings.update(config.get(name) or {})
+            self.classes[name] = RateClass(name, settings)
+        self.buckets = {}
+        self.noticed = set()
+        self.event = None
+        self.decisions = {}
+
+    def classify(self, handler):
+        """ The class of a command handler. """
+        funct = handler.funct
+        name = getattr(funct, "rate_class", None)
+        if name in self.classes:
+            return self.classes[name]
+        triggers = getattr(funct, "triggers", ())
+        module = handler.module.__name__ if handler.module is not None else ""
+        for rate_class in self.classes.values():
+            if (rate_class.commands.intersection(triggers)
+                    or rate_class.modules and module.startswith(rate_class.modules)):
+                return rate_class
+        return self.classes[DEFAULT]
+
+    @staticmethod
+    def triggered(handler, event):
+        """ True if an event's first word is one of a handler's commands. """
+        keys = CommandRouter.keys(handler.funct)
+        if keys is None:
+            # We can't tell, so don't charge for it.
+            return False
+        word = event.trailing.split(" ", 1)[0] if event.trailing else ""
+        return (word[:1], word[1:].lower()) in keys
+
+    def keys(self, rate_class, event):
+        """ The buckets an event draws from, with their rates and bursts. """
+        address = event.address
+        keys = [((rate_class.name, "user", self.lower("%s@%s" % (address.ident, address.mask))),
+                 rate_class.rate, rate_class.burst)]
+        target = event.target
+        if target is not None and "#" in target:
+            keys.append(((rate_class.name, "channel", self.lower(target)),
+                         rate_class.channel_rate, rate_class.channel_burst))
+        return keys
+
+    def check(self, handler, event, now):
+        """
+        Decide whether an event may trigger a handler. Returns a pair of
+        whether it may, and whether the sender should be told it may not.
+        """
+        if event.command != "PRIVMSG" or event.address is None:
+            return True, False
+        if not self.triggered(handler, event):
+            return True, False
+        rate_class = self.classify(handler)
+        if event is not self.event:
+            self.event, self.decisions = event, {}
+        elif rate_class.name in self.decisions:
+            # Another handler for the same command has already paid.
+            return self.decisions[rate_class.name], False
+        keys, buckets = self.keys(rate_class, event), []
+        for key, rate, burst in keys:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if not rate:
+                    continue
+                if len(self.buckets) >= self.PRUNE_AT:
+                    self.prune(now)
+                bucket = self.buckets[key] = TokenBucket(rate, burst)
+            buckets.append(bucket)
+        # Notices go to the user, whichever of their buckets ran dry.
+        user, notify = keys[0][0], False
+        allowed = all(i.available(now) >= 1 for i in buckets)
+        if allowed:
+            # Only pay once every bucket can.
+            for bucket in buckets:
+                bucket.consume(now)
+            self.noticed.discard(user)
+        elif user not in self.noticed:
+            if len(self.noticed) >= self.PRUNE_AT:
+                self.prune(now)
+            self.noticed.add(user)
+            notify = True
+        self.decisions[rate_class.name] = allowed
+        return allowed, notify
+
+    def prune(self, now):
+        """ Forget buckets which have refilled, as they would be made anew. """
+        for key, bucket in list(self.buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self.buckets[key]
+        # Users without a bucket of their own are told again after this.
+        self.noticed.intersection_update(self.buckets)
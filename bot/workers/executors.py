@@ -2,12 +2,13 @@
 Objects for dispatching function calls.
 """
 
+import collections
 import sys
 import time
 
 from abc import ABC, abstractmethod
-from functools import wraps
-from threading import Lock
+from queue import Empty
+from threading import Event, Lock, Thread
 
 from .worker import Worker
 from .work import Work
@@ -120,189 +121,208 @@ class AsyncExecutor(Worker, Executor):
         super().join()
 
 
-class Flexicutor(AsyncExecutor):
+class PoolWorker(AsyncExecutor):
     """
-    An asynchronous executor which can be dumped mid-execution.
-
-    This class implements threaded execution for callbacks with a defined
-    mutual exclusion set. This is the default operating mode for callbacks,
-    where calls are guaranteed to be executed synchronously within the class
-    it is defined, but not relative to anything else.
-
-    An attempt to add to the queue in a blocked state triggers a dump event if
-    the worker has been executing for DUMP_THRESHHOLD seconds.
+    A thread of an AsyncExecutorPool. Jobs carry the time they were queued,
+    and the worker exits once it has been idle for the pool's SHRINK_AFTER
+    seconds, if the pool can spare it.
     """
 
-    DUMP_THRESHHOLD = 45
-
-    def __init__(self):
-        super().__init__()
-        self.last = None
-        self.dump_lock = Lock()
-        self.__mutex__ = set()
-        self.next_thread = None
-
-    def call(self, funct, *args, **kwargs):
-        # Check we're blocked
-        if self.last is not None:
-            if time.time() - self.last > self.DUMP_THRESHHOLD:
-                self.dump()
-
-        # Route job to correct queue
-        with self.dump_lock:
-            if self.next_thread is None:
-                # We have no thread to defer to, so weaken the mutex.
-                self.__mutex__ = set()
-            if funct not in self.__mutex__ and self.next_thread is not None:
-                self.next_thread.call(self, funct, *args, **kwargs)
-            else:
-                self.put((funct, args, kwargs))
-
-    def dump(self):
-        """
-        Terminate the worker and spawn a new one with the queue elements that
-        are safe.
-
-        Assumes 1:1 map between worker and work queue.
-        """
-        with self.dump_lock:
-            self.next_thread = Flexicutor()
-            old_jobs = self.work.flush()
-            # Clearing the queue is atomic. This gives us two cases:
-            # 1. The worker is executing a job, or blocked on us, in which case
-            #    we must leave the mutex set of the last dequed job untouched.
-            # 2. The worker has cleared the dump lock and is waiting for a job.
-            #    However, we cannot detect the difference between this and the
-            #    prior case! As it is idle, we let it retain jobs from the last
-            #    mutex set, as this is probably not harmful.
-            last_job = self.work.last
-            self.__mutex__ = getattr(last_job, '__mutex__', {last_job})
-            for job in old_jobs:
-                if job[0] in self.__mutex__:
-                    # We aren't assuming thread safety, so we must requeue
-                    # the functions in the mutex set.
-                    self.work.put(job)
-                else:
-                    self.next_thread.put(job)
-            self.next_thread.start()
-            # We quarantine jobs from this mutexset to this thread.
-            # self.work.put((self.revive, (), {}))
-
-    def revive(self):
-        """ Kill the child and start accepting jobs. """
-        # FIXME: not threadsafe!!!
-        with self.dump_lock:
-            if self.next_thread is not None:
-                # Kill off the thread
-                self.next_thread.terminate()
-                self.next_thread = None
-            self.__mutex__ = set()
-
-
-    def process(self, job):
-        """ Call a function in this worker thread. """
-        self.last = time.time()
-
-        super().process(job)
-
-        with self.dump_lock:
-            self.last = None
-
-    def terminate(self):
-        if self.next_thread is not None:
-            self.next_thread.terminate()
-        super().terminate()
-
-    def join(self):
-        if self.next_thread is not None:
-            self.next_thread.join()
-        super().join()
+    def __init__(self, pool):
+        super().__init__(pool.queue)
+        self.pool = pool
+
+    def run(self):
+        while True:
+            try:
+                job = self.work.get(timeout=self.pool.SHRINK_AFTER)
+            except Empty:
+                if self.pool.retire(self):
+                    return
+                continue
+            if job is Work.TERM:
+                return
+            # Whatever is queued behind this job may need another thread.
+            self.pool.check()
+            funct, args, kwargs, _ = job
+            self.process((funct, args, kwargs))
 
 
-class FlexicutorPool(Executor):
+class AsyncExecutorPool(Executor):
     """
-    A statically sized pool of flexicutors.
+    A dynamic pool of executors sharing a work pool.
 
-    Sends calls to the least loaded pool. This Executor assumes that calls are
-    threadsafe.
+    The pool starts with min_size threads, and adds one, up to max_size,
+    whenever the oldest queued job has waited GROW_AFTER seconds. This is
+    checked as jobs are queued and picked up, and by a supervisor thread
+    for when every thread is busy and no more jobs arrive. Threads beyond
+    min_size exit after SHRINK_AFTER idle seconds. As jobs run in whichever
+    thread is free, calls must be threadsafe.
     """
-    # TODO: Expand on demand. Currently does not attempt to guarantee
-    # any queue-to-execution latency properties.
 
-    def __init__(self, workers=2):
-        self.executors = [Flexicutor() for _ in range(workers)]
-        # NOTE: This is not threadsafe for multiple callers, but as it is just
-        # a heuristic, we don't really care.
-        self.serviced = [0 for i in range(workers)]
-        self.waiting = [0 for i in range(workers)]
+    GROW_AFTER = 0.5
+    SHRINK_AFTER = 60
 
-    def tracked(self, funct, worker_num):
-        """
-        Marks the function as threadsafe for the flexicutor, and updates our
-        statistics once the function is serviced.
-        """
-        @wraps(funct)
-        def tracked_function(*args, **kwargs):
-            """ Wraps a function call with tracking information """
-            funct(*args, **kwargs)
-            self.serviced[worker_num] += 1
-        tracked_function.__mutex__ = set()
-        return tracked_function
+    def __init__(self, min_size=2, max_size=4, queue=None):
+        if queue is None:
+            self.queue = Work()
+        else:
+            self.queue = queue
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.lock = Lock()
+        self.started = False
+        self.terminated = False
+        self.grown = 0
+        self.executors = [PoolWorker(self) for i in range(min_size)]
+        self.stopped = Event()
+        self.supervisor = Thread(target=self.supervise, daemon=True)
 
     def call(self, funct, *args, **kwargs):
-        # Calculate most timely worker thread
-        worker_num, worker = min(
-            enumerate(self.executors),
-            key=lambda i, w: self.waiting[i] - self.serviced[i]
-        )
+        self.queue.put((funct, args, kwargs, time.time()))
+        self.check()
+
+    def check(self):
+        """ Grow the pool if the oldest queued job has waited too long. """
+        job = self.queue.peek()
+        if job is None or job is Work.TERM:
+            return
+        now = time.time()
+        if now - job[3] > self.GROW_AFTER and now - self.grown > self.GROW_AFTER:
+            self.grow()
+
+    def supervise(self):
+        """ Keep checking the queue, as busy threads cannot. """
+        while not self.stopped.wait(self.GROW_AFTER / 2):
+            self.check()
+
+    def grow(self):
+        """ Add a thread, unless the pool is full or stopped. """
+        with self.lock:
+            if (not self.started or self.terminated
+                    or len(self.executors) >= self.max_size):
+                return
+            self.grown = time.time()
+            executor = PoolWorker(self)
+            self.executors.append(executor)
+            executor.start()
 
-        # Queue and track function
-        self.waiting[worker_num] += 1
-        worker.call(self.tracked(funct, worker_num), *args, **kwargs)
+    def retire(self, executor):
+        """ Let an idle thread exit if the pool is above its minimum size. """
+        with self.lock:
+            if self.terminated or len(self.executors) <= self.min_size:
+                return False
+            self.executors.remove(executor)
+            return True
 
     def start(self):
-        for executor in self.executors:
-            executor.start()
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+            for executor in self.executors:
+                executor.start()
+            self.supervisor.start()
 
     def terminate(self):
-        for executor in self.executors:
-            executor.terminate()
+        with self.lock:
+            if self.terminated:
+                return
+            self.terminated = True
+            self.stopped.set()
+            for _ in self.executors:
+                self.queue.terminate()
 
     def join(self):
-        for executor in self.executors:
+        for executor in list(self.executors):
             executor.join()
+        if self.supervisor.is_alive():
+            self.supervisor.join()
 
 
-class AsyncExecutorPool(Executor):
+class MutexScheduler(Executor):
     """
-    A dynamic pool of executors sharing a work pool.
+    Runs callbacks as actors, one per mutual exclusion set.
+
+    Each set of callbacks that must not run concurrently (a callback's
+    __mutex__) gets a mailbox. Calls are queued in their mailbox, and a
+    mailbox with work is drained by a single job on the shared pool, so
+    calls in a set run one at a time and in order, while unrelated
+    callbacks run in parallel. Sets are told apart by their members.
+    Callbacks with an empty mutex set go straight to the pool.
+
+    Calls queued with call_slow, such as those of demoted callbacks, go
+    through the same mailbox, which is drained on the slow executor while
+    they are at its head, so they still exclude the rest of their set
+    without holding up the pool. The slow executor is started and stopped
+    by its owner.
+
+    A mailbox gives up its thread after BATCH calls and queues itself
+    again, so a busy plugin cannot starve the others.
     """
-    # TODO: Finish this class.
-    def __init__(self, min_size=2, max_size=4, queue=None):
-        if queue is None:
-            self.queue = Work()
-        else:
-            self.queue = queue
 
-        self.executors = [AsyncExecutor(self.queue) for i in range(min_size)]
-        self.min_size = min_size
-        self.max_size = max_size
-        raise NotImplementedError
+    BATCH = 16
+
+    def __init__(self, pool=None, slow=None):
+        self.pool = pool if pool is not None else AsyncExecutorPool()
+        self.slow = slow if slow is not None else self.pool
+        self.mailboxes = {}
+        self.lock = Lock()
+
+    @staticmethod
+    def key(funct):
+        """ The mailbox a callback belongs to. """
+        return frozenset(getattr(funct, "__mutex__", {funct}))
 
     def call(self, funct, *args, **kwargs):
-        pass
+        self.post(False, funct, args, kwargs)
+
+    def call_slow(self, funct, *args, **kwargs):
+        """ Queue a call to run on the slow executor, in its mailbox. """
+        self.post(True, funct, args, kwargs)
+
+    def post(self, slow, funct, args, kwargs):
+        key = self.key(funct)
+        if not key:
+            (self.slow if slow else self.pool).call(funct, *args, **kwargs)
+            return
+        with self.lock:
+            mailbox = self.mailboxes.get(key)
+            idle = mailbox is None
+            if idle:
+                mailbox = self.mailboxes[key] = collections.deque()
+            mailbox.append((slow, (funct, args, kwargs)))
+        if idle:
+            (self.slow if slow else self.pool).call(self.drain, key, slow)
+
+    def drain(self, key, slow=False):
+        """
+        Run a mailbox's calls in order until it is empty, moving to the
+        other executor when the next call belongs there.
+        """
+        for _ in range(self.BATCH):
+            with self.lock:
+                mailbox = self.mailboxes[key]
+                if not mailbox:
+                    del self.mailboxes[key]
+                    return
+                if mailbox[0][0] != slow:
+                    slow = not slow
+                    break
+                _, job = mailbox.popleft()
+            AsyncExecutor.process(job)
+        # The mailbox stays registered, so nothing else can schedule it.
+        (self.slow if slow else self.pool).call(self.drain, key, slow)
 
     def start(self):
-        for executor in self.executors:
-            executor.start()
+        self.pool.start()
 
     def terminate(self):
-        for executor in self.executors:
-            executor.terminate()
+        self.pool.terminate()
 
     def join(self):
-        for executor in self.executors:
-            executor.join()
+        self.pool.join()
 
 
 class ExecutorMap(Executor):
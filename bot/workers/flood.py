@@ -0,0 +1,224 @@
+"""
+Flood control for outgoing IRC lines.
+
+Lines are queued in one of three strict-priority lanes, round-robin across
+targets within a lane, and released at the rate a token bucket allows.
+"""
+
+import collections
+import threading
+import time
+
+# Lanes, in priority order.
+PROTOCOL = 0     # PONG, NICK, JOIN and friends.
+INTERACTIVE = 1  # Replies to commands.
+BULK = 2         # Background output and state syncing.
+LANES = (PROTOCOL, INTERACTIVE, BULK)
+LANE_NAMES = ("protocol", "interactive", "bulk")
+
+
+class TokenBucket(object):
+    """
+    Allows bursts of up to `burst` lines, refilling at `rate` lines per
+    second. A rate of 0 disables flood control.
+
+    Schedulers only use consume and delay, which are passed the line being
+    sent, so any object with those methods can stand in for the bucket.
+
+    A bucket may be shared by several schedulers, so it has its own lock.
+    """
+
+    def __init__(self, rate=0.5, burst=5):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = None
+        self.lock = threading.RLock()
+
+    def refill(self, now):
+        """ Add the tokens accrued since the last update. """
+        with self.lock:
+            if self.updated is not None:
+                elapsed = max(0, now - self.updated)
+                self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def available(self, now):
+        """ The tokens in the bucket right now. """
+        with self.lock:
+            self.refill(now)
+            return self.tokens
+
+    def consume(self, now, line=None):
+        """
+        Take a token to send a line. Returns False if the bucket is empty.
+        """
+        if not self.rate:
+            return True
+        with self.lock:
+            self.refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def delay(self, now, line=None):
+        """ Seconds until the bucket will hold a token. """
+        if not self.rate:
+            return 0
+        with self.lock:
+            self.refill(now)
+            return max(0, (1 - self.tokens) / self.rate)
+
+
+class LaneStats(object):
+    """ Time-in-queue statistics for a lane. """
+
+    def __init__(self):
+        self.sent = 0
+        self.waited = 0
+        self.max_wait = 0
+
+    def record(self, wait):
+        self.sent += 1
+        self.waited += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    @property
+    def mean_wait(self):
+        return self.waited / self.sent if self.sent else 0
+
+
+class OutputScheduler(object):
+    """
+    Orders queued lines by lane, then round-robin across targets within a
+    lane, so one target's backlog cannot starve another.
+
+    Note: This object is not thread safe.
+    """
+
+    def __init__(self, bucket=None):
+        self.bucket = bucket if bucket is not None else TokenBucket()
+        self.lanes = [collections.OrderedDict() for _ in LANES]
+        self.stats = [LaneStats() for _ in LANES]
+        self.size = 0
+
+    def push(self, line, lane=INTERACTIVE, target=None, now=None):
+        """ Queue a line for a target. """
+        if now is None:
+            now = time.time()
+        queue = self.lanes[lane].setdefault(target, collections.deque())
+        queue.append((now, line))
+        self.size += 1
+
+    def pop(self, now):
+        """
+        Return the next line the bucket allows, or None if there is none.
+        """
+        if not self.size:
+            return None
+        for lane, targets in enumerate(self.lanes):
+            for target, queue in targets.items():
+                queued, line = queue[0]
+                if not self.bucket.consume(now, line):
+                    continue
+                queue.popleft()
+                if queue:
+                    # Go to the back of the round.
+                    targets.move_to_end(target)
+                else:
+                    del targets[target]
+                self.size -= 1
+                self.stats[lane].record(now - queued)
+                return line
+
+    def ready(self, now, limit=None):
+        """ Pop every line the bucket allows right now, up to a limit. """
+        lines = []
+        while limit is None or len(lines) < limit:
+            line = self.pop(now)
+            if line is None:
+                break
+            lines.append(line)
+        return lines
+
+    def delay(self, now):
+        """ Seconds until a line may be sent, or None if nothing is queued. """
+        if not self.size:
+            return None
+        return min(self.bucket.delay(now, queue[0][1])
+                   for targets in self.lanes
+                   for queue in targets.values())
+
+    def flush(self):
+        """ Remove and return every queued line, in priority order. """
+        lines = [line for targets in self.lanes
+                      for queue in targets.values()
+                      for _, line in queue]
+        for targets in self.lanes:
+            targets.clear()
+        self.size = 0
+        return lines
+
+    def depths(self):
+        """ The number of queued lines in each lane. """
+        return [sum(len(i) for i in targets.values()) for targets in self.lanes]
+
+    def __len__(self):
+        return self.size
+
+
+class ScheduledWork(object):
+    """
+    A work queue which releases jobs in the order and at the rate its
+    OutputScheduler allows. Iterating blocks until a job may be sent.
+    """
+
+    def __init__(self, scheduler=None):
+        self.scheduler = scheduler if scheduler is not None else OutputScheduler()
+        self.last = None
+        self._cond = threading.Condition()
+        self._terminated = False
+
+    def empty(self):
+        """ Returns true if probably empty. """
+        return not len(self.scheduler)
+
+    def flush(self):
+        """ Removes and returns all queued items. """
+        with self._cond:
+            return self.scheduler.flush()
+
+    def ready(self, limit=None):
+        """ Remove and return the jobs which may be sent right away. """
+        with self._cond:
+            return self.scheduler.ready(time.time(), limit)
+
+    def put(self, job, lane=INTERACTIVE, target=None):
+        """ Queue a job in the given lane. """
+        with self._cond:
+            self.scheduler.push(job, lane, target)
+            self._cond.notify()
+
+    def terminate(self):
+        """ Stop iteration, discarding anything still queued. """
+        with self._cond:
+            self._terminated = True
+            self._cond.notify_all()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._cond:
+            while not self._terminated:
+                now = time.time()
+                job = self.scheduler.pop(now)
+                if job is not None:
+                    self.last = job
+                    return job
+                self._cond.wait(self.scheduler.delay(now))
+            raise StopIteration
+
+    def __len__(self):
+        return len(self.scheduler)
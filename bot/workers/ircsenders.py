@@ -1,14 +1,26 @@
 """ Controls and linearises messages sent to IRC. """
+import collections
 import json
 import time
 import sys
-import re
 import random
 
-from util.text import lineify, ircstrip
-from util.irc import Address
+from util.text import lineify, ircstrip, wrap, colourise
+from util.irc import Address, MAX_MESSAGE_SIZE
+
+from util import scheduler
 
 from .worker import Worker
+from .pool import OutputPool
+from .flood import (
+    ScheduledWork,
+    OutputScheduler,
+    TokenBucket,
+    PROTOCOL,
+    INTERACTIVE,
+    BULK,
+    LANE_NAMES,
+)
 
 
 class PrinterBuffer(object):
@@ -23,13 +35,14 @@ class PrinterBuffer(object):
         adpool = []
     lastad = 0
 
-    def __init__(self, printer, recipient, method):
+    def __init__(self, printer, recipient, method, lane=INTERACTIVE):
         """
         Obj is an object that supports the message method.
         """
         self.buffer = []
         self.recipient = recipient
         self.method = method
+        self.lane = lane
         self.sender = printer
 
     def __enter__(self):
@@ -49,7 +62,8 @@ class PrinterBuffer(object):
         if self.buffer:
             self.sender.message("\n".join(self.buffer),
                                 self.recipient,
-                                self.method)
+                                self.method,
+                                self.lane)
             self.serve_ad()
             self.buffer = []
 
@@ -63,7 +77,7 @@ class PrinterBuffer(object):
         ):
             advert = self.__class__.adpool.pop()
             self.sender.message(
-                "│ SPONSORED │ %s" % advert, self.recipient, self.method
+                "│ SPONSORED │ %s" % advert, self.recipient, self.method, BULK
             )
             with open("ads.json", "w") as ad_file:
                 json.dump(self.__class__.adpool, ad_file)
@@ -71,15 +85,45 @@ class PrinterBuffer(object):
 
 
 class IRCSender(Worker):
-    """ This queue-like thread controls the output to a socket."""
+    """
+    This queue-like thread controls the output to a socket.
+
+    Config:
+        Flood Rate: lines per second once a burst is spent (default 0, off)
+        Flood Burst: lines sent back to back before throttling (default 5)
+    """
 
     QUIET = 0
     QUEUE_STATE = 1
     FULL_MESSAGE = 2
     TYPE_ONLY = 4
 
+    # Output lanes, in priority order.
+    PROTOCOL = PROTOCOL
+    INTERACTIVE = INTERACTIVE
+    BULK = BULK
+
+    # The most lines coalesced into a single write.
+    BATCH_SIZE = 64
+
+    # Assumed length of our hostname until the server tells us.
+    HOSTLEN = 63
+
+    # Raw commands which keep the connection and our state alive.
+    PROTOCOL_COMMANDS = {
+        "PONG", "PING", "NICK", "JOIN", "PART", "QUIT", "PASS", "USER",
+        "CAP", "AUTHENTICATE", "AWAY",
+    }
+
+    # Flood control is off unless configured, as servers' limits differ.
+    FLOOD_RATE = 0
+    FLOOD_BURST = 5
+
     def __init__(self, connection):
-        super().__init__()
+        config = getattr(connection, "config", {})
+        bucket = TokenBucket(config.get("Flood Rate", self.FLOOD_RATE),
+                             config.get("Flood Burst", self.FLOOD_BURST))
+        super().__init__(ScheduledWork(OutputScheduler(bucket)))
         self.bot = connection
         self.verbosity = self.TYPE_ONLY | self.QUEUE_STATE
         self.servername = connection.server[0]
@@ -96,6 +140,12 @@ class IRCSender(Worker):
         """
         self.bot.sendline(message)
 
+    def send_batch(self, lines):
+        """
+        Send several lines through the underlying socket with one write.
+        """
+        self.bot.sendlines(lines)
+
     @staticmethod
     def pack(msg, recipient, method):
         """
@@ -103,6 +153,12 @@ class IRCSender(Worker):
         """
         return "%s %s :%s" % (method, recipient, msg)
 
+    def format(self, msg, method):
+        """
+        Return the text to send for a line of a message.
+        """
+        return msg
+
     def can_send(self, msg, recipient, method):
         """
         Returns true if the message can probably be sent without
@@ -110,18 +166,76 @@ class IRCSender(Worker):
         """
         return self.bot.can_send(msg, recipient, method)
 
-    def message(self, mesg, recipient, method="PRIVMSG"):
+    def prefix_size(self, bot=None):
         """
-        Send a message.
+        The size of the `:nick!user@host ` prefix the server adds when it
+        relays our messages.
         """
-        msg = lineify(str(mesg))
-        self.history[self.lower(recipient)] = msg
-        for message in [i for i in msg if i]:
-            self.put(self.pack(message, recipient, method))
+        bot = bot or self.bot
+        nick = bot.nick or max(bot.nicks, key=len)
+        host = getattr(bot, "hostmask", None)
+        if host is None:
+            # Allow for an ident ~ and the longest hostname.
+            user, host = "~" + bot.username, "x" * self.HOSTLEN
+        else:
+            user = bot.username
+        return len((":%s!%s@%s " % (nick, user, host)).encode(bot.encoding))
+
+    def split(self, line, limit):
+        """
+        Split a formatted line into pieces of at most limit bytes, keeping
+        CTCP framing intact.
+        """
+        encoding = self.bot.encoding
+        if line[:1] == line[-1:] == "\x01" and " " in line:
+            command, body = line[:-1].split(" ", 1)
+            return ["%s %s\x01" % (command, i)
+                    for i in wrap(body, limit - len(command) - 2, encoding)]
+        return wrap(line, limit, encoding)
+
+    def message(self, mesg, recipient, method="PRIVMSG", lane=INTERACTIVE):
+        """
+        Send a message. Long lines are split to fit, byte for byte.
+        """
+        msg = lineify(str(mesg), None)
+        target = self.lower(recipient)
+        self.history[target] = msg
+        # The overhead is the same for every line to this target.
+        header = IRCSender.pack("", recipient, method)
+        limit = (MAX_MESSAGE_SIZE - len("\r\n") - self.prefix_size() -
+                 len(header.encode(self.bot.encoding)))
+        for line in msg:
+            if not line:
+                continue
+            for piece in self.split(self.format(line, method), limit):
+                self.work.put(header + piece, lane, target)
         return mesg  # Debugging
 
-    def raw_message(self, mesg):
-        self.work.put(mesg)
+    def raw_message(self, mesg, lane=None):
+        """
+        Send a raw line. Unless a lane is given, protocol commands jump the
+        queue and everything else is treated as interactive.
+        """
+        words = mesg.split(" ", 2)
+        if lane is None:
+            if words[0].upper() in self.PROTOCOL_COMMANDS:
+                lane = PROTOCOL
+            else:
+                lane = INTERACTIVE
+        target = self.lower(words[1]) if len(words) > 1 else None
+        self.work.put(mesg, lane, target)
+
+    def stats(self):
+        """
+        Returns (lane, queued, sent, mean wait, max wait) for each lane.
+        """
+        scheduler = self.work.scheduler
+        return [
+            (LANE_NAMES[lane], depth, stats.sent, stats.mean_wait, stats.max_wait)
+            for lane, (depth, stats) in enumerate(
+                zip(scheduler.depths(), scheduler.stats)
+            )
+        ]
 
     def log(self, data):
         if self.verbosity != self.QUIET:
@@ -132,27 +246,33 @@ class IRCSender(Worker):
                 else:
                     output = ircstrip(data)
                 sys.stdout.write("%s ← %s" % (self.servername, output))
-            if self.work.qsize() and self.verbosity & self.QUEUE_STATE:
-                sys.stdout.write(" ⬩ %d messages queued." % self.work.qsize())
+            if len(self.work) and self.verbosity & self.QUEUE_STATE:
+                sys.stdout.write(" ⬩ %d messages queued (%s)." % (
+                    len(self.work),
+                    "/".join(str(i) for i in self.work.scheduler.depths())
+                ))
             print()
 
     def process(self, data):
+        # Anything else flood control allows right now goes in the same write.
+        lines = [data] + self.work.ready(self.BATCH_SIZE - 1)
         try:
-            self.send(data)
+            self.send_batch(lines)
         except BaseException:
-            print("Printer could not send: %r\n" % data, file=sys.stderr)
+            print("Printer could not send: %r\n" % lines, file=sys.stderr)
             sys.excepthook(*sys.exc_info())
         else:
-            self.log(data)
+            for line in lines:
+                self.log(line)
 
-    def buffer(self, recipient, method="PRIVMSG"):
+    def buffer(self, recipient, method="PRIVMSG", lane=INTERACTIVE):
         """
         Create a context manager with the given target and method bound to
         the current printer object.
         """
-        return PrinterBuffer(self, recipient, method)
+        return PrinterBuffer(self, recipient, method, lane)
 
-    def respond(self, line, method="PRIVMSG"):
+    def respond(self, line, method="PRIVMSG", lane=INTERACTIVE):
         """
         Create a context manager which parses the input words and responds
         in PM if messaged, else in the channel.
@@ -161,7 +281,7 @@ class IRCSender(Worker):
             target = line[2]
         else:
             target = Address(line[0]).nick
-        return PrinterBuffer(self, target, method)
+        return PrinterBuffer(self, target, method, lane)
 
 
 class ColourPrinter(IRCSender):
@@ -178,63 +298,86 @@ class ColourPrinter(IRCSender):
         Parse a message and colour it in.
         """
         value = []
-        color = self.color
+        color = int(self.color)
         for line in data.rstrip().split("\n"):
             if " " in line and line[0] + line[-1] == "\x01\x01":
-                value.append(
-                    "%s %s" % (
-                        line.split(" ")[0],
-                        self.defaultcolor(line.split(" ", 1)[-1])
-                    )
-                )
+                command, body = line[:-1].split(" ", 1)
+                value.append("%s %s\x01" % (command, colourise(body, color)))
             else:
-                line = re.sub(
-                    r"\x03([^\d])",
-                    lambda x: (("\x03%s" % (color)) + (x.group(1) or "")),
-                    line
-                )
-                line = line.replace("\x0f", "\x0f\x03%s" % (color))
-                line = line.replace(
-                    "\x0f\x03%s\x0f\x03%s" % (color, color),
-                    "\x0f"
-                )
-                value.append("\x03%s%s" % (color, line))
-        return "\n".join(value)  # TODO: Minify.
+                value.append(colourise(line, color))
+        return "\n".join(value)
 
-    def pack(self, msg, recipient, method):
+    def format(self, msg, method):
         msg = str(msg)
         if method.upper() in ["PRIVMSG", "NOTICE"] and self.hasink:
-            msg = super().pack(self.defaultcolor(msg), recipient, method)
-        else:
-            msg = super().pack(msg, recipient, method)
-
+            msg = self.defaultcolor(msg)
         return msg
 
+    def pack(self, msg, recipient, method):
+        return super().pack(self.format(msg, method), recipient, method)
+
 
 class MultiPrinter(ColourPrinter):
+    """
+    Sends output through a pool of connections, each with its own flood
+    budget. See bot.workers.pool.
+    """
+
+    # Seconds between checks for dead output connections.
+    HEALTH_INTERVAL = 30
+
     def __init__(self, bot):
         super().__init__(bot)
-        self.bots = [bot]
-        self.outmap = {}
+        scheduler = self.work.scheduler
+        self.pool = OutputPool(bot, scheduler.bucket, self.lower)
+        scheduler.bucket = self.pool
+        self.health = None
+
+    @property
+    def bots(self):
+        return [i.bot for i in self.pool]
+
+    def prefix_size(self, bot=None):
+        # Any connection in the pool might send the line.
+        if bot is not None:
+            return super().prefix_size(bot)
+        return max(super(MultiPrinter, self).prefix_size(i) for i in self.bots)
 
     def send(self, message):
-        words = message.split(" ", 2)
-        if (
-                words[0].lower() not in ["notice", "privmsg"] or
-                len(words) != 3 or
-                words[1].startswith("#") or len(self.bots) == 1
-        ):
-            bot = 0
-        elif words[1] in self.outmap:
-            bot = self.outmap[words[1]]
-        else:
-            bot = min(
-                range(len(self.bots)),
-                key=lambda x: list(self.outmap.values()).count(x)
+        self.send_batch([message])
+
+    def send_batch(self, lines):
+        # Each output gets one write for all of its lines.
+        batches = collections.OrderedDict()
+        for line in lines:
+            batches.setdefault(self.pool.take(line), []).append(line)
+        for output, batch in batches.items():
+            try:
+                output.bot.sendlines(batch)
+            except OSError:
+                if output is self.pool.main:
+                    raise
+                print("Output connection %d failed." % output.number,
+                      file=sys.stderr)
+                self.pool.failed(output)
+                self.bot.sendlines(batch)
+
+    def add(self, bot, reconnect=None):
+        """
+        Add an output connection. reconnect() is called to replace it
+        if it dies, and should return a new, connected output.
+        """
+        if self.health is None:
+            if self.bot.config.get("Output Joins", True):
+                self.bot.register("join", self.pool.follow)
+                self.bot.register("part", self.pool.follow)
+            self.health = scheduler.schedule_after(
+                self.HEALTH_INTERVAL, self.pool.check, stop_after=None
             )
-            self.outmap[words[1]] = bot
-        sys.stdout.write("[%d] " % bot)
-        self.bots[bot].sendline(message)
+        self.pool.add(bot, reconnect)
 
-    def add(self, bot):
-        self.bots.append(bot)
+    def terminate(self):
+        super().terminate()
+        if self.health is not None:
+            self.health.cancel()
+        self.pool.close()
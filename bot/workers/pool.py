@@ -0,0 +1,258 @@
+"""
+Spreads output across several connections to the same network.
+
+Every connection keeps its own flood budget. Channel messages go out through
+any connection that is in the channel, and private messages stick to the
+connection that last spoke to that nick, so users see one sender.
+"""
+
+import collections
+import socket
+import sys
+import threading
+
+from util.irc import Address, Callback
+
+from .flood import TokenBucket
+
+CHANNEL_PREFIXES = "#&"
+MESSAGE_COMMANDS = {"PRIVMSG", "NOTICE"}
+
+
+class PooledOutput(object):
+    """ A connection in the pool, and what the pool knows about it. """
+
+    def __init__(self, bot, number, reconnect=None):
+        self.bot = bot
+        self.number = number
+        self.reconnect = reconnect
+        self.reviving = False
+        self.sent = 0
+        self.channels = set()
+        try:
+            # Share the budget of the connection's own printer.
+            self.bucket = bot.printer.pool.main.bucket
+        except AttributeError:
+            self.bucket = TokenBucket(0)
+
+    @property
+    def alive(self):
+        return self.bot.connected
+
+    def tokens(self, now):
+        """ How many lines this connection may send right now. """
+        if not self.bucket.rate:
+            return float("inf")
+        return self.bucket.available(now)
+
+
+class OutputPool(object):
+    """
+    Decides which connection sends each line.
+
+    The pool stands in for the printer's token bucket: the scheduler asks it
+    whether a line may be sent, and the pool answers by reserving a token on
+    the least loaded connection which can carry that line. The printer then
+    sends the line through the reserved connection.
+    """
+
+    AFFINITY_SIZE = 512
+    # Reservations for lines which were never sent, such as flushed ones,
+    # are dropped oldest first past this many.
+    RESERVED_SIZE = 1024
+
+    def __init__(self, bot, bucket, lower=str.lower):
+        self.lower = lower
+        main = PooledOutput(bot, 0)
+        main.bucket = bucket
+        self.outputs = [main]
+        self.affinity = collections.OrderedDict()
+        # Reserved outputs, queued by line.
+        self.reserved = collections.OrderedDict()
+        self.pending = 0
+        self.closed = False
+        self.lock = threading.RLock()
+
+    @property
+    def main(self):
+        return self.outputs[0]
+
+    def add(self, bot, reconnect=None):
+        """
+        Add a connection. If given, reconnect() should return a new,
+        connected replacement for it once it dies.
+        """
+        with self.lock:
+            output = PooledOutput(bot, len(self.outputs), reconnect)
+            self.outputs.append(output)
+        self.watch(output)
+        return output
+
+    def watch(self, output):
+        """ Track the channels an output connection is in. """
+        bot = output.bot
+        bot.register("join", Callback.inline(
+            lambda server, line: self.joined(output, line)))
+        bot.register("part", Callback.inline(
+            lambda server, line: self.parted(output, line)))
+        bot.register("kick", Callback.inline(
+            lambda server, line: self.kicked(output, line)))
+        for channel in getattr(self.main.bot, "channels", ()):
+            bot.printer.raw_message("JOIN %s" % channel)
+
+    def joined(self, output, line):
+        words = line.split()
+        if Address(words[0]).nick == output.bot.nick:
+            with self.lock:
+                output.channels.add(self.lower(words[2].lstrip(":")))
+
+    def parted(self, output, line):
+        words = line.split()
+        if Address(words[0]).nick == output.bot.nick:
+            with self.lock:
+                output.channels.discard(self.lower(words[2]))
+
+    def kicked(self, output, line):
+        words = line.split()
+        if words[3] == output.bot.nick:
+            with self.lock:
+                output.channels.discard(self.lower(words[2]))
+
+    @Callback.inline
+    def follow(self, server, line):
+        """ Mirror the main connection's JOINs and PARTs on every output. """
+        words = line.split()
+        if Address(words[0]).nick != server.nick:
+            return
+        command, channel = words[1].upper(), words[2].lstrip(":")
+        for output in self.outputs[1:]:
+            if output.alive:
+                output.bot.printer.raw_message("%s %s" % (command, channel))
+
+    def candidates(self, line):
+        """
+        Returns the outputs which may send a line, and the private target
+        to pin to whichever is picked.
+        """
+        words = line.split(" ", 2)
+        if len(words) != 3 or words[0].upper() not in MESSAGE_COMMANDS:
+            return [self.main], None
+        target = self.lower(words[1])
+        if target[:1] in CHANNEL_PREFIXES:
+            return [i for i in self.outputs
+                    if i is self.main or i.alive and target in i.channels], None
+        output = self.affinity.get(target)
+        if output is not None and output.alive:
+            self.affinity.move_to_end(target)
+            return [output], None
+        return [i for i in self.outputs if i is self.main or i.alive], target
+
+    def consume(self, now, line=None):
+        """ Reserve a connection to send a line. Returns False if none can. """
+        with self.lock:
+            if len(self.outputs) == 1:
+                if not self.main.bucket.consume(now, line):
+                    return False
+                self.reserve(line, self.main)
+                return True
+            outputs, target = self.candidates(line)
+            output = max(outputs, key=lambda i: (i.tokens(now), -i.sent))
+            if not output.bucket.consume(now, line):
+                return False
+            output.sent += 1
+            if target is not None:
+                self.affinity[target] = output
+                if len(self.affinity) > self.AFFINITY_SIZE:
+                    self.affinity.popitem(last=False)
+            self.reserve(line, output)
+            return True
+
+    def reserve(self, line, output):
+        """ Remember which output a line is to go out on. """
+        self.reserved.setdefault(line, collections.deque()).append(output)
+        self.pending += 1
+        if self.pending > self.RESERVED_SIZE:
+            oldest, outputs = next(iter(self.reserved.items()))
+            outputs.popleft()
+            self.pending -= 1
+            if not outputs:
+                del self.reserved[oldest]
+
+    def delay(self, now, line=None):
+        """ Seconds until some connection may send a line. """
+        with self.lock:
+            outputs, _ = self.candidates(line)
+            return min(i.bucket.delay(now, line) for i in outputs)
+
+    def take(self, line):
+        """
+        Returns the output reserved for a line, releasing that reservation
+        only. Lines which were never reserved go out on the main connection.
+        """
+        with self.lock:
+            outputs = self.reserved.get(line)
+            if not outputs:
+                return self.main
+            output = outputs.popleft()
+            self.pending -= 1
+            if not outputs:
+                del self.reserved[line]
+            return output
+
+    def failed(self, output):
+        """ Take an output out of rotation. """
+        output.bot.connected = False
+        try:
+            # Wake the reader, so the connection cleans up after itself.
+            output.bot.sock.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+        with self.lock:
+            for target in [k for k, v in self.affinity.items() if v is output]:
+                del self.affinity[target]
+
+    def check(self):
+        """ Take dead outputs out of rotation and try to bring them back. """
+        for output in self.outputs[1:]:
+            if self.closed:
+                return
+            if output.alive or output.reviving:
+                continue
+            self.failed(output)
+            if output.reconnect is not None:
+                output.reviving = True
+                threading.Thread(target=self.revive, args=(output,),
+                                 daemon=True).start()
+
+    def revive(self, output):
+        """ Replace a dead output with a new connection. """
+        try:
+            bot = output.reconnect()
+        except Exception:
+            print("Output connection %d could not reconnect." % output.number,
+                  file=sys.stderr)
+            sys.excepthook(*sys.exc_info())
+        else:
+            with self.lock:
+                revived = PooledOutput(bot, output.number, output.reconnect)
+                self.outputs[output.number] = revived
+            self.watch(revived)
+            print("Output connection %d reconnected." % output.number)
+        finally:
+            output.reviving = False
+
+    def close(self):
+        """ Stop reviving outputs and disconnect them. """
+        self.closed = True
+        for output in self.outputs[1:]:
+            if output.alive:
+                try:
+                    output.bot.quit()
+                except OSError:
+                    pass
+
+    def __iter__(self):
+        return iter(self.outputs)
+
+    def __len__(self):
+        return len(self.outputs)
@@ -0,0 +1,148 @@
+"""
+Runs CPU-bound callbacks in worker processes.
+
+Threads share the GIL, so a callback which renders an image in pure Python
+holds up dispatch for everything else. Callbacks marked Callback.cpu are
+instead sent, with the line they were called for, to a pool of warm worker
+processes. The lines they return are sent back through the printer, to the
+channel or user the line came from.
+
+A cpu callback must be a module level function, which is what lets it be
+pickled. It is called with the line (or the Event, for Callback.event
+callbacks) alone, as the bot cannot follow it into the child:
+
+    @Callback.cpu
+    def render(line):
+        return ["line one", "line two"]
+
+Workers import the modules of the cpu callbacks loaded when the pool starts,
+which loads the modules' static data, and call each module's optional
+__cpu_initialise__() hook, once per worker, before taking any jobs. Modules
+loaded later are set up the first time a worker runs one of their callbacks.
+"""
+
+import concurrent.futures
+import importlib
+import multiprocessing
+import os
+import sys
+import time
+
+from util.irc import Event
+
+from .executors import Executor, repr_call
+
+# Modules set up in this worker process.
+_initialised = set()
+
+
+def setup(module):
+    """ Import a module in this worker and run its set up hook, once. """
+    if module in _initialised:
+        return
+    _initialised.add(module)
+    initialise = getattr(importlib.import_module(module), "__cpu_initialise__", None)
+    if initialise is not None:
+        initialise()
+
+
+def initialise(modules):
+    """ Worker start up: set up the modules of the cpu callbacks. """
+    for module in modules:
+        setup(module)
+
+
+def warm():
+    """ Returns once a worker is ready for jobs. """
+    return os.getpid()
+
+
+def run(funct, line):
+    """
+    Call a callback in a worker, setting its module up first if need be.
+    Returns when the call started, how long it ran, and its lines.
+    """
+    setup(funct.__module__)
+    start = time.time()
+    result = funct(line)
+    if result is None:
+        lines = []
+    elif isinstance(result, str):
+        lines = result.split("\n")
+    else:
+        lines = [str(i) for i in result]
+    return start, time.time() - start, lines
+
+
+class ProcessExecutor(Executor):
+    """
+    Sends calls to a pool of worker processes. The pool is only created
+    once something needs it; warm() starts every worker ahead of time, so
+    that the first calls pay for neither starting a worker nor loading
+    their module.
+
+    Workers are started with forkserver where it is available, as forking
+    a process with running threads is unsafe.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 2
+        self.pool = None
+
+    def warm(self, modules=()):
+        """
+        Create the pool and start its workers, which set the given modules
+        up before taking any jobs.
+        """
+        if self.pool is not None:
+            return
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in methods else "spawn"
+        )
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            self.workers, context, initializer=initialise,
+            initargs=(sorted(modules),)
+        )
+        for _ in range(self.workers):
+            self.pool.submit(warm)
+
+    def call(self, funct, server, line):
+        self.warm()
+        event = Event.of(line)
+        arg = event if funct.takes_event else event.raw
+        future = self.pool.submit(run, funct.funct, arg)
+        future.add_done_callback(lambda f: self.done(f, funct, server, event))
+
+    def done(self, future, funct, server, event):
+        """ Send a finished call's lines, and record how it went. """
+        if future.cancelled():
+            cancel = getattr(funct, "cancel", None)
+            if cancel is not None:
+                cancel()
+            return
+        record = getattr(funct, "record", None)
+        try:
+            start, elapsed, lines = future.result()
+        except BaseException:
+            if record is not None:
+                record(time.time(), 0, True)
+            print("Error in cpu function %s" % repr_call(funct, server, event.raw),
+                  file=sys.stderr)
+            sys.excepthook(*sys.exc_info())
+            return
+        if record is not None:
+            record(start, elapsed, False)
+        for line in lines:
+            server.printer.message(line, event.context)
+
+    def start(self):
+        pass
+
+    def terminate(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def join(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
@@ -1,6 +1,7 @@
 """
 Represents a work queue
 """
+import collections
 import queue
 import threading
 
@@ -8,6 +9,10 @@ import threading
 class Work(object):
     """
     This object is an iterable work queue.
+
+    Jobs are kept in a deque guarded by a single condition variable. put()
+    never blocks, and consumers wait on the condition, which releases the
+    lock, so an idle worker never holds up the dispatch thread.
     """
 
     TERM = object()
@@ -17,35 +22,63 @@ class Work(object):
         Create a new Work Queue.
         """
 
-        self._lock = threading.Lock()
+        self._cond = threading.Condition(threading.Lock())
+        self._queue = collections.deque()
         self.last = None
-        self._queue = queue.Queue()
 
     def empty(self):
         """ Returns true if probably empty. """
-        return self._queue.empty()
+        return not self._queue
 
     def flush(self):
-        """ Locks the queue and flushes all items from it. """
-        jobs = []
-
-        with self._lock:
-            while not self.empty():
-                jobs.append(self._queue.get())
-
+        """ Atomically removes and returns all queued items. """
+        with self._cond:
+            jobs = list(self._queue)
+            self._queue.clear()
         return jobs
 
-    def get(self, *args, **kwargs):
-        """ See queue.Queue.get """
-        with self._lock:
-            value = self._queue.get(*args, **kwargs)
+    def peek(self):
+        """ Returns the next job without removing it, or None if empty. """
+        with self._cond:
+            return self._queue[0] if self._queue else None
+
+    def get(self, block=True, timeout=None):
+        """
+        Remove and return a job. Raises queue.Empty if none arrives in time,
+        or straight away if block is false, as queue.Queue.get does.
+        """
+        with self._cond:
+            if not self._queue:
+                if not block or not self._cond.wait_for(self.__len__, timeout):
+                    raise queue.Empty
+            value = self._queue.popleft()
             self.last = value
             return value
 
-    def put(self, *args, **kwargs):
-        """ See queue.Queue.put """
-        with self._lock:
-            self._queue.put(*args, **kwargs)
+    def get_batch(self, size, timeout=None):
+        """
+        Block until there is work, then remove and return up to size jobs
+        in one go. A batch ends at the TERM sentinel, which is returned last.
+        Returns an empty list on timeout.
+        """
+        with self._cond:
+            if not self._cond.wait_for(self.__len__, timeout):
+                return []
+            jobs = []
+            while self._queue and len(jobs) < size:
+                job = self._queue.popleft()
+                jobs.append(job)
+                if job is Work.TERM:
+                    break
+            if jobs[-1] is not Work.TERM:
+                self.last = jobs[-1]
+            return jobs
+
+    def put(self, job):
+        """ Queue a job. This never blocks. """
+        with self._cond:
+            self._queue.append(job)
+            self._cond.notify()
 
     def terminate(self):
         """ Queues the TERM sentinel, which breaks out of the iterator. """
@@ -59,15 +92,16 @@ class Work(object):
 
     def __next__(self):
         """
-        Tells the queue a task is done and deques a new one.
+        Waits for and deques a new job.
         """
-        with self._lock:
-            value = self._queue.get()
-            if value == Work.TERM:
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            value = self._queue.popleft()
+            if value is Work.TERM:
                 raise StopIteration
-            else:
-                self.last = value
-                return value
+            self.last = value
+            return value
 
     def __len__(self):
-        return self._queue.qsize()
+        return len(self._queue)
@@ -21,7 +21,7 @@ class Worker(threading.Thread):
 
     def __init__(self, work=None):
         super().__init__()
-        self.work = work or Work()
+        self.work = work if work is not None else Work()
         self.flush = False
 
     @abstractmethod
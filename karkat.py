@@ -1,7 +1,7 @@
 #! /usr/bin/env python3.3
 # -*- coding: utf-8 -*-
 """
-Usage: %(name)s [options] <config>
+Usage: %(name)s [options] <config>...
 
 Options:
     -h --help                          Show this message.
@@ -9,12 +9,17 @@ Options:
     -p PACKAGE, --plugins=PACKAGE      Set plugin package [default: plugins]
     -e PLUGINS, --exclude=PLUGINS      Don't load these plugins
     -d --debug                         Turn on debugging
-    -i PASSWORD, --identify=PASSWORD   Identify with the given password
+    -i PASSWORD, --identify=PASSWORD   Identify with the given password on the
+                                       first network
     -s --stdin                         Take password from STDIN
     -r --restart                       Restart on disconnect
     -c NUM, --conns=NUM          Number of output connections [default: 1]
+    -a --async                         Run all connections on one event loop
+    --resume=SNAPSHOT                  Take over connections after a hot restart
 """
 
+import asyncio
+import functools
 import os
 import socket
 import sys
@@ -24,6 +29,8 @@ import docopt
 
 from bot.workers.ircsenders import IRCSender as Printer
 from bot.threads import StatefulBot, Bot
+from bot.asyncbot import AsyncBot, AsyncOutput
+from bot import handoff
 from util.irc import Callback, Message
 import util.text
 import util.scheduler
@@ -35,46 +42,12 @@ socket.setdefaulttimeout(1800)
 GP_CALLERS = 2
 
 
-def main():
+def import_plugins(names, exclude):
     """
-    Karkat's mainloop simply spawns a server and registers all plugins.
-    You can replace this.
+    Import plugin packages and their submodules. Modules are imported once
+    per process and shared by every server.
     """
-    # Parse command line args
-    args = docopt.docopt(__doc__ % {"name": sys.argv[0]}, version=__version__)
-    exclude = args["--exclude"].split(",") if args["--exclude"] else []
-    config_file = args["<config>"]
-    num_connections = int(args["--conns"])
-
-    if args["--stdin"]:
-        args["--identify"] = input("Password: ")
-        sys.argv.extend(["--identify", args["--identify"]])
-
-    if args["--debug"]:
-        debug = 0.15
-    else:
-        debug = None
-
-    server = StatefulBot(config_file, debug=debug)
-
-    if int(args["--conns"]) > 1:
-        def cleanup(output):
-            """ Signal main thread to terminate """
-            output.connected = False
-
-        outputs = [Bot(config_file) for i in range(num_connections-1)]
-        for output in outputs:
-            output.connect()
-            server.printer.add(output)
-            server.register("DIE", cleanup)
-            output.start()
-
-    if args["--restart"]:
-        server.restart = True
-    server.connect()
-    os.makedirs(server.get_config_dir(), exist_ok=True)
-
-    plugins = deque(args["--plugins"].split(","))
+    plugins = deque(names)
     loaded = []
 
     while plugins:
@@ -92,12 +65,42 @@ def main():
                 plugins.extend("%s.%s" % (plugin, i) for i in mod.__modules__)
             loaded.append(mod)
 
-    for module in loaded:
+    return loaded
+
+
+def setup_server(server, config_file, output_type, args, state=None):
+    """
+    Connect a server and its output connections. A server with state from a
+    hot restart resumes its old connection instead.
+    """
+    num_connections = int(args["--conns"])
+
+    def spawn():
+        """ Connect a new output connection. """
+        output = output_type(config_file)
+        output.connect()
+        output.start()
+        return output
 
-        print("Loading %s" % module.__name__)
-        server.loadplugin(module)
+    for i in range(num_connections - 1):
+        server.printer.add(spawn(), spawn)
 
-    if args["--identify"]:
+    if args["--restart"]:
+        server.restart = True
+    if state is not None:
+        server.resume(state)
+    else:
+        server.connect()
+    os.makedirs(server.get_config_dir(), exist_ok=True)
+
+
+def register_extras(server, args, password=None):
+    """
+    Register the callbacks enabled by command line options. Each network
+    identifies with the password it is given, or else its NickServ Password.
+    """
+    password = password or server.config.get("NickServ Password")
+    if password:
         def authenticate(server, line):
             """ Sends nickserv credentials after the server preamble. """
             msg = Message(line)
@@ -108,7 +111,7 @@ def main():
                     cmd = "nickserv IDENTIFY %s"
                 else:
                     return
-                server.sendline(cmd % args["--identify"])
+                server.sendline(cmd % password)
 
         server.register("notice", authenticate)
     if args["--debug"]:
@@ -119,18 +122,91 @@ def main():
         server.printer.verbosity = Printer.FULL_MESSAGE | Printer.QUEUE_STATE
         server.register("ALL", log)
 
+
+def main():
+    """
+    Karkat's mainloop simply spawns a server per config and registers all
+    plugins with each. You can replace this.
+    """
+    # Parse command line args
+    args = docopt.docopt(__doc__ % {"name": sys.argv[0]}, version=__version__)
+    exclude = args["--exclude"].split(",") if args["--exclude"] else []
+
+    if args["--stdin"]:
+        args["--identify"] = input("Password: ")
+        sys.argv.extend(["--identify", args["--identify"]])
+
+    if args["--debug"]:
+        debug = 0.15
+    else:
+        debug = None
+
+    if args["--async"]:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        util.scheduler.use_loop(loop)
+        server_type = functools.partial(AsyncBot, loop=loop)
+        output_type = functools.partial(AsyncOutput, loop=loop)
+    else:
+        server_type = StatefulBot
+        output_type = Bot
+
+    snapshot = handoff.load(args["--resume"]) if args["--resume"] else {}
+
+    servers = []
+    for config_file in args["<config>"]:
+        server = server_type(config_file, debug=debug)
+        setup_server(server, config_file, output_type, args,
+                     snapshot.get(server.name))
+        servers.append(server)
+
+    loaded = import_plugins(args["--plugins"].split(","), exclude)
+
+    for i, server in enumerate(servers):
+        for module in loaded:
+            print("Loading %s" % module.__name__)
+            server.loadplugin(module)
+        # Passwords from the command line belong to the first network only.
+        register_extras(server, args, args["--identify"] if not i else None)
+
     print("Running...")
-    server.start()
+    for server in servers:
+        server.start()
+    running = list(servers)
     try:
-        server.join()
+        while running:
+            running[0].join(1)
+            running = [i for i in running if i.connected]
+            if any(i.restart and not i.connected for i in servers):
+                # Restarting takes every network down with it.
+                break
     except KeyboardInterrupt:
         print("Terminating...")
-        server.connected = False
-        server.sock.send("QUIT\r\n".encode("utf-8"))
+
+    if any(server.restart == "hot" for server in servers):
+        # Hand off the other networks too. Those that cannot be handed off,
+        # such as TLS connections, quit and reconnect after the restart.
+        handing = [i for i in servers if i.handoff or i.can_hand_off()]
+        for server in handing:
+            if not server.handoff:
+                server.hand_off()
+        for server in handing:
+            server.join()
+
+    for server in servers:
+        if server.connected:
+            server.quit()
 
     util.scheduler.stop()
 
-    if server.restart is True:
+    handed = [server for server in servers if server.handoff]
+    if handed:
+        print("Handing off %d connections..." % len(handed))
+        argv = handoff.argv(sys.argv, handoff.save(handed))
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.execv(sys.argv[0], argv)
+    elif any(server.restart for server in servers):
         print("Restarting...")
         sys.stdout.flush()
         sys.stderr.flush()
@@ -17,4 +17,6 @@ __modules__ = [
     "watchdog",
     "nickserv",
     "users",
+    "ignore",
+    "stats",
 ]
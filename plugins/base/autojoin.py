@@ -10,6 +10,8 @@ from util.irc import Callback, command
 class AutoJoin(object):
 
     CHANFILE = "autojoin.txt"
+    # Channels per JOIN. The printer paces the JOINs.
+    JOIN_GROUP = 5
 
     def __init__(self, server):
         self.chanfile = server.get_config_dir(self.CHANFILE)
@@ -32,9 +34,9 @@ class AutoJoin(object):
 
     @Callback.threadsafe
     def join(self, server, line):
-        """ Joins all saved channels on connect. """
-        if self.chans:
-            server.sendline("JOIN :%s" % (",".join(self.chans)))
+        """ Joins all saved channels on connect, a few at a time. """
+        for i in range(0, len(self.chans), self.JOIN_GROUP):
+            server.printer.raw_message("JOIN %s" % ",".join(self.chans[i:i+self.JOIN_GROUP]))
 
     @Callback.threadsafe
     def invited(self, server, line):
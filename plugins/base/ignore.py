@@ -0,0 +1,64 @@
+"""
+Ignores users in a channel.
+
+Masks ignored everywhere are set with Ignore in the config file.
+"""
+import json
+import os
+
+from bot.events import Callback, command
+from util.text import namedtable
+
+
+class Ignore(Callback):
+
+    IGNOREFILE = "ignore.json"
+
+    def __init__(self, server):
+        self.ignorefile = server.get_config_dir(self.IGNOREFILE)
+        try:
+            saved = json.load(open(self.ignorefile, "r"))
+        except IOError:
+            # File doesn't exist
+            os.makedirs(server.get_config_dir(), exist_ok=True)
+            saved = {}
+        for channel, masks in saved.items():
+            for mask in masks:
+                server.ignore(mask, channel)
+        super().__init__(server)
+
+    def sync(self, server):
+        with open(self.ignorefile, "w") as f:
+            f.write(json.dumps({channel: matcher.masks
+                                for channel, matcher in server.ignores.items()
+                                if channel is not None}))
+
+    @Callback.inline
+    @command("ignore", r"(\S+)", prefixes=("", ":"), admin=True,
+             templates={Callback.USAGE: "12Ignore│ Usage: :ignore <nick!user@host>"})
+    def ignore(self, server, message, mask):
+        server.ignore(mask, message.context)
+        self.sync(server)
+        return "12Ignore│ Ignoring %s here." % mask
+
+    @Callback.inline
+    @command("unignore", r"(\S+)", prefixes=("", ":"), admin=True,
+             templates={Callback.USAGE: "12Ignore│ Usage: :unignore <nick!user@host>"})
+    def unignore(self, server, message, mask):
+        if server.unignore(mask, message.context):
+            self.sync(server)
+            return "12Ignore│ No longer ignoring %s here." % mask
+        else:
+            return "12Ignore│ %s is not ignored here." % mask
+
+    @command("ignored", admin=True)
+    def list_ignored(self, server, message):
+        matcher = server.ignores.get(server.lower(message.context))
+        if matcher is not None and matcher.masks:
+            for line in namedtable(matcher.masks, size=72, header="Ignored "):
+                yield line
+        else:
+            yield "12Ignore│ Nobody is ignored here."
+
+
+__initialise__ = Ignore
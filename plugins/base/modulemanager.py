@@ -16,7 +16,7 @@ class ModManager(Callback):
         if isinstance(server, SelectiveBot):
             self.bfile = server.get_config_dir(self.BLACKLIST)
             try:
-                server.blacklist.update(json.load(open(self.bfile, "r")))
+                server.update_blacklist(json.load(open(self.bfile, "r")))
             except:
                 # File doesn't exist
                 os.makedirs(server.get_config_dir(), exist_ok=True)
@@ -39,27 +39,21 @@ class ModManager(Callback):
     @command("disable", "([^ ]+)", prefixes=("", ":"), admin=True,
                 templates={Callback.USAGE: "12│ 🔌 │ Usage: :disable <modname>"})
     def disable_module(self, server, message, mod):
-        blacklisted = server.blacklist.setdefault(server.lower(message.context), 
-                                                  list(server.blacklist[None]))
-        if mod not in blacklisted:
-            blacklisted.append(mod)
+        if server.disable(server.lower(message.context), mod):
+            self.sync(server)
             return "12│ 🔌 │ Module %s disabled." % mod
         else:
             return "12│ 🔌 │ %s is already blacklisted." % mod
-        self.sync(server)
 
     @Callback.inline
     @command("enable", "([^ ]+)", prefixes=("",":"), admin=True,
                 templates={Callback.USAGE: "12│ 🔌 │ Usage: :enable <modname>"})
     def enable_module(self, server, message, mod):
-        blacklisted = server.blacklist.setdefault(server.lower(message.context), 
-                                                  list(server.blacklist[None]))
-        if mod in blacklisted:
-            blacklisted.remove(mod)
+        if server.enable(server.lower(message.context), mod):
+            self.sync(server)
             return "12│ 🔌 │ Module %s re-enabled." % mod
         else:
             return "12│ 🔌 │ %s is not blacklisted." % mod
-        self.sync(server)
 
     @command("disabled")
     def list_disabled(self, server, message):
@@ -76,10 +70,10 @@ class ModManager(Callback):
     def remove_modules(self, bot, mod):
         removed = []
         destroyed = []
-        for i in bot.callbacks:
+        for i in list(bot.callbacks):
             for cb in [x for x in bot.callbacks[i] if x.name.startswith(mod)]:
                 removed.append(cb)
-                bot.callbacks[i].remove(cb)
+                bot.unregister_funct(cb, i)
                 if (hasattr(cb.funct, "__self__") 
                     and hasattr(cb.funct.__self__, "__destroy__")
                     and cb.funct.__self__ not in destroyed):
@@ -15,7 +15,9 @@ class Registration(Callback):
             "330":  [self.identified],
             "nick": [self.nick],
             "quit": [self.quit],
+            "batch": [self.netsplit],
             "352":  [self.who],
+            "354":  [self.whox],
             "kick": [self.kick],
             "part": [self.part]
         }
@@ -63,6 +65,16 @@ class Registration(Callback):
         words = line.split()
         del server.registered[server.lower(Address(words[0]).nick)]
 
+    @Callback.inline
+    @Callback.event
+    def netsplit(self, server, event):
+        """ Netsplits and netjoins arrive as one batch. """
+        for i in event.events or ():
+            if i.command == "QUIT":
+                server.registered.pop(server.lower(i.nick), None)
+            elif i.command == "JOIN":
+                self.joined(server, i.raw)
+
     @Callback.background
     def who(self, server, line):
         words = line.split()
@@ -70,6 +82,13 @@ class Registration(Callback):
         if nick not in server.registered:
             server.registered[nick] = False
             #server.printer.raw_message("WHOIS :%s" % nick)
-        
+
+    @Callback.inline
+    def whox(self, server, line):
+        """ WHOX replies to channel syncs carry the user's account. """
+        words = line.split()
+        if len(words) >= 10 and words[3] == getattr(server, "WHOX_TOKEN", None):
+            server.registered[server.lower(words[7])] = words[9] != "0"
+
 
 __initialise__ = Registration
\ No newline at end of file
@@ -4,8 +4,7 @@ Triggers a bot restart.
 
 from util.irc import command
 
-@command("restart", public=":", private="", admin=True)
-def set_restart(server, message):
+def restart(server, message):
     """ Set the restart flag and disconnect. """
     server.restart = True
     if message.arg is None:
@@ -13,6 +12,22 @@ def set_restart(server, message):
     else:
         server.printer.raw_message("QUIT :Restarting: " + message.arg)
 
+@command("restart", public=":", private="", admin=True)
+def set_restart(server, message):
+    """ Set the restart flag and disconnect. """
+    restart(server, message)
+
+@command("hotrestart", public=":", private="", admin=True)
+def hot_restart(server, message):
+    """
+    Restart without disconnecting: the new process takes over the socket and
+    the bot's state. Falls back to a normal restart over TLS.
+    """
+    if not server.can_hand_off():
+        return restart(server, message)
+    server.restart = "hot"
+    server.hand_off()
+
 @command("quit", public=":", private="", admin=True)
 def shut_down(server, message):
     """ Disconnect from the server, ensuring that the restart flag is unset. """
@@ -22,4 +37,4 @@ def shut_down(server, message):
     else:
         server.printer.raw_message("QUIT :Shutting down: " + message.arg)
 
-__callbacks__ = {"privmsg": [set_restart, shut_down]}
+__callbacks__ = {"privmsg": [set_restart, hot_restart, shut_down]}
@@ -0,0 +1,113 @@
+"""
+Reports which handlers the bot spends its time in.
+
+The admin command !stats lists the handlers which have run the longest, or
+the figures for handlers whose names contain its argument, and !breaker lists
+the handlers the circuit breaker has demoted or disabled. The same figures
+are served in the Prometheus text format if the config has
+
+    Metrics: 9105              (a port on localhost)
+    Metrics: /run/karkat.sock  (or a Unix socket)
+"""
+import http.server
+import os
+import socketserver
+import threading
+
+from bot.events import Callback, command
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """ Serves the bot's metrics at any path. """
+
+    def do_GET(self):
+        body = self.server.bot.metrics.exposition(server=self.server.bot.name)
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        return str(self.client_address[0]) if self.client_address else "local"
+
+    def log_message(self, *args):
+        pass
+
+
+class TCPMetricsServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class UnixMetricsServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Stats(Callback):
+
+    COLOR = "\x0312Stats│\x03 "
+
+    def __init__(self, server):
+        self.endpoint = None
+        address = server.config.get("Metrics")
+        if address is not None:
+            self.endpoint = self.serve(server, address)
+        super().__init__(server)
+
+    @staticmethod
+    def serve(server, address):
+        """ Serve the metrics on a local port or Unix socket path. """
+        if isinstance(address, int):
+            endpoint = TCPMetricsServer(("127.0.0.1", address), MetricsHandler)
+        else:
+            if os.path.exists(address):
+                os.remove(address)
+            endpoint = UnixMetricsServer(address, MetricsHandler)
+        endpoint.bot = server
+        thread = threading.Thread(target=endpoint.serve_forever, daemon=True)
+        thread.start()
+        return endpoint
+
+    @staticmethod
+    def describe(name, executor, stats):
+        return "%s [%s] %d calls, %d errors, %.1fms waiting, %.1fms running" % (
+            name, executor, stats.calls, stats.errors,
+            1000 * stats.wait / stats.calls, 1000 * stats.time / stats.calls
+        )
+
+    @command("stats", r"(\S+)?", admin=True)
+    def stats(self, server, message, name):
+        """ The handlers which have run the longest, or those matching a name. """
+        if name is None:
+            figures = server.metrics.top(5)
+        else:
+            figures = [i for i in sorted(server.metrics.snapshot().items())
+                       if name.lower() in i[0][0].lower()][:5]
+        if not figures:
+            yield self.COLOR + "No handlers have run yet."
+        for (handler, executor), stats in figures:
+            yield self.COLOR + self.describe(handler, executor, stats)
+        dropped = sum(server.metrics.dropped.values())
+        if dropped:
+            yield self.COLOR + "%d calls dropped under load, %d queued now." % (
+                dropped, server.metrics.depth
+            )
+
+    @command("breaker", admin=True)
+    def breaker(self, server, message):
+        """ The handlers the circuit breaker has moved or disabled. """
+        tripped = server.breaker.tripped()
+        if not tripped:
+            yield self.COLOR + "Every handler is running where it should."
+        for name, state in tripped:
+            yield self.COLOR + "%s: %s" % (name, state)
+
+    def __destroy__(self, server):
+        if self.endpoint is not None:
+            self.endpoint.shutdown()
+            self.endpoint.server_close()
+
+
+__initialise__ = Stats
@@ -4,9 +4,10 @@ import json
 from bot.events import command, Callback
 from util.irc import Message
 from util.text import ircstrip, minify, generate_vulgarity
+from util.data import table
 
 def parse(btf):
-    data = open(btf).read().split("\n")
+    data = btf.read().split("\n")
     num = None
     ds = {}
     for i in data:
@@ -116,7 +117,7 @@ def bigtext(server, message, flags, lines, text):
     if "l" in flags:
         text = text.lower()
     if lines > 1:
-        ds = parse("data/bigtext/%d.txt" % lines)
+        ds = table("data/bigtext/%d.txt" % lines, parse)
         text = big(text, ds)
     if "t" in flags:
         text = thicken(text)
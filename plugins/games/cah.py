@@ -643,11 +643,11 @@ class CAHPlayer(object):
     
     def printHand(self, printer):
         if self.compact:
-            lines = self.get_compact_hand(printer.bot)
-        else:
-            lines = self.getHand()
+            # The printer splits the hand to fit, byte for byte.
+            printer.message(self.get_compact_hand(), self.nick, "NOTICE")
+            return
         with printer.buffer(self.nick, "NOTICE") as buff:
-            for i in lines:
+            for i in self.getHand():
                 buff += i
 
     def getHand(self):
@@ -662,17 +662,9 @@ class CAHPlayer(object):
         card = card[0], (card[1][0].upper() + card[1][1:]).rstrip(".")
         return "00,01 %d 01,00 %s " % card
 
-    def get_compact_hand(self, server):
-        # assert len(self.hand) > 1
-        lines = [CAHPREFIX + self.fmt_card((1, self.hand[0]))]
-        for i, text in enumerate(self.hand[1:]):
-            card = i+2, text
-            line = lines[-1] + " " + self.fmt_card(card)
-            if server.can_send(line, self.nick, "NOTICE"):
-                lines[-1] = line
-            else:
-                lines.append(CAHPREFIX + self.fmt_card(card))
-        return lines      
-                
+    def get_compact_hand(self):
+        return CAHPREFIX + " ".join(self.fmt_card((i+1, card))
+                                    for i, card in enumerate(self.hand))
+
 class CAHDeck(list):
     pass
@@ -336,9 +336,21 @@ class Logger(Callback):
         return userinf
 
     @Callback.inline
+    @Callback.event
     def log(self, server, line) -> "ALL":
-        timestamp = datetime.utcnow()
-        event = make_event(line, timestamp=timestamp)
+        if line.command == "BATCH":
+            # Batch markers only group the lines between them, but netsplits
+            # and netjoins hand their lines over on the closing marker.
+            for event in line.events or ():
+                self.add(event)
+            return
+        self.add(line)
+
+    def add(self, line):
+        # Prefer the server's timestamp (server-time), which is accurate for
+        # lines that arrive late, such as history replayed by a bouncer.
+        timestamp = line.time or datetime.utcnow()
+        event = make_event(line.raw, timestamp=timestamp)
         self.db.add(event)
 
     def cache_update(self):
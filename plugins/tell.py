@@ -129,6 +129,13 @@ class Reminder(Callback):
         if server.lower(address.nick) in self.reminders:
             self.send_messages(address.nick, channel)       
 
+    @Callback.event
+    def netjoin_check(self, server, event) -> "batch":
+        """ Users back from a netsplit rejoin in one batch. """
+        for i in event.events or ():
+            if i.command == "JOIN":
+                self.join_check(server, i.raw)
+
     def nick_check(self, server, line) -> "nick":
         hostmask, method, nick = line.split()
         nick = nick[1:]
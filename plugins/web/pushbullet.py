@@ -475,6 +475,15 @@ class PushBullet(Callback):
                         self.skip.add(self.push(push, acc["token"]))
 
 
+    @Callback.event
+    def update_active_netsplit(self, server, event) -> "batch":
+        """ Netsplits and netjoins arrive as one batch. """
+        for i in event.events or ():
+            if i.command == "QUIT":
+                self.update_active_quit(server, i.raw)
+            elif i.command == "JOIN":
+                self.update_active_join(server, i.raw)
+
     def update_active_part(self, server, line) -> "part":
         words = line.split(" ", 3)
         nick = Address(words[0]).nick
@@ -9,6 +9,7 @@ import xml.etree.ElementTree as xml
 import util
 from bot.events import Callback, command
 from util.text import pretty_date
+from util.data import table
 from util.throttle import ThrottledResource
 
 
@@ -168,7 +169,7 @@ class Weather(Callback):
                                                 Callback.USAGE: "4│ Please supply a valid 4 character ICAO airport code."})
     def metar(self, server, msg, station):
         station = station.upper()
-        airports = json.load(open("data/airports.json"))
+        airports = table("data/airports.json")
         station_name = airports.get(station, station)
         params = {"dataSource":"metars",
                   "requestType": "retrieve",
@@ -0,0 +1,27 @@
+""" Fixtures shared by the bot tests. """
+import pytest
+import yaml
+
+# The least a bot needs to be configured.
+CONFIG = {
+    "Nick": ["Kk"],
+    "Real Name": "K",
+    "Server": ["localhost", 6667],
+    "Username": "u",
+    "Admins": [],
+}
+
+
+@pytest.fixture
+def config(tmp_path):
+    """
+    Writes a bot config to tmp_path, with any extra settings, and returns
+    its path. Bot data is kept in tmp_path too.
+    """
+    def config(extra=None):
+        settings = dict(CONFIG, Data=str(tmp_path))
+        settings.update(extra or {})
+        path = tmp_path / "test.yaml"
+        path.write_text(yaml.safe_dump(settings))
+        return str(path)
+    return config
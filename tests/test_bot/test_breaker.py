@@ -0,0 +1,58 @@
+""" Tests for demoting and disabling slow handlers. """
+import time
+
+from bot.threads import Bot, EventHandler
+from util.irc import Callback
+
+
+@Callback.inline
+def slow(server, line):
+    time.sleep(0.01)
+
+
+def make_bot(config):
+    bot = Bot(config({"Admin Channel": "#ops", "Budgets": {"inline": 0.005}}))
+    bot.register("privmsg", slow)
+    return bot
+
+
+def test_slow_handlers_are_demoted_then_disabled(config):
+    bot = make_bot(config)
+    handler = [i for i in bot.callbacks["privmsg"] if i.funct is slow][0]
+    for _ in range(bot.breaker.STRIKES):
+        assert bot.breaker.route(handler) == EventHandler.INLINE
+        bot.dispatch(":a!b@c PRIVMSG #chan :hi")
+    assert bot.breaker.route(handler) == EventHandler.BACKGROUND
+    assert "moved to the background" in bot.printer.work.flush()[0]
+
+    for _ in range(bot.breaker.STRIKES):
+        timed = bot.metrics.timed(handler, "background", EventHandler.BACKGROUND)
+        timed.record(time.time(), 100, False)
+    assert bot.breaker.route(handler) is None
+    assert bot.breaker.tripped()[0][0] == handler.name
+
+    bot.breaker.states[handler.name].disabled = time.time() - 1
+    assert bot.breaker.route(handler) == EventHandler.BACKGROUND
+    for _ in range(bot.breaker.RECOVER):
+        timed = bot.metrics.timed(handler, "background", EventHandler.BACKGROUND)
+        timed.record(time.time(), 0, False)
+    assert bot.breaker.route(handler) == EventHandler.INLINE
+    assert "fast again" in bot.printer.work.flush()[-1]
+
+
+def test_calls_are_counted_while_still_running(config):
+    bot = make_bot(config)
+    handler = [i for i in bot.callbacks["privmsg"] if i.funct is slow][0]
+    stuck = [bot.metrics.timed(handler, "inline") for _ in range(bot.breaker.STRIKES)]
+    for timed in stuck:
+        timed.start = time.time() - 1
+        bot.metrics.running[id(timed)] = timed
+    bot.breaker.check(time.time())
+    assert bot.breaker.route(handler) == EventHandler.BACKGROUND
+    assert "still running" in bot.printer.work.flush()[0]
+    # Finishing does not count against them twice.
+    for timed in stuck:
+        del bot.metrics.running[id(timed)]
+        timed.record(timed.start, 1, False)
+    assert not bot.breaker.overdue
+    assert bot.breaker.states[handler.name].strikes == 0
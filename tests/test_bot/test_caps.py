@@ -0,0 +1,62 @@
+""" Tests for IRCv3 capability negotiation. """
+import base64
+
+from bot.caps import Capabilities
+from util.irc import Event
+
+
+class MockBot(object):
+    username = "karkat"
+
+    def __init__(self):
+        self.sent = []
+
+    def sendline(self, line):
+        self.sent.append(line)
+
+
+def negotiate(caps, lines):
+    for line in lines:
+        assert caps.handle(Event(line))
+    return caps.bot.sent
+
+
+def test_requests_supported_caps_then_ends():
+    caps = Capabilities(MockBot())
+    caps.start()
+    sent = negotiate(caps, [
+        ":irc.example.net CAP * LS * :multi-prefix sasl=PLAIN,EXTERNAL",
+        ":irc.example.net CAP * LS :server-time away-notify batch",
+        ":irc.example.net CAP * ACK :batch multi-prefix",
+        ":irc.example.net CAP * NAK :server-time",
+    ])
+    # Without SASL configured, sasl is not requested.
+    assert sent == ["CAP LS 302",
+                    "CAP REQ :batch multi-prefix server-time",
+                    "CAP END"]
+    assert "batch" in caps and "server-time" not in caps
+    assert caps.available["sasl"] == "PLAIN,EXTERNAL"
+
+
+def test_sasl_plain_delays_cap_end():
+    caps = Capabilities(MockBot(), sasl={"Password": "hunter2"})
+    caps.start()
+    sent = negotiate(caps, [
+        ":irc.example.net CAP * LS :sasl",
+        ":irc.example.net CAP * ACK :sasl",
+        "AUTHENTICATE +",
+    ])
+    payload = base64.b64encode(b"karkat\0karkat\0hunter2").decode("ascii")
+    assert sent[-2:] == ["AUTHENTICATE PLAIN", "AUTHENTICATE %s" % payload]
+    negotiate(caps, [":irc.example.net 900 * karkat!k@h karkat :Logged in",
+                     ":irc.example.net 903 * :SASL authentication successful"])
+    assert sent[-1] == "CAP END" and caps.account == "karkat"
+
+
+def test_cap_notify():
+    caps = Capabilities(MockBot())
+    caps.enabled = {"cap-notify", "server-time"}
+    sent = negotiate(caps, [":irc.example.net CAP karkat DEL :server-time",
+                            ":irc.example.net CAP karkat NEW :batch foo"])
+    assert "server-time" not in caps
+    assert sent == ["CAP REQ :batch"]
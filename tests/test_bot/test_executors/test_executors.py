@@ -0,0 +1,191 @@
+""" Tests for executors. """
+import threading
+import time
+
+from bot.events import Callback
+from bot.threads import EventHandler
+from bot.workers.executors import AsyncExecutor, AsyncExecutorPool, MutexScheduler
+from bot.workers import processes
+
+
+def wait_for(predicate, timeout=2):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_pool_grows_under_load_and_shrinks_when_idle():
+    pool = AsyncExecutorPool(min_size=1, max_size=3)
+    pool.GROW_AFTER = 0.05
+    pool.SHRINK_AFTER = 0.1
+    release = threading.Event()
+    done = []
+    pool.start()
+    try:
+        for i in range(6):
+            pool.call(lambda i=i: (release.wait(2), done.append(i)))
+            time.sleep(0.06)
+        # Every thread is blocked, so the pool grows to its limit and stops.
+        assert wait_for(lambda: len(pool.executors) == 3)
+        release.set()
+        assert wait_for(lambda: len(done) == 6)
+        assert wait_for(lambda: len(pool.executors) == 1)
+    finally:
+        release.set()
+        pool.terminate()
+        pool.join()
+    assert sorted(done) == list(range(6))
+
+
+def test_pool_grows_when_a_burst_blocks_every_thread():
+    pool = AsyncExecutorPool(min_size=1, max_size=4)
+    pool.GROW_AFTER = 0.05
+    release = threading.Event()
+    pool.start()
+    try:
+        # Nothing is queued or picked up after the burst.
+        for _ in range(4):
+            pool.call(release.wait, 2)
+        assert wait_for(lambda: len(pool.executors) == 4)
+    finally:
+        release.set()
+        pool.terminate()
+        pool.join()
+
+
+def test_mutex_sets_run_in_order_and_apart():
+    scheduler = MutexScheduler(AsyncExecutorPool(min_size=2, max_size=2))
+    scheduler.BATCH = 2
+    release = threading.Event()
+    seen = []
+
+    def slow(i):
+        release.wait(2)
+        seen.append(("slow", i))
+
+    def fast(i):
+        seen.append(("fast", i))
+
+    scheduler.start()
+    try:
+        for i in range(5):
+            scheduler.call(slow, i)
+            scheduler.call(fast, i)
+        # The fast set is not held up behind the slow one.
+        assert wait_for(lambda: len(seen) == 5)
+        release.set()
+        assert wait_for(lambda: len(seen) == 10)
+    finally:
+        release.set()
+        scheduler.terminate()
+        scheduler.join()
+    assert [i for kind, i in seen if kind == "slow"] == list(range(5))
+    assert [i for kind, i in seen if kind == "fast"] == list(range(5))
+    assert not scheduler.mailboxes
+
+
+def test_slow_calls_still_exclude_their_set():
+    """ A demoted hook drains in the background, but never beside its siblings. """
+    background = AsyncExecutor()
+    scheduler = MutexScheduler(AsyncExecutorPool(min_size=2, max_size=2), background)
+    lock = threading.Lock()
+    running, overlaps, threads = [], [], []
+
+    def hook(name, pause):
+        with lock:
+            overlaps.append(len(running))
+            running.append(name)
+        threads.append((name, threading.current_thread()))
+        time.sleep(pause)
+        with lock:
+            running.remove(name)
+
+    def first(pause):
+        hook("first", pause)
+
+    def second(pause):
+        hook("second", pause)
+
+    first.__mutex__ = second.__mutex__ = {first, second}
+    background.start()
+    scheduler.start()
+    try:
+        for _ in range(3):
+            scheduler.call_slow(first, 0.05)
+            scheduler.call(second, 0.01)
+        assert wait_for(lambda: len(threads) == 6)
+        assert wait_for(lambda: not scheduler.mailboxes)
+    finally:
+        scheduler.terminate()
+        scheduler.join()
+        background.terminate()
+        background.join()
+    assert overlaps == [0] * 6
+    assert all(thread is background for name, thread in threads if name == "first")
+    assert all(thread is not background for name, thread in threads if name == "second")
+
+
+class Plugin(Callback):
+    def first(self, server, line) -> "privmsg":
+        pass
+
+    def second(self, server, line) -> "join":
+        pass
+
+
+class FakeServer(object):
+    printer = name = None
+
+    def register_all(self, callbacks):
+        self.callbacks = callbacks
+
+
+def test_callback_hooks_share_a_mailbox():
+    """ Hooks of one plugin instance are exclusive, other instances are not. """
+    plugin, other = Plugin(FakeServer()), Plugin(FakeServer())
+    first, second = EventHandler("privmsg", plugin.first), EventHandler("join", plugin.second)
+    assert MutexScheduler.key(first) == MutexScheduler.key(second)
+    assert MutexScheduler.key(first) != MutexScheduler.key(EventHandler("privmsg", other.first))
+
+
+@Callback.cpu
+def render(line):
+    return None if line == "quiet" else line.upper()
+
+
+def test_cpu_callbacks_return_lines():
+    handler = EventHandler("privmsg", render)
+    assert handler.isCPU and handler.executor == "cpu"
+    assert processes.run(render, "a\nb")[2] == ["A", "B"]
+    assert processes.run(render, "quiet")[2] == []
+    assert __name__ in processes._initialised
+
+
+def initialised():
+    return sorted(processes._initialised)
+
+
+class Printer(object):
+    def __init__(self):
+        self.sent = []
+
+    def message(self, line, target):
+        self.sent.append((line, target))
+
+
+def test_cpu_callbacks_run_in_warm_workers():
+    executor = processes.ProcessExecutor(workers=1)
+    server = FakeServer()
+    server.printer = Printer()
+    executor.warm([__name__])
+    try:
+        # The worker set this module up before it took any jobs.
+        assert __name__ in executor.pool.submit(initialised).result(10)
+        executor.call(EventHandler("privmsg", render), server,
+                      ":a!b@c PRIVMSG #chan :hi")
+        assert wait_for(lambda: server.printer.sent, timeout=10)
+        assert server.printer.sent == [(":A!B@C PRIVMSG #CHAN :HI", "#chan")]
+    finally:
+        executor.terminate()
+        executor.join()
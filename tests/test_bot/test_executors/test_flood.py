@@ -0,0 +1,70 @@
+""" Hypotheses and tests about output flood control. """
+from hypothesis import given
+from hypothesis.strategies import lists, integers, sampled_from, tuples
+
+from bot.workers.flood import (
+    TokenBucket, OutputScheduler, PROTOCOL, INTERACTIVE, BULK
+)
+
+
+def unlimited():
+    """ A scheduler with flood control disabled. """
+    return OutputScheduler(TokenBucket(rate=0))
+
+
+def drain(scheduler, now=0):
+    """ Pop every line from a scheduler. """
+    lines = []
+    while len(scheduler):
+        lines.append(scheduler.pop(now))
+    return lines
+
+
+@given(lists(tuples(sampled_from([PROTOCOL, INTERACTIVE, BULK]), integers())))
+def test_lanes_are_strict_priority(jobs):
+    """ Lines come out ordered by lane. """
+    scheduler = unlimited()
+    for lane, value in jobs:
+        scheduler.push((lane, value), lane)
+    assert [i[0] for i in drain(scheduler)] == sorted(i[0] for i in jobs)
+
+
+def test_round_robin_across_targets():
+    """ A long backlog for one target does not starve another. """
+    scheduler = unlimited()
+    for i in range(3):
+        scheduler.push("a%d" % i, target="#a")
+    scheduler.push("b0", target="#b")
+    assert drain(scheduler) == ["a0", "b0", "a1", "a2"]
+
+
+def test_bucket_limits_rate():
+    """ After the burst is spent, lines are released at the refill rate. """
+    scheduler = OutputScheduler(TokenBucket(rate=1, burst=2))
+    for i in range(4):
+        scheduler.push(i)
+    assert scheduler.pop(0) == 0
+    assert scheduler.pop(0) == 1
+    assert scheduler.pop(0) is None
+    assert scheduler.delay(0) == 1
+    assert scheduler.pop(1) == 2
+
+
+@given(lists(integers()))
+def test_flush_returns_all(ints):
+    """ .flush() empties the scheduler and returns every line. """
+    scheduler = OutputScheduler()
+    for i in ints:
+        scheduler.push(i)
+    assert scheduler.flush() == ints
+    assert not len(scheduler)
+
+
+def test_ready_stops_at_the_budget():
+    """ Only the lines the bucket allows right now are coalesced. """
+    scheduler = OutputScheduler(TokenBucket(rate=1, burst=3))
+    for i in range(5):
+        scheduler.push(i)
+    assert scheduler.ready(0) == [0, 1, 2]
+    assert scheduler.ready(0) == []
+    assert scheduler.ready(1) == [3]
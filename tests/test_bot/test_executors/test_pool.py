@@ -0,0 +1,132 @@
+""" Tests for spreading output across connections. """
+from bot.workers.flood import TokenBucket, OutputScheduler
+from bot.workers.pool import OutputPool
+
+
+class MockPrinter(object):
+    def __init__(self):
+        self.raw = []
+
+    def raw_message(self, line):
+        self.raw.append(line)
+
+
+class MockBot(object):
+    def __init__(self, nick):
+        self.nick = nick
+        self.connected = True
+        self.callbacks = {}
+        self.printer = MockPrinter()
+
+    def register(self, trigger, funct):
+        self.callbacks.setdefault(trigger, []).append(funct)
+
+    def receive(self, line):
+        for funct in self.callbacks.get(line.split()[1].lower(), []):
+            funct(self, line)
+
+
+def pool_of(size, rate=1, burst=1):
+    """ A pool of connections which may each send one line per second. """
+    pool = OutputPool(MockBot("main"), TokenBucket(rate, burst))
+    for i in range(1, size):
+        pool.add(MockBot("out%d" % i)).bucket = TokenBucket(rate, burst)
+    return pool
+
+
+def senders(pool, lines, now=0):
+    """ Pop every line that may be sent now, and who sends it. """
+    scheduler = OutputScheduler(pool)
+    for line in lines:
+        scheduler.push(line, target=line.split()[1])
+    return [pool.take(line).number for line in scheduler.ready(now)]
+
+
+def test_budgets_are_per_connection():
+    """ N connections send N times as many private messages at once. """
+    lines = ["PRIVMSG nick%d :hi" % i for i in range(5)]
+    assert senders(pool_of(1), lines) == [0]
+    assert sorted(senders(pool_of(3), lines)) == [0, 1, 2]
+
+
+def test_channels_need_membership():
+    """ Channel messages only go through outputs in the channel. """
+    pool = pool_of(3)
+    out = pool.outputs[1].bot
+    out.receive(":out1!u@h JOIN :#chan")
+    lines = ["PRIVMSG #chan :%d" % i for i in range(3)]
+    assert sorted(senders(pool, lines)) == [0, 1]
+    out.receive(":out1!u@h PART #chan")
+    assert senders(pool, lines, now=10) == [0]
+
+
+def test_private_affinity():
+    """ A nick keeps hearing from the same connection. """
+    pool = pool_of(3, rate=0)
+    first = senders(pool, ["PRIVMSG nick :a"])
+    assert senders(pool, ["PRIVMSG nick :b", "PRIVMSG NICK :c"]) == first * 2
+
+
+def test_affinity_is_bounded():
+    pool = pool_of(2, rate=0)
+    pool.AFFINITY_SIZE = 4
+    senders(pool, ["PRIVMSG nick%d :hi" % i for i in range(10)])
+    assert list(pool.affinity) == ["nick%d" % i for i in range(6, 10)]
+
+
+def test_dead_outputs_leave_rotation():
+    pool = pool_of(3, rate=0)
+    pool.outputs[1].bot.connected = False
+    lines = ["PRIVMSG nick%d :hi" % i for i in range(10)]
+    assert 1 not in senders(pool, lines)
+
+
+def test_protocol_lines_use_main():
+    pool = pool_of(3, rate=0)
+    assert senders(pool, ["MODE #chan +o nick", "WHO #chan"]) == [0, 0]
+
+
+def test_take_releases_only_the_used_reservation():
+    pool = pool_of(3, rate=0)
+    lines = ["PRIVMSG nick%d :hi" % i for i in range(3)]
+    for line in lines:
+        assert pool.consume(0, line)
+    outputs = [pool.reserved[i][0] for i in lines]
+    # A line nobody reserved leaves the others' reservations alone.
+    assert pool.take("PRIVMSG other :hi") is pool.main
+    assert pool.take(lines[2]) is outputs[2]
+    assert [pool.take(i) for i in lines[:2]] == outputs[:2]
+    assert not pool.reserved and not pool.pending
+
+
+def test_stale_reservations_are_bounded():
+    pool = pool_of(1, rate=0)
+    pool.RESERVED_SIZE = 3
+    for i in range(5):
+        assert pool.consume(0, "PRIVMSG nick :%d" % (i % 2))
+    assert pool.pending == 3
+    assert [len(i) for i in pool.reserved.values()] == [1, 2]
+    assert pool.take("PRIVMSG nick :0") is pool.main
+    assert pool.pending == 2
+
+
+def test_shared_buckets_do_not_overspend():
+    """ Two pools drawing on one bucket from many threads. """
+    import threading
+    bucket = TokenBucket(1e-9, 100)
+    first, second = pool_of(1), pool_of(1)
+    first.main.bucket = second.main.bucket = bucket
+    sent = []
+
+    def send(pool):
+        for i in range(100):
+            if pool.consume(0, "PRIVMSG nick :%d" % i):
+                sent.append(i)
+
+    threads = [threading.Thread(target=send, args=(i,))
+               for i in (first, second) * 4]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(sent) == 100
@@ -1,4 +1,9 @@
 """ Hypotheses and tests about work queues. """
+import queue
+import threading
+import time
+
+import pytest
 from hypothesis import given
 from hypothesis.strategies import lists, integers
 
@@ -61,3 +66,69 @@ def test_iterator_terminate(queue):
         length -= 1
     assert length == 0
     assert queue.empty()
+
+
+@given(lists(integers()), integers(min_value=1, max_value=20))
+def test_get_batch_preserves_order(ints, size):
+    """ Draining in batches of any size yields every job, in order. """
+    queue = list_to_queue(ints)
+    drained = []
+    while not queue.empty():
+        batch = queue.get_batch(size)
+        assert 0 < len(batch) <= size
+        drained.extend(batch)
+    assert drained == ints
+
+
+@given(lists(integers()), lists(integers()))
+def test_get_batch_stops_at_terminate(before, after):
+    """ A batch never reaches past the TERM sentinel. """
+    queue = list_to_queue(before)
+    queue.terminate()
+    for i in after:
+        queue.put(i)
+    drained = []
+    while not drained or drained[-1] is not Work.TERM:
+        drained.extend(queue.get_batch(len(before) + len(after) + 1))
+    assert drained == before + [Work.TERM]
+    assert queue.flush() == after
+
+
+def test_get_does_not_block_when_asked():
+    """ A non-blocking get or a timed out batch returns straight away. """
+    work = Work()
+    with pytest.raises(queue.Empty):
+        work.get(block=False)
+    with pytest.raises(queue.Empty):
+        work.get(timeout=0.01)
+    assert work.get_batch(5, timeout=0.01) == []
+
+
+def test_put_while_consumer_waits():
+    """ A consumer blocked on an empty queue does not hold up producers. """
+    work = Work()
+    got = []
+    consumer = threading.Thread(target=lambda: got.extend(work))
+    consumer.start()
+    time.sleep(0.05)
+    putter = threading.Thread(target=lambda: [work.put(1), work.terminate()])
+    putter.start()
+    putter.join(1)
+    consumer.join(1)
+    assert not putter.is_alive() and not consumer.is_alive()
+    assert got == [1]
+
+
+@given(integers(min_value=0, max_value=200))
+def test_flush_is_atomic(count):
+    """ Flushing while producers run loses and duplicates nothing. """
+    work = Work()
+    producers = [threading.Thread(target=lambda: [work.put(i) for i in range(count)])
+                 for _ in range(3)]
+    for producer in producers:
+        producer.start()
+    flushed = work.flush()
+    for producer in producers:
+        producer.join()
+    flushed += work.flush()
+    assert sorted(flushed) == sorted(list(range(count)) * 3)
@@ -0,0 +1,79 @@
+""" Tests for handing connections over on hot restarts. """
+import json
+import socket
+
+from bot import handoff
+from bot.threads import StatefulBot
+
+
+def make_bot(config):
+    bot = StatefulBot(config())
+    bot.nick = "Kk"
+    return bot
+
+
+def test_snapshot_round_trip(config):
+    bot = make_bot(config)
+    bot.dispatch(":s 005 Kk WHOX CASEMAPPING=rfc1459 CHANMODES=b,k,l,nt "
+                 "PREFIX=(ov)@+ :are supported")
+    bot.dispatch(":Kk!u@h JOIN :#a")
+    bot.dispatch(":s 354 Kk 152 #a user host Nick[x] H@ acct")
+    bot.dispatch(":s 315 Kk #a :End of WHO list")
+    bot.dispatch(":s 324 Kk #a +nt")
+    bot.dispatch(":s 368 Kk #a :End of ban list")
+    bot.dispatch(":Kk!u@h JOIN :#b")
+    bot.buff.append(b":s PRIVMSG #a :first\r\n:s PRIVMSG #a :sec")
+    bot.sock, other = socket.socketpair()
+
+    state = json.loads(json.dumps(bot.snapshot()))
+    resumed = make_bot(config)
+    resumed.restore(state)
+
+    assert resumed.is_synced("#a") and not resumed.is_synced("#b")
+    assert resumed.printer.work.flush()[0] == "WHO #b %tcuhnfa,152"
+    assert resumed.get_user_modes("#a", "nick{X}") == ["o"]
+    assert resumed.members.user("NICK[X]").account == "acct"
+    assert resumed.channel_modes == bot.channel_modes
+    assert list(resumed.buff) == [":s PRIVMSG #a :first"]
+    bot.sock.close()
+    other.close()
+
+
+def test_queued_output_survives_hand_off(config):
+    bot = make_bot(config)
+    bot.printer.raw_message("PRIVMSG #a :still queued")
+    bot.hand_off()
+    bot.keep_unsent()
+    assert bot.unsent == ["PRIVMSG #a :still queued"]
+
+    bot.sock, other = socket.socketpair()
+    resumed = make_bot(config)
+    resumed.restore(json.loads(json.dumps(bot.snapshot())))
+    assert resumed.printer.work.flush() == ["PRIVMSG #a :still queued"]
+    bot.sock.close()
+    other.close()
+
+
+def test_cold_start_reuses_saved_lists(config):
+    bot = make_bot(config)
+    bot.dispatch(":s 005 Kk CHANMODES=beI,k,l,nt :are supported")
+    bot.dispatch(":Kk!u@h JOIN :#a")
+    bot.dispatch(":s 367 Kk #a *!*@bad.net op 0")
+    for reply in ("315 Kk #a :End", "324 Kk #a +nt", "368 Kk #a :End",
+                  "349 Kk #a :End", "347 Kk #a :End"):
+        bot.dispatch(":s " + reply)
+    assert bot.is_synced("#a")
+    bot.save_lists()
+
+    restarted = make_bot(config)
+    restarted.dispatch(":s 005 Kk CHANMODES=beI,k,l,nt :are supported")
+    restarted.dispatch(":Kk!u@h JOIN :#a")
+    assert restarted.printer.work.flush() == ["WHO #a", "MODE #a"]
+    assert restarted.is_banned("#a", "x!y@bad.net")
+
+
+def test_argv_replaces_resume_option():
+    args = ["karkat.py", "--resume", "/tmp/old.json", "a.yaml", "--resume=x"]
+    assert handoff.argv(args, "/tmp/new.json") == [
+        "karkat.py", "a.yaml", "--resume", "/tmp/new.json"
+    ]
@@ -0,0 +1,51 @@
+""" Tests for the channel membership store. """
+from hypothesis import given
+from hypothesis.strategies import text
+
+import util
+from bot.members import Members
+
+
+def test_casemappings():
+    members = Members("rfc1459")
+    assert members.lower("Nick[Away]^") == "nick{away}~"
+    members.set_casemapping("strict-rfc1459")
+    assert members.lower("Nick[Away]^") == "nick{away}^"
+    members.set_casemapping("ascii")
+    assert members.lower("Nick[Away]^") == "nick[away]^"
+
+
+@given(text(alphabet="aZ[]{}\\|^~"))
+def test_rfc1459_matches_nickkey(nick):
+    assert Members("rfc1459").lower(nick) == util.rfc_nickkey(nick)
+
+
+def test_channels_act_like_sets_of_nicks():
+    members = Members()
+    channel = members.add_channel("#Chan")
+    channel.add("Alice")
+    members.join("#chan", "Bob", ["o"])
+    assert "ALICE" in channel and "carol" not in channel
+    assert sorted(channel) == ["Alice", "Bob"] and len(channel) == 2
+    assert members.membership("#CHAN", "bob").modes == ["o"]
+    channel.remove("alice")
+    assert members.user("alice") is None
+
+
+def test_quits_and_renames_follow_the_user():
+    members = Members()
+    for name in ("#a", "#b", "#c"):
+        members.join(name, "Dave")
+    members.join("#c", "Erin")
+    members.rename("dave", "David")
+    assert sorted(i.name for i in members.quit("DAVID")) == ["#a", "#b", "#c"]
+    assert sorted(members.channels["#c"]) == ["Erin"] and not members.channels["#a"]
+    assert sorted(members.users) == ["erin"]
+
+
+def test_rekeys_on_casemapping_change():
+    members = Members()
+    members.join("#[chan]", "Nick[1]")
+    members.set_casemapping("rfc1459")
+    assert "NICK{1}" in members.channels["#{chan}"]
+    assert members.user("nick{1}").channels == {"#{chan}"}
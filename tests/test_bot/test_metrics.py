@@ -0,0 +1,35 @@
+""" Tests for handler metrics. """
+import pytest
+
+from bot.metrics import Metrics
+from bot.threads import EventHandler
+
+
+def fails(server, line):
+    raise ValueError(line)
+
+
+def test_timed_calls_are_recorded_per_executor():
+    metrics = Metrics()
+    handler = EventHandler("privmsg", fails)
+    with pytest.raises(ValueError):
+        metrics.timed(handler, handler.executor)(None, "line")
+    metrics.record(handler.name, "inline", 0, 0.02)
+
+    stats = metrics.snapshot()
+    assert stats[handler.name, "general"].calls == 1
+    assert stats[handler.name, "general"].errors == 1
+    assert stats[handler.name, "inline"].errors == 0
+
+
+def test_exposition_is_cumulative_and_escaped():
+    metrics = Metrics()
+    metrics.record('odd"name', "general", 0.5, 0.002)
+    metrics.record('odd"name', "general", 0.5, 20)
+    text = metrics.exposition(server="net")
+    labels = 'executor="general",handler="odd\\"name",server="net"'
+    assert "karkat_handler_calls_total{%s} 2" % labels in text
+    assert 'karkat_handler_duration_seconds_bucket{%s,le="0.001"} 0' % labels in text
+    assert 'karkat_handler_duration_seconds_bucket{%s,le="0.005"} 1' % labels in text
+    assert 'karkat_handler_duration_seconds_bucket{%s,le="+Inf"} 2' % labels in text
+    assert "karkat_handler_queue_wait_seconds_sum{%s} 1.0" % labels in text
@@ -0,0 +1,75 @@
+""" Tests for shedding work under load. """
+import pytest
+
+from bot.events import command, msghandler
+from bot.overload import COMMAND, PASSIVE, PROTOCOL
+from bot.threads import Bot
+from util.irc import Callback
+
+
+@msghandler
+def watcher(server, msg):
+    pass
+
+
+@command("cmd")
+def cmd(server, msg):
+    pass
+
+
+@Callback.inline
+def state(server, line):
+    pass
+
+
+def make_bot(config):
+    bot = Bot(config({"Overload": {"coalesce": 2, "shed": 4, "limit": 6}}))
+    for funct in (watcher, cmd, state):
+        bot.register("privmsg", funct)
+    return bot
+
+
+def test_passive_work_gives_way_first(config):
+    bot = make_bot(config)
+    priorities = {i.funct: i.priority for i in bot.callbacks["privmsg"]}
+    assert [priorities[i] for i in (state, watcher, cmd)] == [PROTOCOL, PASSIVE, COMMAND]
+
+    # The executors are not running, so every queued call stays queued.
+    for _ in range(5):
+        bot.dispatch(":a!b@c PRIVMSG #chan :!cmd")
+    dropped = bot.metrics.dropped
+    name = "%s.watcher" % __name__
+    # The watcher was queued once, coalesced from depth 2, and shed from 4.
+    assert bot.metrics.waiting[name] == 1
+    assert dropped[name, "coalesced"] == 2 and dropped[name, "shed"] == 2
+    assert ("%s.cmd" % __name__, "full") not in dropped
+    assert bot.metrics.depth == 6
+
+    bot.dispatch(":a!b@c PRIVMSG #chan :!cmd")
+    assert dropped["%s.cmd" % __name__, "full"] == 1
+    assert 'reason="shed"' in bot.metrics.exposition()
+
+
+class Broken(object):
+    """ An executor which fails to take calls. """
+    def call(self, *args):
+        raise RuntimeError("full")
+
+
+def test_depth_only_counts_calls_that_can_run(config):
+    bot = make_bot(config)
+    executor, bot.executor = bot.executor, Broken()
+    with pytest.raises(RuntimeError):
+        bot.dispatch(":a!b@c PRIVMSG #chan :!cmd")
+    assert bot.metrics.depth == 0 and not bot.metrics.waiting
+
+    bot.executor = executor
+    bot.dispatch(":a!b@c PRIVMSG #chan :!cmd")
+    assert bot.metrics.depth == 2
+    # Cancelled calls, such as those of a pool shutting down, are let go.
+    for handler in bot.callbacks["privmsg"]:
+        if handler.funct is not state:
+            timed = bot.metrics.timed(handler, handler.executor)
+            bot.metrics.enqueued(timed)
+            timed.cancel()
+    assert bot.metrics.depth == 2
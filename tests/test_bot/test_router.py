@@ -0,0 +1,56 @@
+""" Tests for dispatch tables and command routing. """
+from bot.events import command, msghandler
+from bot.router import CommandRouter, DispatchTables
+from bot.threads import EventHandler
+from util.irc import Event, command as old_command
+
+
+@command("echo say")
+def echo(server, msg):
+    pass
+
+
+@command("admin", prefixes=(".", "@"), admin=True)
+def admin(server, msg):
+    pass
+
+
+@old_command("legacy")
+def legacy(server, msg):
+    pass
+
+
+@msghandler
+def passive(server, msg):
+    pass
+
+
+def names(router, line):
+    return [i.funct.__name__ for i in router.route(Event(line))]
+
+
+def test_routes_by_prefix_and_trigger():
+    router = CommandRouter([EventHandler("privmsg", i)
+                            for i in (echo, passive, admin, legacy)])
+    assert names(router, ":a!b@c PRIVMSG #chan :!echo hi") == ["echo", "passive"]
+    assert names(router, ":a!b@c PRIVMSG #chan :@SAY") == ["echo", "passive"]
+    assert names(router, ":a!b@c PRIVMSG #chan :.admin") == ["passive", "admin"]
+    assert names(router, ":a!b@c PRIVMSG #chan :@legacy") == ["passive", "legacy"]
+    assert names(router, ":a!b@c PRIVMSG #chan :!admin") == ["passive"]
+    assert names(router, ":a!b@c PRIVMSG #chan :echo") == ["passive"]
+    assert names(router, ":a!b@c PRIVMSG #chan :") == ["passive"]
+
+
+def test_blacklisted_modules_skip_channel_messages():
+    callbacks = {"ALL": [EventHandler("ALL", print)],
+                 "privmsg": [EventHandler("privmsg", echo)],
+                 "join": [EventHandler("join", passive)]}
+    tables = DispatchTables(callbacks, {None: [], "#Quiet": [__name__]})
+
+    def lookup(line):
+        return [i.funct for i in tables.lookup(Event(line))]
+
+    assert lookup(":a!b@c PRIVMSG #chan :!echo") == [print, echo]
+    assert lookup(":a!b@c PRIVMSG #quiet :!echo") == [print]
+    assert lookup(":a!b@c JOIN #quiet") == [print, passive]
+    assert lookup(":a!b@c QUIT :bye") == [print]
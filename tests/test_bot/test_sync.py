@@ -0,0 +1,102 @@
+""" Tests for the channel state StatefulBot keeps. """
+from bot.threads import StatefulBot
+from util.irc import Callback
+
+
+def make_bot(config):
+    bot = StatefulBot(config())
+    bot.nick = "Kk"
+    bot.dispatch(":s 005 Kk WHOX CHANMODES=beI,k,l,imnpst PREFIX=(ov)@+ :are supported")
+    return bot
+
+
+def queued(bot):
+    return bot.printer.work.flush()
+
+
+def test_sync_is_limited_and_tracked(config):
+    bot = make_bot(config)
+    bot.SYNC_LIMIT = 1
+    bot.dispatch(":Kk!u@h JOIN :#a")
+    bot.dispatch(":Kk!u@h JOIN :#b")
+    assert queued(bot) == ["WHO #a %tcuhnfa,152", "MODE #a",
+                           "MODE #a b", "MODE #a e", "MODE #a I"]
+    assert not bot.is_synced("#a")
+
+    # Before the list queries are answered, a 482 is for something else.
+    bot.dispatch(":s 482 Kk #a :You're not a channel operator")
+    assert bot.syncing["#a"] == ["who", "modes", "b", "e", "I"]
+    bot.dispatch(":s 354 Kk 152 #a user host Nick H@ account")
+    bot.dispatch(":s 315 Kk #a :End of WHO list")
+    bot.dispatch(":s 324 Kk #a +nt")
+    bot.dispatch(":s 368 Kk #a :End of ban list")
+    bot.dispatch(":s 482 Kk #a :You're not a channel operator")
+    assert bot.syncing["#a"] == ["I"] and queued(bot) == []
+    bot.dispatch(":s 347 Kk #a :End of invite list")
+
+    assert bot.wait_synced("#a", 0)
+    assert bot.get_user_modes("#a", "nick") == ["o"]
+    assert bot.members.user("NICK").account == "account"
+    assert queued(bot)[0] == "WHO #b %tcuhnfa,152"
+
+
+def test_ban_lists_and_ignores(config):
+    bot = make_bot(config)
+    bot.dispatch(":Kk!u@h JOIN :#a")
+    bot.dispatch(":s 367 Kk #a *!*@*.bad.net op 0")
+    bot.dispatch(":s 368 Kk #a :End of ban list")
+    bot.dispatch(":op!o@h MODE #a +e good!*@*")
+    assert bot.is_banned("#A", "x!y@host.bad.net")
+    assert not bot.is_banned("#a", "good!y@host.bad.net")
+
+    heard = []
+    bot.register("privmsg", Callback.inline(lambda server, line: heard.append(line)))
+    bot.ignore("*!*@*.bad.net", "#a")
+    bot.dispatch(":x!y@host.bad.net PRIVMSG #a :hello")
+    bot.dispatch(":x!y@host.bad.net PRIVMSG #b :hello")
+    assert heard == [":x!y@host.bad.net PRIVMSG #b :hello"]
+
+
+def test_netsplits_arrive_as_one_event(config):
+    bot = make_bot(config)
+    bot.dispatch(":Kk!u@h JOIN :#a")
+    for nick in ("a", "b", "c"):
+        bot.dispatch(":%s!u@h JOIN :#a" % nick)
+    heard = []
+    bot.register("quit", Callback.inline(lambda server, line: heard.append(line)))
+    bot.register("batch", Callback.inline(lambda server, line: heard.append(line)))
+
+    bot.dispatch(":s BATCH +x netsplit hub.net leaf.net")
+    for nick in ("a", "b"):
+        bot.dispatch("@batch=x;time=2020-01-01T00:00:00.000Z "
+                     ":%s!u@h QUIT :hub.net leaf.net" % nick)
+    # Nothing changes until the batch closes, and then all at once.
+    assert sorted(bot.get_users("#a")) == ["a", "b", "c"]
+    bot.dispatch(":s BATCH -x")
+    assert sorted(bot.get_users("#a")) == ["c"]
+    assert bot.split_time("A").year == 2020
+    assert heard == [":s BATCH +x netsplit hub.net leaf.net", ":s BATCH -x"]
+
+    bot.dispatch(":s BATCH +y netjoin hub.net leaf.net")
+    bot.dispatch("@batch=y :a!u@h JOIN #a")
+    bot.dispatch(":s BATCH -y")
+    assert "a" in bot.get_users("#a") and bot.split_time("a") is None
+
+
+def test_held_lines_are_capped(config):
+    bot = make_bot(config)
+    bot.HELD_SIZE = 1
+    bot.dispatch(":Kk!u@h JOIN :#a")
+    for nick in ("a", "b"):
+        bot.dispatch(":%s!u@h JOIN :#a" % nick)
+    heard = []
+    bot.register("quit", Callback.inline(lambda server, line: heard.append(line)))
+
+    bot.dispatch(":s BATCH +x netsplit hub.net leaf.net")
+    for nick in ("a", "b"):
+        bot.dispatch("@batch=x :%s!u@h QUIT :hub.net leaf.net" % nick)
+    # Past the cap, lines go out as they arrive.
+    assert heard == [":b!u@h QUIT :hub.net leaf.net"]
+    assert sorted(bot.get_users("#a")) == ["a"]
+    bot.dispatch(":s BATCH -x")
+    assert not bot.get_users("#a") and not bot.held
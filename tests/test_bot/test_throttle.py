@@ -0,0 +1,64 @@
+""" Tests for per-user input rate limiting. """
+from bot.events import command
+from bot.threads import SelectiveBot
+
+
+@command("cmd")
+def cmd(server, msg):
+    pass
+
+
+@command("cmd")
+def also(server, msg):
+    pass
+
+
+@command("fetch")
+def fetch(server, msg):
+    pass
+
+fetch.rate_class = "network"
+
+
+def make_bot(config):
+    bot = SelectiveBot(config({
+        "Admins": ["admin"],
+        "Input Limits": {
+            "command": {"rate": 0.001, "burst": 2,
+                        "channel rate": 0.001, "channel burst": 3},
+            "network": {"rate": 0.001, "burst": 1, "channel rate": 0},
+        },
+    }))
+    for funct in (cmd, also, fetch):
+        bot.register("privmsg", funct)
+    notices = []
+    bot.printer.message = lambda text, nick, method: notices.append((nick, method))
+    return bot, notices
+
+
+def test_users_are_throttled_with_one_notice(config):
+    bot, notices = make_bot(config)
+    for _ in range(4):
+        bot.dispatch(":a!b@c PRIVMSG #chan :!cmd")
+    # Both handlers ran for the first two messages, paying one token each.
+    assert bot.metrics.depth == 4
+    assert bot.metrics.dropped["%s.cmd" % __name__, "throttled"] == 2
+    assert notices == [("a", "NOTICE")]
+
+    # Network commands have their own, tighter, buckets.
+    bot.dispatch(":a!b@c PRIVMSG #chan :!fetch")
+    bot.dispatch(":a!b@c PRIVMSG #chan :!fetch")
+    assert bot.metrics.dropped["%s.fetch" % __name__, "throttled"] == 1
+
+    # The channel's bucket has one token left, and admins don't use it.
+    for _ in range(3):
+        bot.dispatch(":x!y@admin PRIVMSG #chan :!cmd")
+    bot.dispatch(":d!e@f PRIVMSG #chan :!cmd")
+    bot.dispatch(":g!h@i PRIVMSG #chan :!cmd")
+    assert bot.metrics.dropped["%s.cmd" % __name__, "throttled"] == 3
+    assert notices == [("a", "NOTICE"), ("a", "NOTICE"), ("g", "NOTICE")]
+
+    # Refused by the channel, g keeps their own tokens, and d is told too.
+    assert bot.limiter.buckets["command", "user", "h@i"].tokens == 2
+    bot.dispatch(":d!e@f PRIVMSG #chan :!cmd")
+    assert notices[-1] == ("d", "NOTICE")
@@ -0,0 +1,56 @@
+""" Tests for parsing IRC lines. """
+from util.irc import Event, Message, Command, HostmaskMatcher
+
+
+def test_event_fields():
+    event = Event(":nick!user@host PRIVMSG #chan :hello there :)")
+    assert event.prefix == "nick!user@host"
+    assert event.command == "PRIVMSG" and event.type == "privmsg"
+    assert event.params == ["#chan", "hello there :)"]
+    assert event.nick == "nick" and event.address.mask == "host"
+    assert event.context == "#chan"
+
+
+def test_event_without_prefix():
+    event = Event("PING :irc.example.net")
+    assert event.prefix is None and event.address is None
+    assert event.type == "ping" and event.trailing == "irc.example.net"
+
+
+def test_numeric_without_trailing():
+    event = Event(":irc.example.net 005 nick CHANTYPES=# PREFIX=(ov)@+")
+    assert event.type == "005"
+    assert event.params == ["nick", "CHANTYPES=#", "PREFIX=(ov)@+"]
+    assert event.address is None and event.nick == "irc.example.net"
+
+
+def test_message_from_event_matches_raw():
+    """ Handlers see the same Message whether or not the line was parsed. """
+    for line in [":nick!user@host PRIVMSG #chan :!cmd some args",
+                 ":nick!user@host PRIVMSG bot :.cmd"]:
+        event = Event(line)
+        for parsed, raw in [(event.message(), Message(line)),
+                            (event.as_command(), Command(line))]:
+            assert vars(parsed) == dict(vars(raw), address=parsed.address)
+            assert parsed.address.hostmask == raw.address.hostmask
+    assert event.as_command() is event.as_command()
+
+
+def test_message_tags_are_split_off():
+    event = Event("@time=2011-10-19T16:40:51.620Z;batch=ref;note=a\\sb\\:c "
+                  ":nick!user@host PRIVMSG #chan :hi")
+    assert event.raw == str(event) == ":nick!user@host PRIVMSG #chan :hi"
+    assert event.tags["note"] == "a b;c" and event.batch == "ref"
+    assert event.time.isoformat() == "2011-10-19T16:40:51.620000"
+    assert Event("PING :x").tags == {} and Event("PING :x").time is None
+
+
+def test_hostmask_matcher():
+    rfc = lambda s: s.lower().translate(str.maketrans("[]\\~", "{}|^"))
+    matcher = HostmaskMatcher(["*!*@*.example.com", "Nick[1]!?ser@host"], rfc)
+    assert matcher.match(":a!b@irc.example.com")
+    assert not matcher.match("a!b@example.com")
+    assert matcher.match("nick{1}!user@HOST") and not matcher.match("nick{1}!user@hostx")
+    matcher.remove("*!*@*.example.com")
+    assert not matcher.match(":a!b@irc.example.com")
+    assert not HostmaskMatcher().match("a!b@c")
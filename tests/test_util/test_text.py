@@ -0,0 +1,137 @@
+""" Hypotheses and tests about line framing. """
+import re
+
+from hypothesis import given
+from hypothesis.strategies import lists, text, integers
+
+from util.text import Buffer, LineFramer, wrap, ircstrip, colourise
+
+
+class MockSocket(object):
+    """ Mock socket which returns the stream in fixed size chunks. """
+    def __init__(self, data, chunk):
+        self.data = memoryview(data)
+        self.chunk = chunk
+
+    def recv_into(self, buffer):
+        size = min(len(buffer), self.chunk, len(self.data))
+        buffer[:size] = self.data[:size]
+        self.data = self.data[size:]
+        return size
+
+
+def encode(lines):
+    """ Turns a list of lines into an IRC byte stream. """
+    return "".join("%s\r\n" % i for i in lines).encode("utf-8")
+
+
+line_lists = lists(text(alphabet="abc é☃\t:"))
+
+
+@given(line_lists, integers(min_value=1, max_value=64))
+def test_framer_matches_buffer(lines, chunk):
+    """ Appending a stream in any chunking yields the same lines as Buffer. """
+    data = encode(lines)
+    old, new = Buffer(), LineFramer(size=16)
+    framed = []
+    for i in range(0, len(data), chunk):
+        old.append(data[i:i+chunk])
+        new.append(data[i:i+chunk])
+        framed.extend(new)
+    assert framed == list(old)
+
+
+@given(line_lists, integers(min_value=1, max_value=64))
+def test_recv_into_returns_all_lines(lines, chunk):
+    """ Reading a stream from a socket returns every line, in order. """
+    sock = MockSocket(encode(lines), chunk)
+    framer = LineFramer(size=8)
+    framed = []
+    while framer.recv_into(sock):
+        framed.extend(framer)
+    assert framed == lines
+    assert not len(framer)
+
+
+def test_partial_line_is_kept():
+    """ An incomplete line is held until its delimiter arrives. """
+    framer = LineFramer()
+    framer.append(b"PING :abc")
+    assert list(framer) == []
+    framer.append(b"\r\nPI")
+    assert list(framer) == ["PING :abc"]
+    assert len(framer) == 2
+
+
+@given(text(alphabet="ab é☃\x02\x0f"), integers(min_value=8, max_value=64))
+def test_wrap_fits_the_limit(line, limit):
+    """ Every piece fits, and no text is lost except spaces at breaks. """
+    pieces = wrap(line, limit)
+    assert all(len(i.encode("utf-8")) <= limit for i in pieces)
+    assert (ircstrip("".join(pieces)).replace(" ", "") ==
+            ircstrip(line).replace(" ", ""))
+
+
+@given(text(alphabet="a ,1\x02\x03", min_size=1), integers(min_value=8, max_value=64))
+def test_wrap_counts_carried_codes(line, limit):
+    """ Pieces fit with the codes they carry, and none are empty. """
+    pieces = wrap(line, limit)
+    assert all(len(i.encode("utf-8")) <= limit for i in pieces)
+    assert all(i for i in pieces)
+
+
+def test_wrap_drops_empty_pieces():
+    assert wrap(" " + "b" * 30, 12) == ["b" * 12, "b" * 12, "b" * 6]
+
+
+def test_wrap_guards_carried_colours():
+    """ A comma after a carried colour is not read as its background. """
+    pieces = wrap("\x0304" + "a" * 9 + ",12 apples", 12)
+    assert pieces[1] == "\x0304\x02\x02,12"
+    assert "".join(ircstrip(i) for i in pieces) == "a" * 9 + ",12apples"
+
+
+def test_wrap_prefers_words():
+    assert wrap("hello there world", 12) == ["hello there", "world"]
+
+
+def test_wrap_carries_formatting():
+    """ Pieces restore the colour and toggles in effect. """
+    pieces = wrap("\x034,3\x02" + "a" * 20, 10)
+    assert all(i.startswith("\x0304,03\x02") for i in pieces[1:])
+
+
+def render(line, colour=None):
+    """
+    The formatting of each visible character, reading unset colours as
+    the given default.
+    """
+    state = (colour, None, frozenset())
+    chars = []
+    codes = r"([\x02\x1d\x1f\x16\x0f])|\x03(\d\d?)?(?:,(\d\d?))?"
+    position = 0
+    for match in re.finditer(codes, line + "\x0f"):
+        chars.extend((i, state) for i in line[position:match.start()])
+        position = match.end()
+        toggle, fg, bg = match.groups()
+        if toggle == "\x0f":
+            state = (colour, None, frozenset())
+        elif toggle:
+            state = state[:2] + (state[2] ^ {toggle},)
+        elif fg is None and bg is None:
+            state = (colour, None, state[2])
+        else:
+            state = (colour if fg is None else int(fg),
+                     state[1] if bg is None else int(bg),
+                     state[2])
+    return chars
+
+
+@given(text(alphabet="a1, \x02\x03\x0f\x1f"))
+def test_colourise_keeps_formatting(line):
+    """ The coloured line looks like the original on the default colour. """
+    assert render(colourise(line, 14)) == render(line, 14)
+
+
+def test_colourise_minifies():
+    assert colourise("a\x0f\x0f\x02\x02b\x02\x0304", 14) == "\x0314ab"
@@ -8,6 +8,7 @@ from . import images
 from . import files
 from . import throttle
 from . import database
+from . import data
 
 # Taken straight from the xchat source. Thanks, xchat!
 rfc_tolowertab = {'A': 'a', 'G': 'g', '\\': '|', '^': '~', 'D': 'd', 'C': 'c', 'T': 't', 'M': 'm', 'I': 'i', 'B': 'b', 'N': 'n', 'R': 'r', 'W': 'w', 'L': 'l', 'F': 'f', 'Y': 'y', '[': '{', 'P': 'p', 'S': 's', 'H': 'h', ']': '}', 'O': 'o', 'Q': 'q', 'U': 'u', 'V': 'v', 'J': 'j', 'K': 'k', 'E': 'e', 'Z': 'z', 'X': 'x'}
@@ -41,4 +42,4 @@ def parallelise(jobs):
     for i in threads: i.join()
     return [i.answer for i in threads]
 
-__all__ = ["services", "irc", "text", "parallelise", "cmp", "rfc_nickkey", "average", "dcc", "images", "files", "throttle"]
\ No newline at end of file
+__all__ = ["services", "irc", "text", "parallelise", "cmp", "rfc_nickkey", "average", "dcc", "images", "files", "throttle", "data"]
\ No newline at end of file
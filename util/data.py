@@ -0,0 +1,32 @@
+"""
+Shared access to the static tables in data/.
+
+Each table is loaded once per process, however many servers use it, and is
+frozen so that no server can modify another's view of it.
+"""
+
+import json
+import threading
+
+from types import MappingProxyType
+
+_tables = {}
+_lock = threading.Lock()
+
+
+def freeze(data):
+    """ Recursively convert dicts and lists to read-only equivalents. """
+    if isinstance(data, dict):
+        return MappingProxyType({k: freeze(v) for k, v in data.items()})
+    elif isinstance(data, list):
+        return tuple(freeze(i) for i in data)
+    return data
+
+
+def table(path, parser=json.load):
+    """ Return the table at path, parsing it with parser on first use. """
+    with _lock:
+        if path not in _tables:
+            with open(path) as datafile:
+                _tables[path] = freeze(parser(datafile))
+        return _tables[path]
@@ -5,9 +5,25 @@ Utilities relating to the IRC protocol and parsing messages from the IRC layer.
 import functools
 import re
 import inspect
+import threading
+from datetime import datetime
 
 MAX_MESSAGE_SIZE = 512 # in bytes
 
+TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+
+def parse_tags(tags):
+    """ Parses IRCv3 message tags into a dict, unescaping their values. """
+    parsed = {}
+    for tag in tags.split(";"):
+        key, _, value = tag.partition("=")
+        if "\\" in value:
+            value = re.sub(r"\\(.?)", lambda m: TAG_ESCAPES.get(m.group(1), m.group(1)), value)
+        parsed[key] = value
+    return parsed
+
+
 class Address(object):
     def __init__(self, addr):
         self.nick, self.ident, self.mask = (
@@ -18,15 +34,208 @@ class Address(object):
         self.hostmask = addr
 
 
+def mask_pattern(mask):
+    """ The regex for an IRC wildcard mask, where * and ? are the wildcards. """
+    return "".join(".*" if i == "*" else "." if i == "?" else re.escape(i)
+                   for i in mask)
+
+
+class HostmaskMatcher(object):
+    """
+    Matches nick!user@host strings against a list of IRC wildcard masks.
+
+    The masks are casemapped with `lower` and compiled into one regex the
+    first time they are needed, and each hostmask's verdict is cached until
+    the masks change. Call invalidate() if the casemapping changes.
+    """
+
+    CACHE_SIZE = 4096
+
+    def __init__(self, masks=(), lower=str.lower):
+        self.lower = lower
+        self.masks = list(masks)
+        self.pattern = None
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def add(self, mask):
+        with self.lock:
+            if mask not in self.masks:
+                self.masks.append(mask)
+            self.invalidate()
+
+    def remove(self, mask):
+        with self.lock:
+            if mask in self.masks:
+                self.masks.remove(mask)
+            self.invalidate()
+
+    def invalidate(self):
+        """ Recompile the masks and forget cached verdicts on next use. """
+        self.pattern = None
+        self.cache = {}
+
+    def compile(self):
+        if not self.masks:
+            # Matches nothing.
+            return re.compile("(?!)")
+        return re.compile("(?:%s)\\Z" % "|".join(mask_pattern(self.lower(i))
+                                                 for i in self.masks))
+
+    def match(self, hostmask):
+        """ True if a hostmask matches any of the masks. """
+        hostmask = hostmask.lstrip(":")
+        verdict = self.cache.get(hostmask)
+        if verdict is not None:
+            return verdict
+        with self.lock:
+            if self.pattern is None:
+                self.pattern = self.compile()
+            verdict = self.pattern.match(self.lower(hostmask)) is not None
+            if len(self.cache) >= self.CACHE_SIZE:
+                self.cache = {}
+            self.cache[hostmask] = verdict
+        return verdict
+
+    def __repr__(self):
+        return "HostmaskMatcher(%r)" % self.masks
+
+
+class Event(object):
+    """
+    A line from the server, split once into its prefix, command and
+    parameters. Everything else is worked out the first time it is used.
+
+    IRCv3 message tags are split off into a dict, so str(event) and
+    event.raw are the line without them, as plugins expect.
+
+    The BATCH line closing a netsplit or netjoin carries the lines of the
+    batch in `events`; they are not dispatched on their own.
+    """
+
+    __slots__ = ("raw", "tags", "prefix", "command", "params", "events",
+                 "_address", "_message", "_command", "_key")
+
+    def __init__(self, raw):
+        self._address = self._message = self._command = self._key = None
+        self.events = None
+        if raw.startswith("@"):
+            tags, _, raw = raw[1:].partition(" ")
+            self.tags = parse_tags(tags)
+        else:
+            self.tags = {}
+        self.raw = raw
+        if raw.startswith(":"):
+            self.prefix, _, raw = raw[1:].partition(" ")
+        else:
+            self.prefix = None
+        middle, colon, trailing = raw.partition(" :")
+        self.params = middle.split()
+        self.command = self.params.pop(0).upper() if self.params else ""
+        if colon:
+            self.params.append(trailing)
+
+    @classmethod
+    def of(cls, line):
+        """ Returns line if it is an Event, else parses it. """
+        return line if isinstance(line, Event) else cls(line)
+
+    @property
+    def type(self):
+        """ The key callbacks for this event are registered under. """
+        return self.command.lower()
+
+    @property
+    def address(self):
+        if self._address is None and self.prefix and "@" in self.prefix:
+            self._address = Address(":" + self.prefix)
+        return self._address
+
+    @property
+    def nick(self):
+        """ The sender's nick, or the server's name. """
+        if self.prefix is None:
+            return None
+        return self.prefix.split("!", 1)[0]
+
+    @property
+    def target(self):
+        return self.params[0] if self.params else None
+
+    @property
+    def trailing(self):
+        """ The last parameter, which is the only one that may hold spaces. """
+        return self.params[-1] if self.params else None
+
+    @property
+    def context(self):
+        """ Where to reply: the channel, or the sender of a private message. """
+        target = self.target
+        if target is not None and "#" not in target:
+            return self.nick
+        return target
+
+    @property
+    def time(self):
+        """ When the server says this happened, as a naive UTC datetime. """
+        stamp = self.tags.get("time")
+        if not stamp:
+            return None
+        try:
+            return datetime.strptime(stamp.rstrip("Z"), "%Y-%m-%dT%H:%M:%S.%f")
+        except ValueError:
+            try:
+                return datetime.strptime(stamp.rstrip("Z"), "%Y-%m-%dT%H:%M:%S")
+            except ValueError:
+                return None
+
+    @property
+    def batch(self):
+        """ The reference of the batch this event belongs to, if any. """
+        return self.tags.get("batch")
+
+    def key(self, lower=str.lower):
+        """ The casefolded context. The first casemapping asked for sticks. """
+        if self._key is None:
+            self._key = lower(self.context or "")
+        return self._key
+
+    def message(self):
+        """ This event as a Message, shared by every handler. """
+        if self._message is None:
+            self._message = Message(self)
+        return self._message
+
+    def as_command(self):
+        """ This event as a Command, shared by every handler. """
+        if self._command is None:
+            self._command = Command(self)
+        return self._command
+
+    def __str__(self):
+        return self.raw
+
+    def __repr__(self):
+        return "Event(%r)" % self.raw
+
+
 class Message(object):
     def __init__(self, raw_message):
-        address, method, target, message = raw_message.split(" ", 3)
-        message = message[1:]
-        self.address = Address(address)
-        self.method = method
-        self.context = target
-        if "#" not in target:
-            self.context = self.address.nick
+        if isinstance(raw_message, Event):
+            event = raw_message
+            self.address = event.address
+            self.method = event.command
+            self.context = event.context
+            message = event.params[1] if len(event.params) > 1 else ""
+            raw_message = event.raw
+        else:
+            address, method, target, message = raw_message.split(" ", 3)
+            message = message[1:]
+            self.address = Address(address)
+            self.method = method
+            self.context = target
+            if "#" not in target:
+                self.context = self.address.nick
         self.text = message
         self.words = message.split(" ")
         self.message = raw_message
@@ -100,6 +309,29 @@ class Callback(object):
     def isBackground(funct):
         return hasattr(funct, "isBackground") and funct.isBackground
 
+    @staticmethod
+    def cpu(funct):
+        """
+        Run the callback in a worker process. See bot.workers.processes for
+        what such callbacks may do.
+        """
+        funct.isCPU = True
+        return funct
+
+    @staticmethod
+    def isCPU(funct):
+        return hasattr(funct, "isCPU") and funct.isCPU
+
+    @staticmethod
+    def event(funct):
+        """ Pass the callback a parsed Event instead of the raw line. """
+        funct.takesEvent = True
+        return funct
+
+    @staticmethod
+    def takesEvent(funct):
+        return hasattr(funct, "takesEvent") and funct.takesEvent
+
     @staticmethod
     def xchat(funct):
         """
@@ -137,7 +369,7 @@ def command(triggers, args=None, key=str.lower, usage=None, error=None, admin=Fa
         @functools.wraps(funct)
         def _(*argv):
             try:
-                message = Command(argv[-1])
+                message = Event.of(argv[-1]).as_command()
                 server = argv[-2]
                 user = message.address
 
@@ -196,5 +428,12 @@ def command(triggers, args=None, key=str.lower, usage=None, error=None, admin=Fa
                             with output as out:
                                 out += error
                         raise
+        _.takesEvent = True
+        _.private = private
+        _.public = public
+        _.triggers = triggers
+        _.key = key
+        _.funct = funct
+        _.admin_only = admin
         return _
     return decorator
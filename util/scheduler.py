@@ -65,6 +65,47 @@ class Scheduler(threading.Thread):
     def stop(self):
         self.incoming.put((-1,))
 
+class LoopScheduler(object):
+    """
+    Runs scheduled jobs as timers on an asyncio event loop, rather than in a
+    scheduler thread. Jobs may be scheduled from any thread.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.stopped = False
+
+    def schedule(self, time, job, args, kwargs):
+        self.loop.call_soon_threadsafe(self._schedule, time, job, args, kwargs)
+
+    def _schedule(self, when, job, args, kwargs):
+        delay = max(0, when - time.time())
+        self.loop.call_later(delay, self._run, job, args, kwargs)
+
+    def _run(self, job, args, kwargs):
+        if self.stopped:
+            return
+        try:
+            job(*args, **kwargs)
+        except BaseException:
+            traceback.print_exc()
+
+    def stop(self):
+        self.stopped = True
+
+
+_loop_scheduler = None
+
+def use_loop(loop):
+    """ Run all scheduled jobs on the given event loop from now on. """
+    global _loop_scheduler
+    _loop_scheduler = LoopScheduler(loop)
+
+def get_scheduler():
+    if _loop_scheduler is not None:
+        return _loop_scheduler
+    return Scheduler()
+
 class Job(object):
     def __init__(self, job, seconds=0, stop_after=1):
         self.job = job
@@ -75,7 +116,7 @@ class Job(object):
     def __call__(self, *args, **kwargs):
         if self.stop: 
             return
-        scheduler = Scheduler()
+        scheduler = get_scheduler()
 
         if self.stop_after != 1:
             scheduler.schedule(time.time() + self.interval, self, args, kwargs)
@@ -88,17 +129,19 @@ class Job(object):
 
 
 def schedule(time, job, args=(), kwargs={}):
-    scheduler = Scheduler()
+    scheduler = get_scheduler()
     job = Job(job)
     scheduler.schedule(time, job, args, kwargs)
     return job
 
 def schedule_after(seconds, job, args=(), kwargs={}, stop_after=1):
-    scheduler = Scheduler()
+    scheduler = get_scheduler()
     job = Job(job, seconds, stop_after)
     scheduler.schedule(time.time() + seconds, job, args, kwargs)
     return job
 
 def stop():
-    if Scheduler._scheduler:
+    if _loop_scheduler is not None:
+        _loop_scheduler.stop()
+    elif Scheduler._scheduler:
         Scheduler().stop()
\ No newline at end of file
@@ -5,6 +5,7 @@ This module contains functions that format text.
 import re
 import time
 import math
+import functools
 from datetime import timedelta
 import html.entities
 import random
@@ -22,12 +23,205 @@ class ControlCode:
 
 
 def lineify(data, max_size=512):
-    """ Split text up into IRC-safe lines. """
+    """
+    Split text up into IRC-safe lines. A max_size of None leaves long lines
+    whole, for wrap to split by bytes.
+    """
     # TODO
     lines = [item.rstrip()[:max_size] for item in data.split('\n')]
     return lines
 
 
+_colour_code = re.compile(r"\x03(?:(\d\d?)(?:,(\d\d?))?)?")
+_toggles = "\x02\x1d\x1f\x16"
+
+
+def _utf8_width(char):
+    point = ord(char)
+    if point < 0x80:
+        return 1
+    elif point < 0x800:
+        return 2
+    elif point < 0x10000:
+        return 3
+    return 4
+
+
+def wrap(line, limit, encoding="utf-8"):
+    """
+    Split a line into pieces of at most `limit` encoded bytes, preferring to
+    break between words. Pieces never split a character or control code,
+    and start with whatever codes restore the formatting in effect where
+    the previous piece ended.
+    """
+    if len(line) * 4 <= limit or len(line.encode(encoding, "replace")) <= limit:
+        return [line]
+
+    if encoding.lower().replace("-", "") == "utf8":
+        width = _utf8_width
+    else:
+        width = lambda char: len(char.encode(encoding, "replace"))
+
+    pieces = []
+    colour, toggles = "", ""
+    carry, start, size = "", 0, 0
+    space = None  # Index, size, colour and toggles just after a space.
+    i, end = 0, len(line)
+    while i < end:
+        char = line[i]
+        if char == "\x03":
+            match = _colour_code.match(line, i)
+            token = match.group(0)
+            step = len(token)
+        else:
+            token, step = char, width(char)
+
+        if size + step > limit and i == start and carry:
+            # There is no room for the formatting, so the piece goes without.
+            size -= len(carry)
+            carry = ""
+            continue
+        if size + step > limit and i > start:
+            if space is not None:
+                cut, cut_size, colour_at, toggles_at = space
+                piece = line[start:cut - 1]
+            else:
+                cut, cut_size, colour_at, toggles_at = i, size, colour, toggles
+                piece = line[start:cut]
+            if piece:
+                pieces.append(carry + piece)
+            carry = colour_at + toggles_at
+            if colour_at and not toggles_at and line[cut:cut + 1] == ",":
+                # Two bolds cancel out, and stop the comma being read as a code.
+                carry += "\x02\x02"
+            size = len(carry) + size - cut_size
+            start, space = cut, None
+            continue
+
+        if char == "\x03":
+            fg, bg = match.groups()
+            if fg is None:
+                colour = ""
+            elif bg is not None or not colour:
+                # Pad the colours, so a carried code cannot swallow digits.
+                colour = "\x03%02d" % int(fg) + (",%02d" % int(bg) if bg else "")
+            else:
+                # Only the foreground changed.
+                colour = "\x03%02d" % int(fg) + colour[3:]
+        elif char == "\x0f":
+            colour, toggles = "", ""
+        elif char in _toggles:
+            if char in toggles:
+                toggles = toggles.replace(char, "")
+            else:
+                toggles += char
+        elif char == " ":
+            space = (i + 1, size + step, colour, toggles)
+        size += step
+        i += len(token)
+
+    if line[start:]:
+        pieces.append(carry + line[start:])
+    return pieces
+
+
+_format_code = re.compile(r"([\x02\x1d\x1f\x16\x0f])|\x03(\d\d?)?(?:,(\d\d?))?")
+_format_chars = re.compile(r"[\x02\x03\x0f\x16\x1d\x1f]")
+
+
+def _colour(fg, bg, after):
+    """ The shortest colour code which the text after it cannot extend. """
+    if bg is None:
+        if after[:1].isdigit():
+            return "\x03%.2d" % fg
+        code = "\x03%d" % fg
+        if after[:1] == "," and after[1:2].isdigit():
+            # Two bolds cancel out, and stop the comma being read as a code.
+            code += "\x02\x02"
+        return code
+    if after[:1].isdigit():
+        return "\x03%d,%.2d" % (fg, bg)
+    return "\x03%d,%d" % (fg, bg)
+
+
+def _after(text):
+    """ Reduce the text after a code to the cases _colour cares about. """
+    if text[:1].isdigit():
+        return "0"
+    elif text[:1] == "," and text[1:2].isdigit():
+        return ",0"
+    return ""
+
+
+@functools.lru_cache(maxsize=1024)
+def _transition(have, want, after):
+    """
+    The shortest codes which change the formatting from have to want, where
+    after is "0" before a digit, ",0" before a comma and digit, else "".
+    """
+    (have_fg, have_bg, have_toggles), (fg, bg, toggles) = have, want
+    # Either toggle the differences...
+    codes = "".join(sorted(set(have_toggles) ^ set(toggles)))
+    if (have_fg, have_bg) != (fg, bg):
+        if bg is None and have_bg is not None:
+            # Only a bare colour code clears the background.
+            codes += "\x03"
+        codes += _colour(fg, bg if bg != have_bg else None, after)
+    # ... or reset and start over.
+    reset = "\x0f" + "".join(sorted(toggles)) + _colour(fg, bg, after)
+    return min(codes, reset, key=len)
+
+
+@functools.lru_cache(maxsize=4096)
+def colourise(line, colour):
+    """
+    Give a line of text a default colour, and minify its formatting codes.
+
+    Resets and bare colour codes return to the default colour. Codes are only
+    written where they change the formatting of the text that follows, so
+    runs of codes collapse and trailing codes are dropped.
+    """
+    if not _format_chars.search(line):
+        return _colour(colour, None, _after(line[:2])) + line
+
+    default = (colour, None, "")
+    have, want = (None, None, ""), default
+    output = []
+    position = 0
+    for match in _format_code.finditer(line + "\x0f"):
+        text = line[position:match.start()]
+        if text:
+            if want != have:
+                after = text[:2]
+                if after == ",":
+                    # Codes which change nothing are dropped, so the next
+                    # visible character may follow a lone comma.
+                    after += _format_code.sub("", line[match.end():])[:1]
+                after = _after(after)
+                output.append(_transition(have, want, after))
+                have = want
+            output.append(text)
+        position = match.end()
+
+        toggle, fg, bg = match.groups()
+        if toggle == "\x0f":
+            want = default
+        elif toggle:
+            toggles = want[2]
+            if toggle in toggles:
+                toggles = toggles.replace(toggle, "")
+            else:
+                toggles += toggle
+            want = (want[0], want[1], toggles)
+        elif fg is None and bg is None:
+            want = (colour, None, want[2])
+        else:
+            fg = colour if fg is None else int(fg)
+            bg = want[1] if bg is None else int(bg)
+            want = (fg, bg, want[2])
+    return "".join(output)
+
+
 def pretty_date(delta):
     """
     Get a datetime object or a int() Epoch timestamp and return a
@@ -199,7 +393,7 @@ def minify(data):
     # Step 3. Shorten colour codes.
     # If it has a background and is 2 digits starting with 0
     # the 0 is omitted.
-    data = re.sub(r"\x030(\d),", r"\x03\1,", data)
+    data = re.sub(r"\x030(\d),", "\x03\\1,", data)
     # If the character following is not a digit, and the adjacent code starts with 0
     # the 0 is omitted.
     data = re.sub(r"(\x03(?:\d?\d?,)?)0(\d[^\d])", r"\1\2", data)
@@ -353,6 +547,85 @@ class Buffer(object):
         self.buffer += data
         return data
 
+class LineFramer(object):
+    """
+    Splits a byte stream into decoded lines.
+
+    Data is read straight into a preallocated bytearray, and lines are decoded
+    from memoryview slices of it, so the pending tail is never copied per line.
+    The buffer is compacted only when it fills up, and grows if a single line
+    is larger than it.
+
+    Note: This object is not thread safe.
+    """
+
+    def __init__(self, encoding="utf-8", delim=b"\n", size=65536):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # Offset of the first unread byte
+        self.end = 0    # Offset past the last valid byte
+        self.encoding = encoding
+        self.delim = delim
+
+    def __iter__(self):
+        return self
+
+    def __len__(self):
+        """ The number of bytes received but not yet returned as lines. """
+        return self.end - self.start
+
+    def reserve(self):
+        """ Make room at the end of the buffer, and return a view of it. """
+        if self.end == len(self.buffer):
+            pending = self.end - self.start
+            if pending == len(self.buffer):
+                # A single line fills the buffer, so double it.
+                self.view.release()
+                self.buffer.extend(bytes(len(self.buffer)))
+                self.view = memoryview(self.buffer)
+            else:
+                self.view[:pending] = self.view[self.start:self.end]
+                self.start, self.end = 0, pending
+        return self.view[self.end:]
+
+    def recv_into(self, sock):
+        """
+        Read from a socket into the buffer. Returns the number of bytes read,
+        which is 0 when the connection has closed.
+        """
+        read = sock.recv_into(self.reserve())
+        self.end += read
+        return read
+
+    def append(self, data):
+        """ Copy data into the buffer. Returns the data, as Buffer does. """
+        view = memoryview(data)
+        while view:
+            free = self.reserve()
+            size = min(len(free), len(view))
+            free[:size] = view[:size]
+            free.release()
+            self.end += size
+            view = view[size:]
+        return data
+
+    def next(self):
+        index = self.buffer.find(self.delim, self.start, self.end)
+        if index == -1:
+            raise StopIteration
+        end = index
+        if end > self.start and self.buffer[end - 1] == 13:  # b"\r"
+            end -= 1
+        line = str(self.view[self.start:end], self.encoding, "replace")
+        self.start = index + len(self.delim)
+        if self.start == self.end:
+            self.start = self.end = 0
+        return line
+
+    def __next__(self):
+        return self.next()
+
+
 class LineReader(object):
     """
     Iterates over lines from a socket.
@@ -384,7 +657,7 @@ class LineReader(object):
         return self.next()
 
 
-class TimerBuffer(Buffer):
+class TimerBuffer(LineFramer):
     """
     Prints out the time between loop iterations.
     """